@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for event dispatch.
+
+Fires channel messages through an InfobarbClient with the default dispatch
+hooks and a handful of plugin hooks, once on a plain pangler and once on a
+compiled one, and prints messages per second for both.
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+import panglery
+
+from infobarb import dispatch, irc
+
+
+class _Bot(object):
+    """
+    The instance panglers are bound to, like a bot would be.
+    """
+    def __init__(self, pangler, plugins):
+        self.p = pangler.bind(self)
+        self.client = irc.InfobarbClient(self.p)
+        irc.addDefaultDispatchHooks(self.p)
+
+        f = irc.FancyInfobarbPangler(self.p)
+        for _ in range(plugins):
+            f.onChannelMessage(_hook)
+            f.onUserJoin(_hook)
+
+
+
+def _hook(*args, **kwargs):
+    pass
+
+
+
+def measure(pangler, messages, plugins):
+    """
+    Returns messages per second for a pangler.
+    """
+    bot = _Bot(pangler, plugins)
+    privmsg = bot.client.privmsg
+
+    def run():
+        for _ in range(messages):
+            privmsg("lvh!lvh@example.com", "#python", "hi")
+
+    elapsed = min(timeit.repeat(run, number=1, repeat=5))
+    return messages / elapsed
+
+
+
+def main(messages=20000, plugins=10):
+    before = measure(panglery.Pangler(), messages, plugins)
+    after = measure(dispatch.Pangler(), messages, plugins)
+
+    print("plain pangler:    %10.0f messages/s" % before)
+    print("compiled pangler: %10.0f messages/s" % after)
+    print("speedup:          %10.2fx" % (after / before))
+
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
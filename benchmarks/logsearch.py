@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Search latency of the channel log.
+
+Logs a number of synthetic channel messages, spread over a number of months,
+into a ``LogStore`` in a temporary directory, in batches like ``ChannelLog``
+commits them, then times searches for rare and common words, with and
+without a channel, and following pages.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import timeit
+
+from infobarb import channellog
+
+from traffic import _CHANNELS, _MESSAGES, _NICKS
+
+
+_WORDS = " ".join(_MESSAGES).split()
+MONTH = 31 * 24 * 60 * 60
+
+
+def fill(store, count, months, batch=500, seed=0):
+    rng = random.Random(seed)
+    start = 1370044800
+    step = months * MONTH / count
+    for first in range(0, count, batch):
+        def write():
+            for i in range(first, min(first + batch, count)):
+                nick = rng.choice(_NICKS)
+                words = rng.sample(_WORDS, 5) + ["needle%d" % (i % 1000,)]
+                store.append(start + i * step, "freenode",
+                             rng.choice(_CHANNELS), nick + "!u@example.com",
+                             " ".join(words))
+        store.transact(write)
+
+
+
+def measure(store, repeat, *args, **kwargs):
+    best = None
+    for _ in range(repeat):
+        started = timeit.default_timer()
+        page = store.search(*args, **kwargs)
+        elapsed = timeit.default_timer() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, page
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        store = channellog.LogStore(directory)
+        started = timeit.default_timer()
+        fill(store, args.messages, args.months)
+        indexing = timeit.default_timer() - started
+
+        results = {}
+        for name, query, kwargs in [
+                ("rare", "needle7", {}),
+                ("common", "deferred", {}),
+                ("commonInChannel", "deferred", {"channel": "#twisted"}),
+                ("allTerms", "deferred fires", {}),
+                ("missing", "nothing", {})]:
+            milliseconds, page = measure(store, args.repeat, query, **kwargs)
+            results[name] = milliseconds
+            if page.next is not None:
+                results[name + "NextPage"], _ = measure(
+                    store, args.repeat, query, before=page.next, **kwargs)
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print(json.dumps({
+        "messages": args.messages,
+        "months": args.months,
+        "messagesIndexedPerSecond": args.messages / indexing,
+        "searchMilliseconds": results,
+    }, indent=2, sort_keys=True))
+
+
+
+if __name__ == "__main__":
+    main()
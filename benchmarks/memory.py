@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Memory benchmark for long-running bots.
+
+Feeds sustained synthetic traffic through a client with a plugin that keeps
+the most recent channel messages around, like a history plugin would, and
+measures how much memory the retained events take with and without interning
+nicknames and channel names.
+"""
+from __future__ import division, print_function
+
+import json
+import sys
+from collections import deque
+
+from infobarb import dispatch, events
+
+from traffic import Bot, generateLines
+
+
+def _retainedBytes(history):
+    """
+    Sums the sizes of the distinct objects a history holds on to.
+    """
+    seen = {}
+    for kwargs in history:
+        seen[id(kwargs)] = sys.getsizeof(kwargs)
+        for value in kwargs.values():
+            seen[id(value)] = sys.getsizeof(value)
+    return sum(seen.values())
+
+
+
+def measure(lines, retained, interned):
+    bot = Bot(dispatch.Pangler(), subscribers=0)
+    if interned:
+        bot.client.internTable = events.InternTable()
+    else:
+        # A table that can never hold anything interns nothing.
+        bot.client.internTable = events.InternTable(maxSize=0)
+
+    history = deque(maxlen=retained)
+    bot.p.subscribe(lambda self, p, **kwargs: history.append(kwargs),
+                    event="channelMessageReceived",
+                    needs=["user", "channel", "message"])
+
+    for line in lines:
+        bot.client.lineReceived(line)
+
+    return _retainedBytes(history)
+
+
+
+def main(count=100000, retained=50000):
+    lines = generateLines(count, mix={"privmsg": 1})
+    before = measure(lines, retained, interned=False)
+    after = measure(lines, retained, interned=True)
+
+    print(json.dumps({
+        "lines": count,
+        "retainedEvents": retained,
+        "bytesWithoutInterning": before,
+        "bytesWithInterning": after,
+        "ratio": after / before,
+    }, indent=2, sort_keys=True))
+
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
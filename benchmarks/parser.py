@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Lines per second through InfobarbClient's fast path and the generic parser.
+
+Feeds the same synthetic or recorded lines through ``lineReceived`` of a bot
+with the default dispatch hooks and no other subscribers, once as usual and
+once forced through ``IRCClient.lineReceived``, and prints lines per second
+for both.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import sys
+import timeit
+
+from infobarb import dispatch, irc
+
+from traffic import Bot, generateLines, readLines
+
+
+def measure(lineReceived, lines, repeat):
+    bot = Bot(dispatch.Pangler(), subscribers=0)
+    client = bot.client
+    best = None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        for line in lines:
+            lineReceived(client, line)
+        elapsed = timeit.default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+        bot.transport.clear()
+    return len(lines) / best
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=20000,
+                        help="number of synthetic lines to generate")
+    parser.add_argument("--recorded", metavar="PATH",
+                        help="read raw IRC lines from PATH instead")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.recorded:
+        lines = readLines(args.recorded)
+    else:
+        lines = generateLines(args.lines)
+
+    fast = measure(irc.InfobarbClient.lineReceived, lines, args.repeat)
+    generic = measure(irc.irc.IRCClient.lineReceived, lines, args.repeat)
+    print(json.dumps({
+        "lines": len(lines),
+        "fastLinesPerSecond": fast,
+        "genericLinesPerSecond": generic,
+        "speedup": fast / generic,
+    }, indent=2, sort_keys=True))
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Throughput benchmark replaying a recorded event log.
+
+Replays a log written by ``infobarb.recording`` through a bot with the
+default dispatch hooks and FancyInfobarbPangler subscribers, as fast as
+possible, and prints events per second. Without a log, one is recorded from
+synthetic traffic first.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from infobarb import dispatch, recording
+
+from traffic import Bot, generateLines
+
+
+def record(path, lines):
+    bot = Bot(dispatch.Pangler(), subscribers=0)
+    log = recording.EventLog(path)
+    recording.attach(bot.client, log)
+    for line in lines:
+        bot.client.lineReceived(line)
+    log.close()
+
+
+
+def measure(path, subscribers, repeat):
+    bot = Bot(dispatch.Pangler(), subscribers)
+    best, count = None, 0
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        d = recording.replay(path, bot.p)
+        elapsed = timeit.default_timer() - start
+        count = d.result
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--log", metavar="PATH",
+                        help="replay the event log at PATH")
+    parser.add_argument("--lines", type=int, default=20000,
+                        help="synthetic lines to record without --log")
+    parser.add_argument("--subscribers", type=int, default=10,
+                        help="FancyInfobarbPangler subscribers per shortcut")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    directory = None
+    path = args.log
+    if path is None:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "events.log")
+        record(path, generateLines(args.lines))
+
+    try:
+        count, elapsed = measure(path, args.subscribers, args.repeat)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+
+    print(json.dumps({
+        "events": count,
+        "subscribers": args.subscribers,
+        "eventsPerSecond": count / elapsed,
+    }, indent=2, sort_keys=True))
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
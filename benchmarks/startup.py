@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Startup benchmark with many plugins installed.
+
+Generates plugin modules in a temporary directory, then starts fresh Python
+processes that set up a bot and register with a fake IRC server, loading
+the plugins either up front or lazily from a manifest. Prints the median
+time from process start to registration for both, in milliseconds.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+_PLUGIN = '''
+import decimal
+import difflib
+import xml.dom.minidom
+
+from infobarb import irc
+
+
+def setup(p):
+    f = irc.FancyInfobarbPangler(p)
+    f.onChannelMessage(onMessage, prefix="!plugin%(index)d")
+    f.onUserJoin(onJoin)
+
+'''
+
+_PLUGIN_FUNCTION = '''
+def helper%(index)d(value):
+    words = [word.strip(".,") for word in value.split() if word]
+    return " ".join(sorted(set(words), key=len)[:%(index)d + 1])
+'''
+
+_PLUGIN_HOOKS = '''
+def onMessage(self, p, user, channel, message):
+    pass
+
+
+def onJoin(self, p, user, channel):
+    pass
+'''
+
+_CHILD = '''
+import sys
+sys.path[:0] = [%(directory)r, %(root)r]
+
+from twisted.internet.testing import StringTransport
+
+from infobarb import dispatch, irc, manifest, plugins
+
+p = dispatch.Pangler()
+manager = plugins.PluginManager(p)
+if %(lazy)r:
+    manifest.loadLazily(manager, manifest.read(%(manifest)r))
+else:
+    for name in %(names)r:
+        manager.load(name)
+
+client = irc.InfobarbClient(p.share(None))
+transport = StringTransport()
+client.makeConnection(transport)
+assert b"NICK" in transport.value()
+'''
+
+
+def writePlugins(directory, count, functions):
+    """
+    Writes plugin modules, and a manifest for them.
+
+    Returns the plugin names and the manifest's path.
+    """
+    names = []
+    for index in range(count):
+        name = "startupplugin%d" % (index,)
+        source = [_PLUGIN % {"index": index}]
+        source.extend(_PLUGIN_FUNCTION % {"index": i}
+                      for i in range(functions))
+        source.append(_PLUGIN_HOOKS)
+
+        with open(os.path.join(directory, name + ".py"), "w") as f:
+            f.write("".join(source))
+        names.append(name)
+
+    # Introspect every plugin once, the way the first run of a bot would.
+    sys.path.insert(0, directory)
+    from infobarb import manifest
+    path = os.path.join(directory, "manifest.json")
+    manifest.write(path, dict((name, manifest.introspect(name))
+                              for name in names))
+    return names, path
+
+
+
+def measure(directory, names, manifestPath, lazy, runs):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    child = _CHILD % {
+        "directory": directory,
+        "root": root,
+        "lazy": lazy,
+        "manifest": manifestPath,
+        "names": names,
+    }
+
+    timings = []
+    for _ in range(runs):
+        started = time.time()
+        subprocess.check_call([sys.executable, "-c", child])
+        timings.append((time.time() - started) * 1000)
+
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--plugins", type=int, default=40,
+                        help="number of plugins to generate")
+    parser.add_argument("--functions", type=int, default=200,
+                        help="functions per plugin module")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="processes to start per mode")
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        names, manifestPath = writePlugins(directory, args.plugins,
+                                           args.functions)
+        eager = measure(directory, names, manifestPath, False, args.runs)
+        lazy = measure(directory, names, manifestPath, True, args.runs)
+    finally:
+        shutil.rmtree(directory)
+
+    print(json.dumps({
+        "plugins": args.plugins,
+        "eagerMilliseconds": round(eager, 1),
+        "lazyMilliseconds": round(lazy, 1),
+    }, indent=2, sort_keys=True))
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
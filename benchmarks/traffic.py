@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+Benchmark InfobarbClient against synthetic or recorded IRC traffic.
+
+Raw IRC lines are fed through ``IRCClient.lineReceived`` of a client that is
+connected to an in-memory transport. The client's pangler has the default
+dispatch hooks and a configurable number of FancyInfobarbPangler subscribers.
+
+Results are written as JSON, so runs can be compared between releases.
+"""
+from __future__ import division, print_function
+
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import timeit
+
+import panglery
+
+from twisted.internet.testing import StringTransport
+
+from infobarb import dispatch, irc
+
+try:
+    import tracemalloc
+except ImportError: # Python 2, without the pytracemalloc backport
+    tracemalloc = None
+
+
+NICKNAME = "infobarb"
+
+_NICKS = ["lvh", "habnabit", "dash", "exarkun", "radix", "glyph", "teratorn"]
+_CHANNELS = ["#python", "#twisted", "#infobarb"]
+_MESSAGES = [
+    "hi",
+    "!help paste",
+    "does anyone know why my deferred never fires?",
+    "http://example.com/some/rather/long/path?with=a&query=string",
+]
+
+_TEMPLATES = {
+    "privmsg": ":{nick}!{nick}@example.com PRIVMSG {channel} :{message}",
+    "notice": ":{nick}!{nick}@example.com NOTICE {channel} :{message}",
+    "join": ":{nick}!{nick}@example.com JOIN {channel}",
+    "part": ":{nick}!{nick}@example.com PART {channel} :{message}",
+    "quit": ":{nick}!{nick}@example.com QUIT :{message}",
+    "kick": ":{nick}!{nick}@example.com KICK {channel} {other} :{message}",
+}
+
+DEFAULT_MIX = {
+    "privmsg": 80,
+    "notice": 5,
+    "join": 6,
+    "part": 3,
+    "quit": 3,
+    "kick": 3,
+}
+
+
+def generateLines(count, mix=DEFAULT_MIX, seed=0):
+    """
+    Generates raw IRC lines.
+
+    ``mix`` maps message types to relative weights.
+    """
+    rng = random.Random(seed)
+    kinds = sorted(mix)
+    weights = [mix[kind] for kind in kinds]
+    total = sum(weights)
+
+    lines = []
+    for _ in range(count):
+        pick = rng.uniform(0, total)
+        for kind, weight in zip(kinds, weights):
+            pick -= weight
+            if pick <= 0:
+                break
+
+        line = _TEMPLATES[kind].format(nick=rng.choice(_NICKS),
+                                       other=rng.choice(_NICKS),
+                                       channel=rng.choice(_CHANNELS),
+                                       message=rng.choice(_MESSAGES))
+        lines.append(line.encode("utf-8"))
+
+    return lines
+
+
+
+def readLines(path):
+    """
+    Reads recorded raw IRC lines from a file, one per line.
+    """
+    with open(path, "rb") as f:
+        return [line.rstrip(b"\r\n") for line in f if line.strip()]
+
+
+
+def _hook(*args, **kwargs):
+    pass
+
+
+
+class Bot(object):
+    """
+    A connected client with hooks attached.
+    """
+    def __init__(self, pangler, subscribers):
+        self.p = pangler.bind(self)
+        irc.addDefaultDispatchHooks(self.p)
+
+        f = irc.FancyInfobarbPangler(self.p)
+        shortcuts = [info["name"] for info in f._shortcuts.values()]
+        for _ in range(subscribers):
+            for name in shortcuts:
+                getattr(f, name)(_hook)
+
+        self.client = irc.InfobarbClient(self.p)
+        self.client.nickname = NICKNAME
+        self.transport = StringTransport()
+        self.client.makeConnection(self.transport)
+
+
+
+def _percentile(sortedSamples, fraction):
+    index = int(round(fraction * (len(sortedSamples) - 1)))
+    return sortedSamples[index]
+
+
+
+def run(lines, subscribers=10, compiled=True, repeat=3, allocationLines=500):
+    """
+    Runs the benchmark and returns the results as a dict.
+    """
+    makePangler = dispatch.Pangler if compiled else panglery.Pangler
+    bot = Bot(makePangler(), subscribers)
+    lineReceived = bot.client.lineReceived
+    timer = timeit.default_timer
+
+    gc.collect()
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        for line in lines:
+            lineReceived(line)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+        bot.transport.clear()
+
+    latencies = []
+    for line in lines:
+        start = timer()
+        lineReceived(line)
+        latencies.append(timer() - start)
+    latencies.sort()
+
+    results = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "pangler": "compiled" if compiled else "plain",
+        "subscribers": subscribers,
+        "lines": len(lines),
+        "linesPerSecond": len(lines) / best,
+        "p50LatencyMicroseconds": _percentile(latencies, 0.50) * 1e6,
+        "p99LatencyMicroseconds": _percentile(latencies, 0.99) * 1e6,
+        "objectsRetainedPerLine": _objectsRetained(bot,
+                                                   lines[:allocationLines]),
+        "peakBytesPerLine": None,
+    }
+    # A fresh bot, so tracing does not see the hooks warming up twice.
+    bot = Bot(makePangler(), subscribers)
+    results["peakBytesPerLine"] = _peakBytes(bot, lines[:allocationLines])
+    return results
+
+
+
+def _objectsRetained(bot, lines):
+    """
+    Measures how many objects each line leaves behind, on average, once the
+    bot has warmed up.
+
+    This counts the objects the garbage collector tracks: containers and
+    instances, but not strings or numbers. It works on every Python.
+    """
+    lineReceived = bot.client.lineReceived
+    gc.collect()
+    before = len(gc.get_objects())
+    for line in lines:
+        lineReceived(line)
+    gc.collect()
+    return (len(gc.get_objects()) - before) / len(lines)
+
+
+
+def _peakBytes(bot, lines):
+    """
+    Measures the high-water mark of the memory each line allocates, on
+    average, where tracemalloc is available; otherwise returns None.
+
+    Most of what a line allocates is freed before the next line comes in,
+    so this is the memory a line needs, not what is left over afterwards.
+    """
+    if tracemalloc is None:
+        return None
+
+    lineReceived = bot.client.lineReceived
+    tracemalloc.start()
+    try:
+        totalBytes = 0
+        for line in lines:
+            # Forgets earlier blocks and resets the peak, so what's traced
+            # from here on is this line's.
+            tracemalloc.clear_traces()
+            lineReceived(line)
+            _, peak = tracemalloc.get_traced_memory()
+            totalBytes += peak
+    finally:
+        tracemalloc.stop()
+
+    return totalBytes / len(lines)
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=20000,
+                        help="number of synthetic lines to generate")
+    parser.add_argument("--recorded", metavar="PATH",
+                        help="read raw IRC lines from PATH instead")
+    parser.add_argument("--subscribers", type=int, default=10,
+                        help="FancyInfobarbPangler subscribers per shortcut")
+    parser.add_argument("--plain", action="store_true",
+                        help="use a plain panglery pangler")
+    parser.add_argument("--allocation-lines", type=int, default=500,
+                        help="lines to measure memory use with")
+    parser.add_argument("--output", metavar="PATH",
+                        help="write JSON to PATH instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.recorded:
+        lines = readLines(args.recorded)
+    else:
+        lines = generateLines(args.lines)
+
+    results = run(lines, args.subscribers, compiled=not args.plain,
+                  allocationLines=args.allocation_lines)
+
+    encoded = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(encoded + "\n")
+    else:
+        print(encoded)
+
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,303 @@
+"""
+Running hooks off the reactor.
+
+Hooks normally run to completion inside ``p.trigger``, so a slow one holds up
+every other event, including keepalives. Hooks wrapped here hand their work to
+a thread pool, or return a Deferred, and the pangler carries on immediately.
+
+Work that has to stay on the reactor, but can be done in small steps, can be
+written as a generator and run cooperatively instead: a step at a time, in
+between everything else the reactor does.
+"""
+import timeit
+
+from collections import deque
+
+from twisted.internet import defer, task, threads
+from twisted.python import log
+
+
+class OffReactorHook(object):
+    """
+    A hook that does its work off the reactor.
+
+    With a thread pool, the wrapped callable runs in that pool. It must not
+    touch the pangler or the client directly from there; use
+    ``reactor.callFromThread``. Without one, the wrapped callable is expected
+    to return a Deferred, for example from an ``inlineCallbacks`` function.
+
+    At most ``concurrency`` calls are in flight at once. Up to ``queueDepth``
+    more wait their turn; events beyond that are dropped and counted in
+    ``dropped``.
+
+    Off-reactor hooks can't modify events, since they finish after the event
+    has been dispatched.
+    """
+    def __init__(self, func, threadpool=None, concurrency=1, queueDepth=100,
+                 reactor=None):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        self.func = func
+        self.threadpool = threadpool
+        self.concurrency = concurrency
+        self.queueDepth = queueDepth
+        self.reactor = reactor
+
+        self.running = 0
+        self.dropped = 0
+        self._queue = deque()
+
+
+    def __repr__(self):
+        return "<%s for %r>" % (self.__class__.__name__, self.func)
+
+
+    @property
+    def pending(self):
+        """
+        The number of calls waiting for a free slot.
+        """
+        return len(self._queue)
+
+
+    def __call__(self, *args, **kwargs):
+        if self.running < self.concurrency:
+            self._start(args, kwargs)
+        elif len(self._queue) < self.queueDepth:
+            self._queue.append((args, kwargs))
+        else:
+            self.dropped += 1
+
+
+    def _start(self, args, kwargs):
+        self.running += 1
+
+        if self.threadpool is not None:
+            d = threads.deferToThreadPool(self._getReactor(), self.threadpool,
+                                          self.func, *args, **kwargs)
+        else:
+            d = defer.maybeDeferred(self.func, *args, **kwargs)
+
+        d.addErrback(log.err, "Unhandled error in off-reactor hook %r" % self)
+        d.addBoth(self._finished)
+
+
+    def _finished(self, _):
+        self.running -= 1
+        if self._queue:
+            args, kwargs = self._queue.popleft()
+            self._start(args, kwargs)
+
+
+    def _getReactor(self):
+        if self.reactor is None:
+            from twisted.internet import reactor
+            self.reactor = reactor
+        return self.reactor
+
+
+
+def offReactor(threadpool=None, concurrency=1, queueDepth=100, reactor=None):
+    """
+    A decorator that makes a hook run off the reactor.
+
+    Apply it below the subscribing decorator::
+
+        @f.onChannelMessage
+        @offReactor(pool, concurrency=4)
+        def fetchTitle(self, p, user, channel, message):
+            ...
+
+    See ``OffReactorHook`` for the arguments.
+    """
+    def decorator(func):
+        return OffReactorHook(func, threadpool, concurrency, queueDepth,
+                              reactor)
+
+    return decorator
+
+
+
+class CooperativeWork(object):
+    """
+    Runs iterators a step at a time, in between everything else the reactor
+    does.
+
+    Every step is one ``next()`` call, so jobs should do a small, bounded
+    amount of work per step. Each reactor tick spends up to ``budget``
+    seconds on steps, across all jobs, then leaves the reactor alone for
+    ``interval`` seconds. Jobs are grouped by owner, usually a plugin's
+    name, and owners take turns, so a plugin with many jobs can't starve one
+    with a few. A step that yields a Deferred pauses its owner's jobs until
+    the Deferred fires.
+    """
+    timer = staticmethod(timeit.default_timer)
+
+    def __init__(self, budget=0.01, interval=0.0001, reactor=None):
+        self.budget = budget
+        self.interval = interval
+        self.reactor = reactor
+
+        self._cooperator = task.Cooperator(
+            terminationPredicateFactory=self._deadline,
+            scheduler=self._schedule)
+        # Owner -> deque of (iterator, Deferred) for its jobs.
+        self._owners = {}
+        self._stopped = False
+
+
+    def _deadline(self):
+        deadline = self.timer() + self.budget
+        return lambda: self.timer() >= deadline
+
+
+    def _schedule(self, f):
+        return self._getReactor().callLater(self.interval, f)
+
+
+    def _getReactor(self):
+        if self.reactor is None:
+            from twisted.internet import reactor
+            self.reactor = reactor
+        return self.reactor
+
+
+    @property
+    def pending(self):
+        """
+        The number of unfinished jobs.
+        """
+        return sum(len(jobs) for jobs in self._owners.values())
+
+
+    def cooperate(self, iterable, owner=None):
+        """
+        Starts a job.
+
+        Returns a Deferred that fires with the iterator once it is
+        exhausted, or fails with whatever it raised. Once the work has been
+        stopped, it fails right away with ``SchedulerStopped``.
+        """
+        if self._stopped:
+            return defer.fail(task.SchedulerStopped())
+
+        d = defer.Deferred()
+        jobs = self._owners.get(owner)
+        if jobs is None:
+            jobs = self._owners[owner] = deque()
+            jobs.append((iter(iterable), d))
+            self._cooperator.cooperate(self._turns(owner, jobs))
+        else:
+            jobs.append((iter(iterable), d))
+        return d
+
+
+    def _turns(self, owner, jobs):
+        """
+        Takes a step of each of an owner's jobs in turn.
+        """
+        while jobs:
+            iterator, d = jobs[0]
+            try:
+                result = next(iterator)
+            except StopIteration:
+                jobs.popleft()
+                d.callback(iterator)
+                continue
+            except:
+                jobs.popleft()
+                d.errback()
+                continue
+
+            jobs.rotate(-1)
+            if isinstance(result, defer.Deferred):
+                result.addErrback(log.err, "Error in cooperative job for %r"
+                                  % (owner,))
+                yield result
+            else:
+                yield None
+
+        del self._owners[owner]
+
+
+    def stop(self):
+        """
+        Stops all jobs, for good. Their Deferreds fail with
+        ``SchedulerStopped``, and so do those of jobs started afterwards.
+        """
+        self._stopped = True
+        self._cooperator.stop()
+        owners, self._owners = self._owners, {}
+        for jobs in owners.values():
+            for _, d in jobs:
+                d.errback(task.SchedulerStopped())
+
+
+
+_defaultWork = None
+
+
+def cooperate(iterable, owner=None):
+    """
+    Starts a job in the shared ``CooperativeWork``.
+    """
+    global _defaultWork
+    if _defaultWork is None:
+        _defaultWork = CooperativeWork()
+    return _defaultWork.cooperate(iterable, owner)
+
+
+
+class CooperativeHook(object):
+    """
+    A hook that returns an iterable, which is run cooperatively.
+
+    The job's owner is ``owner``, or else the module the hook was defined
+    in, which for plugins is the plugin's name. Errors are logged.
+    Cooperative hooks can't modify events.
+    """
+    def __init__(self, func, work=None, owner=None):
+        self.func = func
+        self.work = work
+        if owner is None:
+            owner = getattr(func, "__module__", None)
+        self.owner = owner
+
+
+    def __repr__(self):
+        return "<%s for %r>" % (self.__class__.__name__, self.func)
+
+
+    def __call__(self, *args, **kwargs):
+        job = self.func(*args, **kwargs)
+        if job is None:
+            return
+
+        if self.work is None:
+            d = cooperate(job, self.owner)
+        else:
+            d = self.work.cooperate(job, self.owner)
+        d.addErrback(log.err, "Unhandled error in cooperative hook %r" % self)
+
+
+
+def cooperative(work=None, owner=None):
+    """
+    A decorator that runs the generator a hook returns cooperatively.
+
+    Apply it below the subscribing decorator::
+
+        @f.onUserJoin
+        @cooperative()
+        def reindex(self, p, user, channel):
+            for nick in self.client.channelState.members(channel):
+                index(nick)
+                yield
+
+    See ``CooperativeHook`` and ``CooperativeWork``.
+    """
+    def decorator(func):
+        return CooperativeHook(func, work, owner)
+
+    return decorator
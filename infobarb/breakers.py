@@ -0,0 +1,255 @@
+"""
+Circuit breakers and rate limits for hooks.
+
+Without them, a hook that raises on every message, or suddenly takes half a
+second per call, is still called for every event it matches, and drags the
+whole bot down with it. ``CircuitBreakers`` are switched on per compiled
+pangler with ``Pangler.protect``, and then watch every subscription:
+
+ * when too many of a hook's recent calls raise or are slow, its circuit
+   opens, and the hook is skipped for a cool-down period. The first call
+   after that is a trial: if it goes well the circuit closes again, and if
+   it doesn't the circuit stays open for another cool-down period;
+ * hooks can be capped to a number of calls per second, by owner (like a
+   plugin's name) or by the hook's callable. Calls over the cap are
+   skipped.
+
+Exceptions from protected hooks are logged instead of propagated, so hooks
+after a failing one still see the event. Circuits opening and closing are
+fired as ``circuitOpened`` and ``circuitClosed`` events, with ``ARGS``.
+"""
+import weakref
+
+from collections import deque
+
+from twisted.python import log
+
+from infobarb import stats
+
+
+ARGS = ("hook", "owner", "reason")
+
+ERRORS = "errors"
+SLOW = "slow calls"
+RECOVERED = "recovered"
+
+
+class _Circuit(object):
+    __slots__ = ("name", "func", "owner", "outcomes", "failures", "openUntil",
+                 "rate", "burst", "tokens", "refilled", "skipped", "calls")
+
+    def __init__(self, func, owner, window):
+        self.name = stats.hookName(func)
+        self.func = func
+        self.owner = owner
+        self.outcomes = deque(maxlen=window)
+        self.failures = 0
+        self.openUntil = None
+
+        self.rate = None
+        self.burst = None
+        self.tokens = None
+        self.refilled = None
+
+        self.skipped = 0
+        self.calls = 0
+
+
+    def limit(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.refilled = now
+
+
+    def take(self, now):
+        """
+        Takes a call from the token bucket, if there's one left.
+        """
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+
+def _hookKey(func):
+    """
+    Identifies a hook's callable. Bound methods are made anew every time
+    they're looked up, so they're identified by their instance and function.
+    """
+    instance = getattr(func, "__self__", None)
+    function = getattr(func, "__func__", None)
+    if instance is not None and function is not None:
+        return id(instance), id(function)
+    return id(func)
+
+
+
+class CircuitBreakers(object):
+    """
+    Watches hooks, and skips the ones that misbehave.
+
+    A circuit opens once at least ``minCalls`` of a hook's last ``window``
+    calls were made, and at least ``failureRate`` of them raised or took
+    longer than ``slowCall`` seconds. It stays open for ``coolDown``
+    seconds.
+    """
+    def __init__(self, window=20, minCalls=10, failureRate=0.5,
+                 slowCall=0.25, coolDown=60.0, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+
+        self.window = window
+        self.minCalls = minCalls
+        self.failureRate = failureRate
+        self.slowCall = slowCall
+        self.coolDown = coolDown
+
+        self._circuits = weakref.WeakKeyDictionary()
+        # Owner -> (calls per second, burst).
+        self._limits = {}
+        # _hookKey(callable) -> (callable, calls per second, burst). Holding
+        # on to the callable keeps its key from being reused.
+        self._hookLimits = {}
+
+
+    def limit(self, target, rate, burst=None):
+        """
+        Caps hooks to ``rate`` calls per second, with bursts of up to
+        ``burst`` calls (by default, one second's worth).
+
+        ``target`` is either the owner of the hooks, like a plugin's name, or
+        the callable a hook was subscribed with. Passing None as the rate
+        removes the cap.
+        """
+        if isinstance(target, basestring):
+            limits, key = self._limits, target
+            value = None if rate is None else (rate, max(burst or rate, 1))
+        else:
+            limits, key = self._hookLimits, _hookKey(target)
+            value = None if rate is None else (target, rate,
+                                               max(burst or rate, 1))
+
+        if value is None:
+            limits.pop(key, None)
+        else:
+            limits[key] = value
+
+        now = self.clock.seconds()
+        for circuit in self._circuits.values():
+            if target == circuit.owner or key == _hookKey(circuit.func):
+                self._applyLimit(circuit, now)
+
+
+    def _applyLimit(self, circuit, now):
+        limit = self._limits.get(circuit.owner)
+        if limit is None:
+            hookLimit = self._hookLimits.get(_hookKey(circuit.func))
+            if hookLimit is not None:
+                limit = hookLimit[1:]
+
+        if limit is None:
+            circuit.rate = None
+        else:
+            circuit.limit(limit[0], limit[1], now)
+
+
+    def _circuitFor(self, hook):
+        circuit = self._circuits.get(hook)
+        if circuit is None:
+            circuit = _Circuit(hook.func, getattr(hook, "owner", None),
+                               self.window)
+            self._applyLimit(circuit, self.clock.seconds())
+            self._circuits[hook] = circuit
+        return circuit
+
+
+    def wrap(self, eventName, hook, func):
+        """
+        Wraps a hook's callable so its calls for an event are watched.
+        """
+        circuit = self._circuitFor(hook)
+        clock = self.clock
+
+        def protected(*args, **kwargs):
+            now = clock.seconds()
+            if circuit.openUntil is not None and now < circuit.openUntil:
+                circuit.skipped += 1
+                return None
+            if circuit.rate is not None and not circuit.take(now):
+                circuit.skipped += 1
+                return None
+
+            circuit.calls += 1
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                log.err(None, "Error in hook %s on %s"
+                        % (circuit.name, eventName))
+                # The pangler is always the last positional argument.
+                self._record(circuit, args[-1], ERRORS)
+                return None
+
+            failure = None
+            if clock.seconds() - now > self.slowCall:
+                failure = SLOW
+            self._record(circuit, args[-1], failure)
+            return result
+
+        return protected
+
+
+    def _record(self, circuit, pangler, failure):
+        now = self.clock.seconds()
+
+        if circuit.openUntil is not None:
+            # That was the trial call.
+            if failure is not None:
+                circuit.openUntil = now + self.coolDown
+                return
+
+            circuit.openUntil = None
+            circuit.outcomes.clear()
+            circuit.failures = 0
+            pangler.trigger(event="circuitClosed", hook=circuit.name,
+                            owner=circuit.owner, reason=RECOVERED)
+            return
+
+        outcomes = circuit.outcomes
+        if len(outcomes) == outcomes.maxlen and outcomes[0]:
+            circuit.failures -= 1
+        outcomes.append(failure is not None)
+        if failure is None:
+            return
+
+        circuit.failures += 1
+        if (len(outcomes) >= self.minCalls
+                and circuit.failures >= self.failureRate * len(outcomes)):
+            circuit.openUntil = now + self.coolDown
+            log.msg("circuit for hook %s opened: %s" % (circuit.name,
+                                                        failure))
+            pangler.trigger(event="circuitOpened", hook=circuit.name,
+                            owner=circuit.owner, reason=failure)
+
+
+    def snapshot(self):
+        """
+        Returns the state of every watched hook.
+
+        Each entry is a dict with ``hook``, ``owner``, ``open``, ``calls``,
+        ``failures`` (among recent calls) and ``skipped`` keys.
+        """
+        now = self.clock.seconds()
+        return [{
+            "hook": circuit.name,
+            "owner": circuit.owner,
+            "open": circuit.openUntil is not None and now < circuit.openUntil,
+            "calls": circuit.calls,
+            "failures": circuit.failures,
+            "skipped": circuit.skipped,
+        } for circuit in self._circuits.values()]
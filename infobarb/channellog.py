@@ -0,0 +1,334 @@
+"""
+A searchable log of channel messages.
+
+A ``ChannelLog`` appends every channel message to SQLite databases, in
+batches, through a ``infobarb.persistence.WriteBehind``. Messages are
+indexed with FTS5 as they are written, so searching months of messages
+doesn't mean scanning them.
+
+The log is partitioned by time: each month (by default) gets a database
+file of its own in the log's directory, named after the month, like
+``2013-06.sqlite``. Old partitions can be archived by moving their files
+elsewhere, and the rest of the log doesn't need to be touched.
+
+Writes and searches run one at a time, on a thread of their own, so the
+reactor never waits on SQLite. Searches see every message logged before them.
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+from collections import namedtuple
+
+from twisted.application import service
+
+from infobarb import persistence
+
+
+Message = namedtuple("Message", "time network channel user message")
+
+# A page of search results, newest first. ``next`` is the ``before`` to
+# pass to get the page after it, or None if this is the last page.
+Page = namedtuple("Page", "messages next")
+
+SUFFIX = ".sqlite"
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        time REAL NOT NULL,
+        network TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        nick TEXT NOT NULL,
+        user TEXT NOT NULL,
+        message TEXT NOT NULL)
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messagesIndex USING fts5(
+        message, content='messages', content_rowid='id')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messagesIndexed AFTER INSERT ON messages
+    BEGIN
+        INSERT INTO messagesIndex (rowid, message)
+        VALUES (new.id, new.message);
+    END
+    """,
+]
+
+_SEARCH = """
+    SELECT messages.id, time, network, channel, user, messages.message
+    FROM messagesIndex JOIN messages ON messages.id = messagesIndex.rowid
+    WHERE messagesIndex MATCH ? AND messagesIndex.rowid < ? %s
+    ORDER BY messagesIndex.rowid DESC
+    LIMIT ?
+"""
+
+
+def _text(value):
+    """
+    Decodes what IRC gives us, which may not be valid UTF-8.
+    """
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+
+def matchExpression(text):
+    """
+    Turns search terms into an FTS5 query for messages with all of them.
+
+    Terms are quoted, so nothing anyone types is taken as query syntax.
+    """
+    return " ".join('"%s"' % (term.replace('"', '""'),)
+                    for term in _text(text).split())
+
+
+
+class LogStore(object):
+    """
+    The partitions of a channel log, in ``directory``.
+
+    Partitions are named by formatting a message's UTC time with
+    ``partitionFormat``; names must sort in time order. A store is only
+    used by one thread at a time, and is compatible with
+    ``persistence.WriteBehind``.
+    """
+    def __init__(self, directory, partitionFormat="%Y-%m"):
+        self.directory = directory
+        self.partitionFormat = partitionFormat
+        self._connections = {}
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+
+    def partitionFor(self, when):
+        return time.strftime(self.partitionFormat, time.gmtime(when))
+
+
+    def partitions(self):
+        """
+        Returns the names of all partitions, oldest first.
+        """
+        return sorted(name[:-len(SUFFIX)]
+                      for name in os.listdir(self.directory)
+                      if name.endswith(SUFFIX))
+
+
+    def _pathFor(self, partition):
+        return os.path.join(self.directory, partition + SUFFIX)
+
+
+    def _connect(self, partition):
+        connection = self._connections.get(partition)
+        if connection is None:
+            connection = sqlite3.connect(self._pathFor(partition),
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+            self._connections[partition] = connection
+        return connection
+
+
+    def transact(self, f, *args, **kwargs):
+        """
+        Calls ``f``, and commits what it wrote to every partition at once,
+        or none of it if it fails.
+        """
+        try:
+            result = f(*args, **kwargs)
+        except Exception:
+            for connection in self._connections.values():
+                connection.rollback()
+            raise
+
+        for connection in self._connections.values():
+            connection.commit()
+        return result
+
+
+    def append(self, when, network, channel, user, message):
+        nick = user.split("!", 1)[0].lower()
+        self._connect(self.partitionFor(when)).execute(
+            "INSERT INTO messages (time, network, channel, nick, user, "
+            "message) VALUES (?, ?, ?, ?, ?, ?)",
+            (when, _text(network), _text(channel).lower(), _text(nick),
+             _text(user), _text(message)))
+
+
+    def search(self, text, network=None, channel=None, nick=None, limit=20,
+               before=None):
+        """
+        Finds messages with all of the terms in ``text``, newest first.
+
+        Returns a ``Page`` of at most ``limit`` messages.
+        """
+        match = matchExpression(text)
+        if not match:
+            return Page([], None)
+
+        conditions, filters = [], []
+        for column, value in [("network", network),
+                              ("channel", channel and channel.lower()),
+                              ("nick", nick and nick.lower())]:
+            if value is not None:
+                conditions.append("AND %s = ?" % (column,))
+                filters.append(_text(value))
+        query = _SEARCH % (" ".join(conditions),)
+
+        partitions = self.partitions()
+        if before is not None:
+            partitions = [partition for partition in partitions
+                          if partition <= before[0]]
+
+        found = []
+        for partition in reversed(partitions):
+            below = sys.maxint
+            if before is not None and partition == before[0]:
+                below = before[1]
+
+            rows = self._connect(partition).execute(
+                query, [match, below] + filters + [limit + 1 - len(found)])
+            found.extend((partition, row) for row in rows)
+            if len(found) > limit:
+                break
+
+        page = [Message(*row[1:]) for _, row in found[:limit]]
+        if len(found) > limit:
+            partition, row = found[limit - 1]
+            return Page(page, (partition, row[0]))
+        return Page(page, None)
+
+
+    def detach(self, partition):
+        """
+        Closes a partition, so that its file can be moved.
+        """
+        connection = self._connections.pop(partition, None)
+        if connection is not None:
+            connection.close()
+
+
+    def archive(self, before, destination):
+        """
+        Moves partitions older than the one for ``before`` to
+        ``destination``.
+
+        Returns the names of the partitions that were moved.
+        """
+        if not os.path.isdir(destination):
+            os.makedirs(destination)
+
+        current = self.partitionFor(before)
+        moved = []
+        for partition in self.partitions():
+            if partition >= current:
+                break
+            self.detach(partition)
+            path = self._pathFor(partition)
+            for suffix in ["", "-wal", "-shm"]:
+                if os.path.exists(path + suffix):
+                    shutil.move(path + suffix, destination)
+            moved.append(partition)
+        return moved
+
+
+    def close(self):
+        for partition in list(self._connections):
+            self.detach(partition)
+
+
+
+class ChannelLog(service.Service):
+    """
+    Logs channel messages, and searches them, without blocking the reactor.
+
+    Messages are committed in batches of up to ``maxPending``, or
+    ``interval`` seconds after they come in. ``hook`` logs
+    ``channelMessageReceived`` events; ``subscribe`` subscribes it. The log
+    uses its own thread, unless it's given a ``threadpool`` with one.
+    """
+    def __init__(self, directory, partitionFormat="%Y-%m", threadpool=None,
+                 reactor=None, maxPending=500, interval=1.0):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.store = LogStore(directory, partitionFormat)
+        self.writer = persistence.WriteBehind(self.store, threadpool,
+                                              reactor, maxPending, interval)
+
+
+    def subscribe(self, pangler):
+        """
+        Logs channel messages ``pangler`` gets.
+        """
+        pangler.subscribe(self.hook, event="channelMessageReceived",
+                          needs=["user", "channel", "message"])
+
+
+    def hook(self, *args, **kwargs):
+        # Called with the pangler, and the instance it's bound to, if any:
+        # the network, when running under a ConnectionManager.
+        instance = args[0] if len(args) > 1 else None
+        network = getattr(instance, "name", None) or ""
+        self.log(network, kwargs["channel"], kwargs["user"],
+                 kwargs["message"])
+
+
+    def log(self, network, channel, user, message, when=None):
+        """
+        Logs a message, at ``when``, or now.
+        """
+        if when is None:
+            when = self.reactor.seconds()
+        self.writer.write(LogStore.append, when, network, channel, user,
+                          message)
+
+
+    def search(self, text, network=None, channel=None, nick=None, limit=20,
+               before=None):
+        """
+        Searches the log for messages with all of the terms in ``text``,
+        newest first, optionally only from one network, channel or nick.
+
+        Returns a Deferred that fires with a ``Page`` of at most ``limit``
+        messages. Pass its ``next`` as ``before`` to get the next page.
+        """
+        return self.writer.read(LogStore.search, text, network, channel,
+                                nick, limit, before)
+
+
+    def lastMention(self, text, network=None, channel=None, nick=None):
+        """
+        Returns a Deferred that fires with the last message with all of the
+        terms in ``text``, or None if there isn't one.
+        """
+        d = self.search(text, network, channel, nick, limit=1)
+        return d.addCallback(lambda page: (page.messages or [None])[0])
+
+
+    def archive(self, before, destination):
+        """
+        Moves partitions older than the one for ``before``, a timestamp,
+        to the ``destination`` directory.
+
+        Returns a Deferred that fires with the names of the partitions that
+        were moved.
+        """
+        return self.writer.read(LogStore.archive, before, destination)
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        d = self.writer.flush()
+        d.addCallback(lambda _: self.writer.read(LogStore.close))
+        return d.addCallback(lambda _: self.writer.stop())
@@ -0,0 +1,148 @@
+"""
+Commands and regex triggers for message hooks.
+
+A ``CommandRegistry`` subscribes a single hook through a FancyInfobarbPangler
+shortcut, and matches every message against all registered commands and
+triggers: literal commands by walking a trie over the start of the message,
+and regexes one by one. Most regexes contain a literal that every match has
+to contain, and the regex is only searched for in messages that contain its
+literal, which is a much cheaper check.
+"""
+import re
+import sre_constants
+import sre_parse
+
+
+_TERMINAL = object()
+
+
+def requiredLiteral(pattern):
+    """
+    Returns the longest run of ASCII characters every match of a compiled
+    regex contains, or None if there isn't one worth checking for.
+    """
+    if pattern.flags & re.IGNORECASE:
+        return None
+
+    runs = []
+
+    def walk(parsed):
+        run = []
+        for op, av in parsed:
+            if op == sre_constants.LITERAL and av < 128:
+                run.append(chr(av))
+                continue
+
+            runs.append("".join(run))
+            run = []
+            if op == sre_constants.SUBPATTERN:
+                walk(av[-1])
+        runs.append("".join(run))
+
+    walk(sre_parse.parse(pattern.pattern, pattern.flags))
+    literal = max(runs, key=len)
+    return literal or None
+
+
+
+class _Trigger(object):
+    def __init__(self, pattern, handler):
+        if not hasattr(pattern, "search"):
+            pattern = re.compile(pattern)
+        self.regex = pattern
+        self.handler = handler
+        self.literal = requiredLiteral(pattern)
+
+
+    def arguments(self, groups):
+        """
+        The hook arguments for a match: its groups, and named groups by name.
+        """
+        kwargs = {"groups": groups}
+        for name, index in self.regex.groupindex.items():
+            kwargs[name] = groups[index - 1]
+        return kwargs
+
+
+
+class CommandRegistry(object):
+    """
+    Commands and triggers for one FancyInfobarbPangler shortcut.
+
+    Command handlers are hooks that get the shortcut's arguments plus
+    ``args``, the rest of the message after the command. Trigger handlers get
+    the shortcut's arguments plus ``groups``, the groups of their match, and
+    each named group as an argument of its own.
+    """
+    def __init__(self, fancyPangler, shortcut="onChannelMessage"):
+        self._trie = {}
+        self._triggers = []
+
+        getattr(fancyPangler, shortcut)(self._dispatch)
+
+
+    def command(self, name, _func=None):
+        """
+        Registers a handler for messages starting with ``name``, followed by
+        whitespace or nothing.
+
+        Works as a decorator if no handler is given.
+        """
+        def register(func):
+            node = self._trie
+            for char in name:
+                node = node.setdefault(char, {})
+            node.setdefault(_TERMINAL, []).append(func)
+            return func
+
+        if _func is not None:
+            return register(_func)
+        return register
+
+
+    def trigger(self, pattern, _func=None):
+        """
+        Registers a handler for messages a regex matches somewhere in.
+
+        Works as a decorator if no handler is given.
+        """
+        def register(func):
+            self._triggers.append(_Trigger(pattern, func))
+            return func
+
+        if _func is not None:
+            return register(_func)
+        return register
+
+
+    def _matches(self, message):
+        """
+        Yields ``(handler, extra arguments)`` for everything that matches.
+        """
+        node = self._trie
+        for i, char in enumerate(message):
+            node = node.get(char)
+            if node is None:
+                break
+
+            handlers = node.get(_TERMINAL)
+            if handlers:
+                rest = message[i + 1:]
+                if not rest or rest[0].isspace():
+                    for handler in handlers:
+                        yield handler, {"args": rest.strip()}
+
+        for trigger in self._triggers:
+            literal = trigger.literal
+            if literal is not None and literal not in message:
+                continue
+
+            match = trigger.regex.search(message)
+            if match is not None:
+                yield trigger.handler, trigger.arguments(match.groups())
+
+
+    def _dispatch(self, *prefix, **kwargs):
+        for handler, extra in list(self._matches(kwargs["message"])):
+            extra.update(kwargs)
+            handler(*prefix, **extra)
@@ -0,0 +1,465 @@
+"""
+Compiled event dispatch.
+
+A plain pangler walks every hook and rebuilds a kwargs dict for every event it
+triggers. The pangler in this module works out which hooks an event reaches,
+and where each hook's arguments come from, once per event shape. The result
+is cached until the subscriptions change.
+"""
+import weakref
+
+import panglery
+
+from panglery.pangler import _DEFAULT_ID
+
+from infobarb import routing
+
+
+# Returned by hooks that finished dispatching the event themselves, so the
+# pangler doesn't go on with it.
+FINISHED = object()
+
+_ANY_OWNER = object()
+
+
+class Pangler(panglery.Pangler):
+    """
+    A pangler with a precompiled dispatch table.
+
+    Hooks see exactly the same calls they would get from a plain pangler.
+    """
+    def __init__(self, id=_DEFAULT_ID):
+        super(Pangler, self).__init__(id)
+        self._table = {}
+        self._wanted = {}
+        self._stats = None
+        self._breakers = None
+        self._enablement = None
+        self._family = weakref.WeakSet([self])
+
+
+    def subscribe(self, _func=None, routeFilter=None, **kwargs):
+        """
+        Adds a hook, just like ``panglery.Pangler.subscribe``.
+
+        The hook only sees events that pass ``routeFilter``, an
+        ``infobarb.routing.Filter``, if one is given. Subscribing invalidates
+        the dispatch table.
+        """
+        deco = super(Pangler, self).subscribe(**kwargs)
+
+        def compilingDeco(func):
+            deco(func)
+            self.hooks[-1].routeFilter = routeFilter
+            self.invalidate()
+            return func
+
+        if _func is not None:
+            compilingDeco(_func)
+        else:
+            return compilingDeco
+
+
+    def invalidate(self):
+        """
+        Throws away the dispatch table, and those of panglers sharing hooks
+        with this one.
+
+        Anything that changes ``self.hooks`` behind the pangler's back should
+        call this.
+        """
+        for p in self._family:
+            p._table.clear()
+            p._wanted.clear()
+
+
+    def swap(self, owner, hooks):
+        """
+        Replaces the hooks belonging to ``owner`` with ``hooks``, in one step.
+
+        The new hooks are tagged with ``owner`` and take the place of the
+        first old one, so hooks keep their order relative to everyone else's.
+        Panglers sharing hooks with this one see the change too.
+        """
+        if owner is None:
+            raise ValueError("tried to swap hooks without an owner")
+
+        for hook in hooks:
+            hook.owner = owner
+
+        kept, position = [], None
+        for hook in self.hooks:
+            if getattr(hook, "owner", None) == owner:
+                if position is None:
+                    position = len(kept)
+            else:
+                kept.append(hook)
+
+        if position is None:
+            position = len(kept)
+        kept[position:position] = hooks
+
+        self.hooks[:] = kept
+        self.invalidate()
+
+
+    def instrument(self, stats):
+        """
+        Starts counting hook calls in an ``infobarb.stats.HookStats``.
+
+        Passing None stops counting. This applies to all panglers sharing
+        hooks with this one. Hooks that run after an event has been modified
+        aren't counted.
+        """
+        for p in self._family:
+            p._stats = stats
+        self.invalidate()
+
+
+    def protect(self, breakers):
+        """
+        Starts watching hooks with an ``infobarb.breakers.CircuitBreakers``,
+        skipping the ones that misbehave.
+
+        Passing None stops watching. Like ``instrument``, this applies to all
+        panglers sharing hooks with this one, and not to hooks that run after
+        an event has been modified.
+        """
+        for p in self._family:
+            p._breakers = breakers
+        self.invalidate()
+
+
+    def restrict(self, enablement):
+        """
+        Leaves plugins' hooks out of dispatch in the channels where a
+        ``infobarb.enablement.PluginEnablement`` has them disabled.
+
+        Passing None enables everything again. Like ``instrument``, this
+        applies to all panglers sharing hooks with this one. Changes to the
+        enablement's rules apply right away.
+        """
+        for p in self._family:
+            p._enablement = enablement
+        if enablement is not None:
+            enablement.watch(self)
+        self.invalidate()
+
+
+    def share(self, instance):
+        """
+        Binds an instance to a pangler that shares this pangler's hooks.
+
+        Unlike ``bind``, hooks subscribed to either pangler afterwards are
+        seen by both.
+        """
+        p = type(self)(self.id)
+        p.hooks = self.hooks
+        p.instance = instance
+        p._stats = self._stats
+        p._breakers = self._breakers
+        p._enablement = self._enablement
+        p._family = self._family
+        self._family.add(p)
+        return p
+
+
+    def clone(self):
+        p = super(Pangler, self).clone()
+        p._stats = self._stats
+        p._breakers = self._breakers
+        p._enablement = self._enablement
+        if p._enablement is not None:
+            p._enablement.watch(p)
+        p.invalidate()
+        return p
+
+
+    def combine(self, *others):
+        p = super(Pangler, self).combine(*others)
+        p.invalidate()
+        return p
+
+
+    def trigger(self, **event):
+        """
+        Triggers an event, just like ``panglery.Pangler.trigger``.
+        """
+        eventName = event.pop("event", _NO_EVENT)
+        if eventName is _NO_EVENT:
+            return super(Pangler, self).trigger(**event)
+
+        argNames = tuple(sorted(event))
+        args = tuple([event[name] for name in argNames])
+        self.fire(eventName, argNames, args)
+
+
+    def fire(self, eventName, argNames, args):
+        """
+        Triggers an event from positional arguments.
+
+        ``argNames`` is a tuple naming the elements of ``args``, which can be
+        any tuple, like an ``infobarb.events`` record. It is used as it is,
+        without copying. Callers that fire the same event over and over
+        should pass the same ``argNames``.
+        """
+        try:
+            plan = self._table[eventName, argNames]
+        except KeyError:
+            plan = self._table[eventName, argNames] = self._compile(
+                eventName, argNames)
+
+        prefix, entries, index = plan
+        if index is not None:
+            entries = index.route(args)
+        self._run(prefix, entries, eventName, argNames, args)
+
+
+    def fireOnly(self, owner, eventName, argNames, args):
+        """
+        Fires an event at only the hooks belonging to ``owner``, the way
+        ``fire`` would.
+
+        If one of them modified the event, the remaining ones see the
+        modified event, which is then returned. Otherwise, returns None.
+        """
+        prefix, entries, index = self._plan(eventName, argNames)
+        if index is not None:
+            entries = index.route(args)
+
+        hooks = self.hooks
+        entries = [entry for entry in entries
+                   if getattr(hooks[entry[0]], "owner", None) == owner]
+        return self._run(prefix, entries, eventName, argNames, args, owner)
+
+
+    def wants(self, eventName, argNames, name, args=None):
+        """
+        Returns whether any hook an event of this shape can reach needs the
+        argument ``name``.
+
+        Firers can leave out arguments that are expensive to make when
+        nobody wants them. ``argNames`` should include ``name``. If the
+        event's ``args`` are given, hooks whose filters don't pass them
+        don't count; ``name`` itself can be anything there, since filters
+        never look at it.
+        """
+        key = eventName, argNames, name
+        try:
+            wanted = self._wanted[key]
+        except KeyError:
+            wanted = self._wanted[key] = self._wants(eventName, argNames,
+                                                     name)
+        if wanted is True or wanted is False:
+            return wanted
+        if args is None:
+            return True
+        return bool(wanted.route(args))
+
+
+    def _wants(self, eventName, argNames, name):
+        """
+        Works out who wants an argument, for ``wants``: True or False if it
+        doesn't depend on the event, or else a ``RouteIndex`` of the entries
+        that need it.
+        """
+        _, entries, index = self._plan(eventName, argNames)
+        hooks = self.hooks
+        needing = [entry for entry in entries
+                   if name in hooks[entry[0]].needs]
+        if not needing:
+            return False
+        if index is None:
+            return True
+
+        routed = routing.RouteIndex(dict((argName, i) for i, argName
+                                         in enumerate(argNames)))
+        for entry in needing:
+            hook = hooks[entry[0]]
+            rule = None
+            if self._enablement is not None and "channel" in argNames:
+                rule = self._enablement.rule(getattr(hook, "owner", None))
+            routed.add(entry, getattr(hook, "routeFilter", None), rule)
+        return routed
+
+
+    def _plan(self, eventName, argNames):
+        try:
+            return self._table[eventName, argNames]
+        except KeyError:
+            plan = self._table[eventName, argNames] = self._compile(
+                eventName, argNames)
+            return plan
+
+
+    def _run(self, prefix, entries, eventName, argNames, args,
+             owner=_ANY_OWNER):
+        for position, func, pairs, checks, constants in entries:
+            if checks and not _checksPass(checks, args):
+                continue
+
+            kwargs = dict([(name, args[i]) for name, i in pairs])
+            if constants:
+                kwargs.update(constants)
+            result = func(*prefix, **kwargs)
+            if result is not None:
+                if result is FINISHED:
+                    return None
+                return self._slowPath(position, eventName, argNames, args,
+                                      result, owner)
+        return None
+
+
+    def _compile(self, eventName, argNames):
+        """
+        Builds the dispatch plan for an event shape.
+
+        The plan is the positional prefix every hook gets, one entry per
+        hook that can match and, if any of those hooks have filters or are
+        only enabled in some channels, a ``RouteIndex`` for them. An entry
+        is the hook's position, its callable, ``(name, index)`` pairs for
+        its parameters, ``(index, value)`` pairs for conditions that can
+        only be checked per event and the parameters that are the same for
+        every event, which is just the event name, if the hook wants it.
+        """
+        indices = dict((name, i) for i, name in enumerate(argNames))
+        known = set(indices) | set(["event"])
+
+        entries, filters, rules = [], [], []
+        for position, hook in enumerate(self.hooks):
+            if not all(key in known for key in hook.needs):
+                continue
+
+            routeFilter = getattr(hook, "routeFilter", None)
+            if routeFilter is not None:
+                if not all(field in known for field in routeFilter.fields):
+                    continue
+
+            conditions = dict(hook.conditions)
+            if "event" in conditions:
+                if conditions.pop("event") != eventName:
+                    continue
+
+            rule = None
+            if self._enablement is not None:
+                owner = getattr(hook, "owner", None)
+                if not self._enablement.isEnabled(owner):
+                    continue
+                if "channel" in indices:
+                    rule = self._enablement.rule(owner)
+
+            func = hook.func
+            if self._stats is not None:
+                func = self._stats.wrap(eventName, hook, func)
+            if self._breakers is not None:
+                func = self._breakers.wrap(eventName, hook, func)
+
+            pairs = tuple((name, indices[name]) for name in hook.parameters
+                          if name != "event")
+            checks = tuple((indices[key], value)
+                           for key, value in conditions.items())
+            constants = None
+            if "event" in hook.parameters:
+                constants = {"event": eventName}
+            entries.append((position, func, pairs, checks, constants))
+            filters.append(routeFilter)
+            rules.append(rule)
+
+        if self.instance is not None:
+            prefix = self.instance, self
+        else:
+            prefix = self,
+
+        index = None
+        if any(routed is not None for routed in filters + rules):
+            index = routing.RouteIndex(indices)
+            for entry, routeFilter, rule in zip(entries, filters, rules):
+                index.add(entry, routeFilter, rule)
+
+        return prefix, tuple(entries), index
+
+
+    def _slowPath(self, position, eventName, argNames, args, result,
+                  owner=_ANY_OWNER):
+        """
+        Finishes an event after a hook modified it, and returns the modified
+        event.
+
+        Modified events go through the hooks after ``position`` (only the
+        ones belonging to ``owner``, if it's given) the way a plain pangler
+        would, since the modification can change which hooks match.
+        """
+        event = dict(zip(argNames, args))
+        event["event"] = eventName
+        event.update(result)
+
+        hooks = self.hooks[position + 1:]
+        if owner is not _ANY_OWNER:
+            hooks = [hook for hook in hooks
+                     if getattr(hook, "owner", None) == owner]
+        self.finish(event, hooks)
+        return event
+
+
+    def finish(self, event, hooks):
+        """
+        Dispatches a modified event to some of this pangler's hooks, in
+        order, the way a plain pangler would.
+
+        A hook that returns ``FINISHED`` ends the dispatch.
+        """
+        if self.instance is not None:
+            prefix = self.instance, self
+        else:
+            prefix = self,
+
+        for hook in hooks:
+            if not hook.matches(event):
+                continue
+
+            enablement = self._enablement
+            if enablement is not None and not enablement.isEnabled(
+                    getattr(hook, "owner", None), event.get("channel")):
+                continue
+
+            routeFilter = getattr(hook, "routeFilter", None)
+            if routeFilter is not None and not routeFilter.matchesEvent(event):
+                continue
+
+            kwargs = dict((key, value) for key, value in event.iteritems()
+                          if key in hook.parameters)
+            result = hook.func(*prefix, **kwargs)
+            if result is FINISHED:
+                return
+            if result is not None:
+                event.update(result)
+
+
+
+_NO_EVENT = object()
+
+
+def _checksPass(checks, args):
+    for i, expected in checks:
+        if args[i] != expected:
+            return False
+    return True
+
+
+
+def firer(pangler):
+    """
+    Gets a ``fire(eventName, argNames, args)`` callable for any pangler.
+
+    Compiled panglers fire directly. Other panglers get their kwargs built
+    per event.
+    """
+    fire = getattr(pangler, "fire", None)
+    if fire is not None:
+        return fire
+
+    def fire(eventName, argNames, args):
+        kwargs = dict(zip(argNames, args))
+        pangler.trigger(event=eventName, **kwargs)
+
+    return fire
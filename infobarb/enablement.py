@@ -0,0 +1,136 @@
+"""
+Turning plugins on and off per channel, while the bot is running.
+
+A ``PluginEnablement`` says where each plugin is enabled: everywhere or
+nowhere by default, with exceptions for some channels. A compiled pangler
+that is restricted by one leaves disabled plugins' hooks out of its dispatch
+table, and routes hooks of plugins that are only enabled in some channels
+through its channel index, so they cost nothing in other channels. Changes
+throw the dispatch table away, so they apply to the very next event.
+
+Plugins are recognized by the owner their hooks were tagged with when
+``infobarb.plugins.PluginManager`` swapped them in; hooks without an owner
+are always enabled. Private messages have the bot's nickname as their
+channel, so they count as a channel of their own. Events without a channel
+reach every plugin that is enabled somewhere.
+
+Rules are saved as JSON to ``path`` whenever they change, if there is one,
+and read back from it when starting up.
+"""
+import json
+import os
+import weakref
+
+
+class PluginEnablement(object):
+    """
+    Where plugins are enabled.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        # Plugin name -> (enabled by default, {channel: enabled}), for
+        # plugins that aren't just enabled everywhere.
+        self._rules = {}
+        self._panglers = weakref.WeakSet()
+
+        if path is not None and os.path.exists(path):
+            self._read()
+
+
+    def watch(self, pangler):
+        """
+        Invalidates a compiled pangler's dispatch table whenever the rules
+        change.
+        """
+        self._panglers.add(pangler)
+
+
+    def enable(self, plugin, channel=None):
+        """
+        Enables a plugin in a channel, or everywhere.
+        """
+        self._set(plugin, channel, True)
+
+
+    def disable(self, plugin, channel=None):
+        """
+        Disables a plugin in a channel, or everywhere.
+        """
+        self._set(plugin, channel, False)
+
+
+    def _set(self, plugin, channel, enabled):
+        if channel is None:
+            # Everywhere means everywhere: forget exceptions.
+            rule = enabled, {}
+        else:
+            default, channels = self._rules.get(plugin, (True, {}))
+            channels = dict(channels)
+            if enabled == default:
+                channels.pop(channel.lower(), None)
+            else:
+                channels[channel.lower()] = enabled
+            rule = default, channels
+
+        if rule == (True, {}):
+            self._rules.pop(plugin, None)
+        else:
+            self._rules[plugin] = rule
+        self._changed()
+
+
+    def isEnabled(self, plugin, channel=None):
+        """
+        Checks whether a plugin sees events in a channel, or, without one,
+        events that aren't in any channel.
+        """
+        rule = self.rule(plugin)
+        if rule is None:
+            return True
+
+        enabled, exceptions = rule
+        if channel is None:
+            return enabled or bool(exceptions)
+        return enabled != (channel.lower() in exceptions)
+
+
+    def rule(self, plugin):
+        """
+        Returns ``(enabled, exceptions)`` for a plugin: whether it is enabled
+        by default, and the lowercased channels where it is the other way
+        around. Returns None for plugins that are enabled everywhere.
+        """
+        rule = self._rules.get(plugin)
+        if rule is None:
+            return None
+        enabled, channels = rule
+        return enabled, frozenset(channels)
+
+
+    def _changed(self):
+        if self.path is not None:
+            self._write()
+        for pangler in list(self._panglers):
+            pangler.invalidate()
+
+
+    def _read(self):
+        with open(self.path) as f:
+            rules = json.load(f)
+
+        for plugin, rule in rules.items():
+            channels = dict((channel.lower(), enabled) for channel, enabled
+                            in rule.get("channels", {}).items())
+            self._rules[plugin] = rule.get("enabled", True), channels
+
+
+    def _write(self):
+        rules = dict((plugin, {"enabled": enabled, "channels": channels})
+                     for plugin, (enabled, channels) in self._rules.items())
+
+        # Write a new file and move it into place, so a crash never leaves
+        # half a file behind.
+        temporary = self.path + ".new"
+        with open(temporary, "w") as f:
+            json.dump(rules, f, indent=2, sort_keys=True)
+        os.rename(temporary, self.path)
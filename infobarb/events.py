@@ -0,0 +1,51 @@
+"""
+Compact event records.
+
+Every IRC event InfobarbClient fires is carried through dispatch as a record:
+a tuple subclass with named fields and no per-instance dict. Nicknames and
+channel names in records are interned, so a long-running bot keeps one copy
+of each instead of one per event that mentions it.
+"""
+from collections import namedtuple
+
+
+def recordClass(eventName, argNames):
+    """
+    Creates a record class for an event with the given arguments.
+    """
+    base = namedtuple(eventName[0].upper() + eventName[1:], argNames)
+    return type(base.__name__, (base,), {
+        "__slots__": (),
+        "event": eventName,
+    })
+
+
+
+class InternTable(object):
+    """
+    A bounded table of interned strings.
+
+    Once the table holds ``maxSize`` strings it is emptied and starts over,
+    which keeps it bounded without per-lookup bookkeeping. Strings interned
+    before that stay valid; they just stop being shared with new ones.
+    """
+    def __init__(self, maxSize=10000):
+        self.maxSize = maxSize
+        self._strings = {}
+
+
+    def __len__(self):
+        return len(self._strings)
+
+
+    def intern(self, s):
+        """
+        Returns the table's copy of ``s``.
+        """
+        try:
+            return self._strings[s]
+        except KeyError:
+            if len(self._strings) >= self.maxSize:
+                self._strings.clear()
+            self._strings[s] = s
+            return s
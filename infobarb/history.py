@@ -0,0 +1,181 @@
+"""
+Recent channel messages, kept once for all plugins.
+
+InfobarbClient feeds every channel message into its ``History`` before
+plugins see it, so plugins can ask what someone last said, or for the last
+URL, without keeping lists of their own. Each channel keeps a fixed number
+of lines in a ring buffer, indexed by nickname and by token (URLs, unless
+told otherwise), so lookups never scan the buffer.
+"""
+import re
+
+from collections import deque, namedtuple
+from itertools import islice
+
+
+URL = re.compile(r"\bhttps?://\S+", re.I)
+
+
+Line = namedtuple("Line", "user message tokens")
+
+
+def _nickKey(user):
+    return user.split("!", 1)[0].lower()
+
+
+
+class ChannelHistory(object):
+    """
+    The last ``size`` messages in a channel.
+
+    Lines are numbered as they come in. The line numbered ``n`` lives in
+    slot ``n % size``, and the indexes hold line numbers, oldest first, so
+    forgetting the oldest line only ever pops from the left.
+    """
+    def __init__(self, size, tokenPattern=URL):
+        self.size = size
+        self.tokenPattern = tokenPattern
+        self._lines = [None] * size
+        self._count = 0
+        self._byNick = {}
+        self._byToken = {}
+        self._withTokens = deque()
+
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+
+    def add(self, user, message):
+        number = self._count
+        slot = number % self.size
+        if self._lines[slot] is not None:
+            self._forget(number - self.size, self._lines[slot])
+
+        tokens = ()
+        if self.tokenPattern is not None:
+            found = self.tokenPattern.findall(message)
+            tokens = tuple(sorted(set(found), key=found.index))
+
+        self._lines[slot] = Line(user, message, tokens)
+        self._count += 1
+
+        self._byNick.setdefault(_nickKey(user), deque()).append(number)
+        for token in tokens:
+            self._byToken.setdefault(token, deque()).append(number)
+        if tokens:
+            self._withTokens.append(number)
+
+
+    def _forget(self, number, line):
+        self._popOldest(self._byNick, _nickKey(line.user))
+        for token in line.tokens:
+            self._popOldest(self._byToken, token)
+        if line.tokens:
+            self._withTokens.popleft()
+
+
+    @staticmethod
+    def _popOldest(index, key):
+        numbers = index[key]
+        numbers.popleft()
+        if not numbers:
+            del index[key]
+
+
+    def _newest(self, numbers, count):
+        lines = self._lines
+        return [lines[number % self.size]
+                for number in islice(reversed(numbers), count)]
+
+
+    def recent(self, count):
+        first = max(self._count - count, self._count - self.size, 0)
+        return self._newest(range(first, self._count), count)
+
+
+    def byNick(self, nick, count):
+        return self._newest(self._byNick.get(nick.lower(), ()), count)
+
+
+    def byToken(self, token, count):
+        return self._newest(self._byToken.get(token, ()), count)
+
+
+    def withTokens(self, count):
+        return self._newest(self._withTokens, count)
+
+
+
+class History(object):
+    """
+    Recent messages in every channel.
+
+    Queries return ``Line``s, newest first: ``user`` is who sent the line
+    (``nick!user@host``), ``message`` is what they said and ``tokens`` are
+    the tokens in it, in order, without duplicates.
+    """
+    def __init__(self, size=1000, tokenPattern=URL):
+        self.size = size
+        self.tokenPattern = tokenPattern
+        self._channels = {}
+
+
+    def add(self, user, channel, message):
+        key = channel.lower()
+        history = self._channels.get(key)
+        if history is None:
+            history = self._channels[key] = ChannelHistory(
+                self.size, self.tokenPattern)
+        history.add(user, message)
+
+
+    def forgetChannel(self, channel):
+        self._channels.pop(channel.lower(), None)
+
+
+    def _query(self, channel, method, *args):
+        history = self._channels.get(channel.lower())
+        if history is None:
+            return []
+        return getattr(history, method)(*args)
+
+
+    def recent(self, channel, count=10):
+        """
+        Returns the last lines said in a channel.
+        """
+        return self._query(channel, "recent", count)
+
+
+    def byNick(self, channel, nick, count=1):
+        """
+        Returns the last lines a nickname said in a channel.
+        """
+        return self._query(channel, "byNick", nick, count)
+
+
+    def byToken(self, channel, token, count=1):
+        """
+        Returns the last lines in a channel with a token, like a URL, in
+        them.
+        """
+        return self._query(channel, "byToken", token, count)
+
+
+    def withTokens(self, channel, count=1):
+        """
+        Returns the last lines in a channel with any tokens in them.
+        """
+        return self._query(channel, "withTokens", count)
+
+
+    def lastToken(self, channel):
+        """
+        Returns the last token, like the last URL, said in a channel, or
+        None.
+        """
+        lines = self.withTokens(channel)
+        if not lines:
+            return None
+        return lines[0].tokens[-1]
@@ -0,0 +1,232 @@
+"""
+Resolving who sent a message, and what they may do.
+
+Hooks get ``user`` as a raw ``nick!ident@host`` string. Instead of every
+admin-gated plugin parsing it and looking up permissions on every message,
+each InfobarbClient has an ``IdentityService`` that does it once per
+hostmask, and keeps the resulting ``Identity`` around until it expires or
+the client sees the user change nick, quit, or log in or out of an account.
+
+Permissions come from sources: callables that take an ``Identity`` without
+permissions and return the names of the permissions it has. Plugins add
+sources for whatever they keep permissions in, like ``MaskPermissions``
+for hostmask patterns from a configuration file.
+
+The message events the default dispatch hooks fire carry the sender's
+``identity``, so a hook that needs one only has to ask for it. With a
+compiled pangler, identities are only resolved for events that some hook
+asks for one on.
+
+Sources are called on the reactor thread, every time a hostmask that isn't
+cached is resolved, so they must be cheap: anything that takes a while,
+like a database or a network service, needs a cache in front of it.
+"""
+import fnmatch
+
+from collections import OrderedDict, namedtuple
+
+
+_IdentityBase = namedtuple("Identity",
+                           "mask nick ident host account permissions")
+
+
+class Identity(_IdentityBase):
+    """
+    A user, parsed out of their hostmask, with their services account (or
+    None) and a frozenset of permission names.
+    """
+    __slots__ = ()
+
+    def has(self, permission):
+        return permission in self.permissions
+
+
+    def asList(self):
+        """
+        Returns the identity as a list of strings and lists, which
+        ``infobarb.recording.encode`` can encode.
+        """
+        return list(self[:-1]) + [sorted(self.permissions)]
+
+
+    @classmethod
+    def fromList(cls, values):
+        return cls(*values[:-1] + [frozenset(values[-1])])
+
+
+
+def parseHostmask(user):
+    """
+    Splits ``nick!ident@host`` into its parts. Parts that are missing, like
+    when ``user`` is just a nickname or a server name, are None.
+    """
+    nick, bang, rest = user.partition("!")
+    if not bang:
+        nick, at, host = user.partition("@")
+        return nick, None, host if at else None
+
+    ident, at, host = rest.partition("@")
+    if not at:
+        return nick, ident, None
+    return nick, ident, host
+
+
+
+class MaskPermissions(object):
+    """
+    A permission source granting permissions by hostmask pattern.
+
+    ``grants`` maps permission names to patterns, like
+    ``{"admin": ["lvh!*@example.com"]}``. Patterns starting with ``$a:``
+    match services accounts instead, like ``$a:lvh``.
+    """
+    def __init__(self, grants):
+        self.grants = dict((permission, tuple(patterns))
+                           for permission, patterns in grants.items())
+
+
+    def __call__(self, identity):
+        granted = []
+        for permission, patterns in self.grants.items():
+            for pattern in patterns:
+                if pattern.startswith("$a:"):
+                    if identity.account is not None and fnmatch.fnmatchcase(
+                            identity.account.lower(), pattern[3:].lower()):
+                        break
+                elif fnmatch.fnmatchcase(identity.mask, pattern):
+                    break
+            else:
+                continue
+            granted.append(permission)
+        return granted
+
+
+
+class IdentityService(object):
+    """
+    Resolves hostmasks to identities, keeping the last ``maxSize`` of them
+    for up to ``ttl`` seconds.
+    """
+    def __init__(self, maxSize=1000, ttl=300.0, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._sources = []
+
+        # Hostmask -> (identity, when it expires), least recently used first.
+        self._cache = OrderedDict()
+        # Nickname key -> hostmasks cached for it.
+        self._masks = {}
+        # Nickname key -> services account.
+        self._accounts = {}
+
+
+    def addSource(self, source):
+        """
+        Adds a permission source. Cached identities are dropped, so they
+        pick up what it grants.
+
+        The source is called synchronously, so it has to be cheap or cached.
+        """
+        self._sources.append(source)
+        self.invalidate()
+
+
+    def removeSource(self, source):
+        self._sources.remove(source)
+        self.invalidate()
+
+
+    def resolve(self, user):
+        """
+        Returns the identity for a hostmask.
+        """
+        cached = self._cache.pop(user, None)
+        if cached is not None and cached[1] > self.clock.seconds():
+            self._cache[user] = cached
+            return cached[0]
+
+        identity = self._resolve(user)
+        key = identity.nick.lower()
+        self._cache[user] = identity, self.clock.seconds() + self.ttl
+        self._masks.setdefault(key, set()).add(user)
+
+        while len(self._cache) > self.maxSize:
+            mask, (oldest, _) = self._cache.popitem(last=False)
+            self._unindex(oldest.nick.lower(), mask)
+        return identity
+
+
+    def _resolve(self, user):
+        nick, ident, host = parseHostmask(user)
+        identity = Identity(user, nick, ident, host,
+                            self._accounts.get(nick.lower()), frozenset())
+
+        permissions = set()
+        for source in self._sources:
+            permissions.update(source(identity))
+        return identity._replace(permissions=frozenset(permissions))
+
+
+    def _unindex(self, key, mask):
+        masks = self._masks.get(key)
+        if masks is not None:
+            masks.discard(mask)
+            if not masks:
+                del self._masks[key]
+
+
+    def invalidate(self, nick=None):
+        """
+        Drops the cached identities for a nickname, or all of them.
+        """
+        if nick is None:
+            self._cache.clear()
+            self._masks.clear()
+            return
+
+        for mask in self._masks.pop(nick.lower(), ()):
+            self._cache.pop(mask, None)
+
+
+    def accountChanged(self, nick, account):
+        """
+        Notes that a user logged in to an account, or out if ``account`` is
+        None.
+        """
+        key = nick.lower()
+        if account is None:
+            self._accounts.pop(key, None)
+        else:
+            self._accounts[key] = account
+        self.invalidate(nick)
+
+
+    def renamed(self, oldNick, newNick):
+        """
+        Notes a nick change. The account, if any, goes along with the user.
+        """
+        account = self._accounts.pop(oldNick.lower(), None)
+        self.invalidate(oldNick)
+        self.invalidate(newNick)
+        if account is not None:
+            self._accounts[newNick.lower()] = account
+
+
+    def forget(self, nick):
+        """
+        Forgets everything about a user, like when they quit.
+        """
+        self._accounts.pop(nick.lower(), None)
+        self.invalidate(nick)
+
+
+    def clear(self):
+        """
+        Forgets everything, except the permission sources.
+        """
+        self._accounts.clear()
+        self.invalidate()
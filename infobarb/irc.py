@@ -2,22 +2,37 @@
 Low level abstraction layer over IRC.
 """
 import inspect
+import re
 
 import panglery
 
+from twisted.python import log
 from twisted.words.protocols import irc
 
+from infobarb import (
+    breakers, dispatch, events, history, identity, netsplit, outbound,
+    routing, state, watchdog)
 
-def _buildCallback(eventName, argNames):
+
+def _buildCallback(eventName, argNames, record, internedArgs):
     """
     Builds a callback method for InfobarbClient.
 
-    Triggers the specified event with all arguments passed to the callback.
+    Fires the specified event with all arguments passed to the callback, as a
+    record. Arguments named in ``internedArgs`` are interned first.
     """
-    def callback(self, *args):
-        assert len(argNames) == len(args) # inspection sanity check
-        kwargs = dict(zip(argNames, args))
-        self.p.trigger(event=eventName, **kwargs)
+    argNames = tuple(argNames)
+    interned = tuple(name in internedArgs for name in argNames)
+
+    if not any(interned):
+        def callback(self, *args):
+            self._fire(eventName, argNames, record._make(args))
+    else:
+        def callback(self, *args):
+            intern = self.internTable.intern
+            self._fire(eventName, argNames, record._make(
+                [intern(arg) if flag else arg
+                 for arg, flag in zip(args, interned)]))
 
     return callback
 
@@ -27,6 +42,7 @@ def eventHookMagic(cls):
     Creates callbacks for all the supported IRC events.
     """
     cls._builtinEventArgs = {}
+    cls._eventRecords = {}
 
     for eventName in cls._supportedEvents:
         callbackName = cls._supportedEvents[eventName]
@@ -35,7 +51,11 @@ def eventHookMagic(cls):
         argNames = inspect.getargspec(original).args[1:]
         cls._builtinEventArgs[eventName] = argNames
 
-        callback = _buildCallback(eventName, argNames)
+        record = events.recordClass(eventName, argNames)
+        cls._eventRecords[eventName] = record
+
+        callback = _buildCallback(eventName, argNames, record,
+                                  cls._internedArgs)
         callback.eventName = eventName
         callback.__name__ = callbackName
 
@@ -44,6 +64,89 @@ def eventHookMagic(cls):
     return cls
 
 
+# Fast paths for the most common lines. Each gets the client, the prefix and
+# the rest of the line after the command, and returns False, before doing
+# anything, for lines that should go through the generic parser instead.
+
+_WHITESPACE = re.compile(r"\s")
+
+
+def _nick(prefix):
+    end = prefix.find("!")
+    if end < 0:
+        return prefix
+    return prefix[:end]
+
+
+def _targetAndText(rest):
+    """
+    Splits ``target :text``, or returns None.
+    """
+    i = rest.find(" :")
+    if i <= 0 or rest[0] == ":":
+        return None
+
+    target, text = rest[:i], rest[i + 2:]
+    if not text or text[0] == irc.X_DELIM or _WHITESPACE.search(target):
+        return None
+    return target, text
+
+
+def _fastPrivmsg(client, prefix, rest):
+    parsed = _targetAndText(rest)
+    if parsed is None:
+        return False
+    client._privmsg(prefix, parsed[0], parsed[1])
+    return True
+
+
+def _fastNotice(client, prefix, rest):
+    parsed = _targetAndText(rest)
+    if parsed is None:
+        return False
+    client.noticed(prefix, parsed[0], parsed[1])
+    return True
+
+
+def _fastJoin(client, prefix, rest):
+    channel = rest[1:] if rest[:1] == ":" else rest
+    if not channel or _WHITESPACE.search(channel):
+        return False
+    client._join(_nick(prefix), channel)
+    return True
+
+
+def _fastPart(client, prefix, rest):
+    i = rest.find(" ")
+    if i < 0:
+        channel = rest[1:] if rest[:1] == ":" else rest
+    elif rest[i + 1:i + 2] == ":" and rest[0] != ":":
+        channel = rest[:i]
+    else:
+        return False
+
+    if not channel or _WHITESPACE.search(channel):
+        return False
+    client._part(_nick(prefix), channel)
+    return True
+
+
+def _fastQuit(client, prefix, rest):
+    if rest[:1] != ":":
+        return False
+    client._quit(_nick(prefix), rest[1:])
+    return True
+
+
+_fastPaths = {
+    "PRIVMSG": _fastPrivmsg,
+    "NOTICE": _fastNotice,
+    "JOIN": _fastJoin,
+    "PART": _fastPart,
+    "QUIT": _fastQuit,
+}
+
+
 @eventHookMagic
 class InfobarbClient(irc.IRCClient):
     """
@@ -61,8 +164,249 @@ class InfobarbClient(irc.IRCClient):
         "userKicked": "userKicked",
         }
 
+    _internedArgs = frozenset(["user", "channel", "kickee", "kicker"])
+
+    # Shared by all clients, so a bot on many networks keeps one copy of
+    # names it sees on several of them.
+    internTable = events.InternTable()
+
+    outboundScheduler = None
+    netsplits = None
+
+    # IRCv3 capabilities asked for while registering, so the identity
+    # service hears about services accounts.
+    capabilities = ("account-notify", "extended-join")
+
     def __init__(self, boundPangler):
         self.p = boundPangler
+        self._fire = dispatch.firer(boundPangler)
+        self.channelState = state.ChannelState(self.internTable.intern)
+        self.history = history.History()
+        self.identities = identity.IdentityService()
+
+
+    def connectionMade(self):
+        irc.IRCClient.connectionMade(self)
+        self.outboundScheduler = outbound.OutboundScheduler(self.sendLine)
+        self.netsplits = netsplit.NetsplitCoalescer(self._netsplit,
+                                                    self._netjoin)
+
+
+    def register(self, nickname, hostname="foo", servername="bar"):
+        """
+        Registers with the server, asking for ``capabilities`` first.
+
+        Servers that don't know about capabilities ignore the request, and
+        registration carries on as usual.
+        """
+        self.sendLine("CAP REQ :" + " ".join(self.capabilities))
+        irc.IRCClient.register(self, nickname, hostname, servername)
+
+
+    def irc_CAP(self, prefix, params):
+        """
+        Ends capability negotiation once the server answers the request,
+        whether it granted the capabilities or not.
+        """
+        if params[1] in ("ACK", "NAK"):
+            self.sendLine("CAP END")
+
+
+    def connectionLost(self, reason):
+        irc.IRCClient.connectionLost(self, reason)
+        if self.outboundScheduler is not None:
+            self.outboundScheduler.stop()
+        if self.netsplits is not None:
+            self.netsplits.stop()
+        self.channelState.clear()
+        self.identities.clear()
+
+
+    def scheduleMsg(self, user, message, priority=outbound.NORMAL):
+        """
+        Queues a message to a user or channel, without flooding.
+
+        Unlike ``msg``, this never sends more than the network allows, and
+        sends higher priority messages first.
+        """
+        self.outboundScheduler.enqueue("PRIVMSG", user, message, priority)
+
+
+    def scheduleNotice(self, user, message, priority=outbound.NORMAL):
+        """
+        Queues a notice to a user or channel, without flooding.
+        """
+        self.outboundScheduler.enqueue("NOTICE", user, message, priority)
+
+
+    def lineReceived(self, line):
+        """
+        Handles a line from the server.
+
+        PRIVMSG, NOTICE, JOIN, PART and QUIT lines in their usual form are
+        parsed in one pass, straight into the event. Anything else, including
+        CTCP and lines that need low-level dequoting, goes through
+        ``IRCClient``'s generic parser.
+        """
+        if line[:1] == ":" and irc.M_QUOTE not in line:
+            space = line.find(" ")
+            end = line.find(" ", space + 1)
+            if space > 0 and end > 0:
+                fastPath = _fastPaths.get(line[space + 1:end])
+                if fastPath is not None:
+                    try:
+                        if fastPath(self, line[1:space], line[end + 1:]):
+                            return
+                    except:
+                        log.deferr()
+                        return
+
+        irc.IRCClient.lineReceived(self, line)
+
+
+    # Channel state and history. Arrivals and messages are recorded before
+    # hooks see them, departures after, so hooks always see the user where
+    # the event says they are.
+
+    def _isMe(self, nick):
+        return nick.lower() == self.nickname.lower()
+
+
+    def irc_RPL_NAMREPLY(self, prefix, params):
+        channel, names = params[2], params[3].split()
+        prefixes = dict((symbol, mode) for mode, (symbol, _)
+                        in self.supported.getFeature("PREFIX", {}).items())
+        self.channelState.namesReply(channel, names, prefixes)
+
+
+    def irc_PRIVMSG(self, prefix, params):
+        channel, message = params[0], params[-1]
+        if message and message[0] != irc.X_DELIM:
+            self._privmsg(prefix, channel, message)
+        else:
+            irc.IRCClient.irc_PRIVMSG(self, prefix, params)
+
+
+    def _privmsg(self, user, channel, message):
+        if irc.X_DELIM not in message and not self._isMe(channel):
+            self.history.add(self.internTable.intern(user), channel, message)
+        self.privmsg(user, channel, message)
+
+
+    def irc_JOIN(self, prefix, params):
+        nick = prefix.split("!", 1)[0]
+        if len(params) > 1:
+            # extended-join also says which account the user is logged in
+            # to, if any.
+            self._accountChanged(nick, params[1])
+        self._join(nick, params[0])
+
+
+    def _join(self, nick, channel):
+        if self.netsplits is not None and self.netsplits.joined(nick, channel):
+            return
+
+        self.channelState.joined(nick, channel)
+        if nick == self.nickname:
+            self.joined(channel)
+        else:
+            self.userJoined(nick, channel)
+
+
+    def irc_PART(self, prefix, params):
+        self._part(prefix.split("!", 1)[0], params[0])
+
+
+    def _part(self, nick, channel):
+        if nick == self.nickname:
+            self.left(channel)
+        else:
+            self.userLeft(nick, channel)
+
+        if self._isMe(nick):
+            self.channelState.forgetChannel(channel)
+            self.history.forgetChannel(channel)
+        else:
+            self.channelState.left(nick, channel)
+
+
+    def irc_QUIT(self, prefix, params):
+        self._quit(prefix.split("!", 1)[0], params[0])
+
+
+    def _quit(self, nick, quitMessage):
+        if self.netsplits is not None and self.netsplits.quit(nick,
+                                                              quitMessage):
+            return
+
+        self.userQuit(nick, quitMessage)
+        self.channelState.quit(nick)
+        self.identities.forget(nick)
+
+
+    # Netsplits and the joins after them come in batches, and their channel
+    # state is updated once per batch.
+
+    def _netsplit(self, servers, nicks):
+        intern = self.internTable.intern
+        nicks = tuple([intern(nick) for nick in nicks])
+        self._fire("netsplit", netsplit.ARGS,
+                   netsplit.Netsplit(servers, nicks))
+        for nick in nicks:
+            self.channelState.quit(nick)
+            self.identities.forget(nick)
+
+
+    def _netjoin(self, servers, joins):
+        intern = self.internTable.intern
+        joins = tuple([(intern(nick), intern(channel))
+                       for nick, channel in joins])
+        for nick, channel in joins:
+            self.channelState.joined(nick, channel)
+        self._fire("netjoin", netsplit.ARGS,
+                   netsplit.Netjoin(servers, joins))
+
+
+    def irc_KICK(self, prefix, params):
+        irc.IRCClient.irc_KICK(self, prefix, params)
+
+        channel, kicked = params[0], params[1]
+        if self._isMe(kicked):
+            self.channelState.forgetChannel(channel)
+            self.history.forgetChannel(channel)
+        else:
+            self.channelState.left(kicked, channel)
+
+
+    def irc_NICK(self, prefix, params):
+        oldNick = prefix.split("!", 1)[0]
+        self.channelState.renamed(oldNick, params[0])
+        self.identities.renamed(oldNick, params[0])
+        irc.IRCClient.irc_NICK(self, prefix, params)
+
+
+    def irc_ACCOUNT(self, prefix, params):
+        """
+        Called when a user logs in to or out of a services account. Servers
+        only send these to clients that asked for the account-notify
+        capability.
+        """
+        self._accountChanged(prefix.split("!", 1)[0], params[0])
+
+
+    def _accountChanged(self, nick, account):
+        if account == "*":
+            account = None
+        self.identities.accountChanged(nick, account)
+
+
+    def modeChanged(self, user, channel, set, modes, args):
+        memberModes = "".join(self.supported.getFeature("PREFIX", {}))
+        self.channelState.modeChanged(channel, set, modes, args, memberModes)
+
+
+    def topicUpdated(self, user, channel, newTopic):
+        self.channelState.topicUpdated(channel, newTopic)
 
 
 
@@ -77,12 +421,15 @@ def addDefaultDispatchHooks(boundPangler):
         boundPangler.subscribe(hook, **kwargs)
 
 
-def dispatchHook(dispatchedEvent):
+def dispatchHook(dispatchedEvent, needs=None):
     """
     A decorator for a callback that takes a general event and fires new, more
     specialized events.
+
+    ``needs`` defaults to the arguments of the client's builtin event.
     """
-    needs = InfobarbClient._builtinEventArgs[dispatchedEvent]
+    if needs is None:
+        needs = InfobarbClient._builtinEventArgs[dispatchedEvent]
 
     def decorator(f):
         kwargs = {"event": dispatchedEvent, "needs": needs}
@@ -101,7 +448,7 @@ def onPrivmsgReceived(self, p, user, channel, message):
     else:
         event = "channelMessageReceived"
 
-    p.trigger(event=event, user=user, channel=channel, message=message)
+    _triggerMessage(self.client, p, event, user, channel, message)
 
 
 @dispatchHook("noticeReceived")
@@ -114,7 +461,49 @@ def onNoticeReceived(self, p, user, channel, message):
     else:
         event = "channelNoticeReceived"
 
-    p.trigger(event=event, user=user, channel=channel, message=message)
+    _triggerMessage(self.client, p, event, user, channel, message)
+
+
+_MESSAGE_ARGS = ("channel", "identity", "message", "user")
+_ANONYMOUS_MESSAGE_ARGS = ("channel", "message", "user")
+
+
+def _triggerMessage(client, p, event, user, channel, message):
+    """
+    Triggers a message event, with the sender's identity if a hook wants it.
+
+    Resolving an identity can mean asking every permission source, so
+    compiled panglers only do it for events that reach a hook that needs it.
+    """
+    wants = getattr(p, "wants", None)
+    if wants is None:
+        p.trigger(event=event, user=user, channel=channel, message=message,
+                  identity=client.identities.resolve(user))
+    elif wants(event, _MESSAGE_ARGS, "identity",
+               (channel, None, message, user)):
+        p.fire(event, _MESSAGE_ARGS,
+               (channel, client.identities.resolve(user), message, user))
+    else:
+        p.fire(event, _ANONYMOUS_MESSAGE_ARGS, (channel, message, user))
+
+
+@dispatchHook("netsplit", needs=netsplit.ARGS)
+def onNetsplit(self, p, servers, users):
+    """
+    Delivers a netsplit to hooks for individual quits.
+    """
+    quitMessage = " ".join(servers)
+    for user in users:
+        p.trigger(event="userQuit", user=user, quitMessage=quitMessage)
+
+
+@dispatchHook("netjoin", needs=netsplit.ARGS)
+def onNetjoin(self, p, servers, users):
+    """
+    Delivers the joins after a netsplit to hooks for individual joins.
+    """
+    for user, channel in users:
+        p.trigger(event="userJoined", user=user, channel=channel)
 
 
 def _buildShortcut(defaultKwargs):
@@ -122,7 +511,10 @@ def _buildShortcut(defaultKwargs):
         if any(k in defaultKwargs for k in kwargs):
             raise KeyError("duplicated shortcut kwarg")
 
+        routeFilter = routing.Filter.fromKwargs(kwargs)
         kwargs.update(defaultKwargs)
+        if routeFilter is not None:
+            return routing.subscribe(self.p, _func, routeFilter, **kwargs)
         return self.p.subscribe(_func, **kwargs)
 
     return shortcut
@@ -147,7 +539,9 @@ class FancyInfobarbPangler(object):
     """
     Some infobarb-specific event hook shortcuts.
 
-    This is just syntactic sugar. No fancy behavior here!
+    This is just syntactic sugar. No fancy behavior here! Shortcuts take the
+    filter arguments of ``infobarb.routing.Filter`` (``channels``, ``nick``,
+    ``prefix`` and ``pattern``), and pass anything else on to ``subscribe``.
     """
     def __init__(self, boundPangler):
         self.p = boundPangler
@@ -186,5 +580,28 @@ class FancyInfobarbPangler(object):
         "userKicked": {
             "name": "onUserKick",
             "args": ("kickee", "channel", "kicker", "message")
-            }
+            },
+
+        "netsplit": {
+            "name": "onNetsplit",
+            "args": netsplit.ARGS,
+            },
+        "netjoin": {
+            "name": "onNetjoin",
+            "args": netsplit.ARGS,
+            },
+
+        "circuitOpened": {
+            "name": "onCircuitOpen",
+            "args": breakers.ARGS,
+            },
+        "circuitClosed": {
+            "name": "onCircuitClose",
+            "args": breakers.ARGS,
+            },
+
+        "reactorStalled": {
+            "name": "onReactorStall",
+            "args": watchdog.ARGS,
+            },
     }
@@ -0,0 +1,165 @@
+"""
+Plugin manifests, for starting up without importing every plugin.
+
+A manifest is a JSON object mapping plugin names to what they want to see:
+
+ * ``shortcuts``: names of ``FancyInfobarbPangler`` shortcuts, like
+   ``"onChannelMessage"``;
+ * ``events``: names of events;
+ * ``commands``: literal commands, like ``"!paste"``, seen in channel or
+   private messages.
+
+Message events can also carry the sender's identity, which can be expensive
+to resolve, so stand-ins only ask for it if the entry says ``"identity":
+true``. Introspected entries say so for the events the plugin has hooks
+needing it for.
+
+Each plugin is loaded lazily, on the first event it wants. Entries can be
+written by hand, or made by ``introspect``, which loads the plugin once and
+looks at its hooks. Introspected entries remember the plugin's source file
+and when it was last modified, and ``read`` only introspects them again
+once that changes.
+"""
+import json
+import os
+
+from infobarb import dispatch, irc, plugins
+
+
+# Events that default dispatch hooks fire, and the events they come from.
+# They can also carry the sender's identity, for hooks that need it.
+_derivedEvents = {
+    "privateMessageReceived": "privmsgReceived",
+    "channelMessageReceived": "privmsgReceived",
+    "privateNoticeReceived": "noticeReceived",
+    "channelNoticeReceived": "noticeReceived",
+}
+
+_commandEvents = ("channelMessageReceived", "privateMessageReceived")
+
+
+def eventArgs(eventName, needs=()):
+    """
+    Returns the names of all the arguments an infobarb event has, or None
+    if it isn't one.
+
+    Message events only have an ``identity`` if it is in ``needs``.
+    """
+    builtin = irc.InfobarbClient._builtinEventArgs
+    shortcuts = irc.FancyInfobarbPangler._shortcuts
+    if eventName in _derivedEvents:
+        argNames = tuple(builtin[_derivedEvents[eventName]])
+        if "identity" in needs:
+            argNames += ("identity",)
+        return argNames
+    if eventName in builtin:
+        return tuple(builtin[eventName])
+    if eventName in shortcuts:
+        return tuple(shortcuts[eventName]["args"])
+    return None
+
+
+
+def _shortcutEvents():
+    return dict((info["name"], event) for event, info
+                in irc.FancyInfobarbPangler._shortcuts.iteritems())
+
+
+
+def stubs(entry):
+    """
+    Returns the ``(eventName, argNames, prefix)`` triples for
+    ``PluginManager.loadLazily`` from a manifest entry.
+    """
+    needs = ("identity",) if entry.get("identity") else ()
+    events = dict(entry.get("events", {}))
+    shortcutEvents = _shortcutEvents()
+    for name in entry.get("shortcuts", ()):
+        events.setdefault(shortcutEvents[name], None)
+
+    triples = []
+    for eventName, argNames in sorted(events.items()):
+        if argNames is None:
+            argNames = eventArgs(eventName, needs)
+        if argNames is None:
+            raise ValueError("don't know the arguments of %r" % (eventName,))
+        triples.append((eventName, tuple(argNames), None))
+
+    for command in entry.get("commands", ()):
+        for eventName in _commandEvents:
+            triples.append((eventName, eventArgs(eventName, needs), command))
+
+    return triples
+
+
+
+def introspect(name):
+    """
+    Loads a plugin and makes a manifest entry for it from its hooks.
+    """
+    module = plugins._loadModule(name)
+    scratch = dispatch.Pangler()
+    module.setup(scratch)
+
+    needs = {}
+    for hook in scratch.hooks:
+        eventName = hook.conditions.get("event")
+        if eventName is None:
+            raise ValueError("%r has hooks for any event, so it can't be "
+                             "loaded lazily" % (name,))
+        needs.setdefault(eventName, set()).update(hook.needs)
+
+    events = {}
+    for eventName, eventNeeds in needs.items():
+        argNames = eventArgs(eventName, eventNeeds)
+        if argNames is None:
+            argNames = sorted(eventNeeds - set(["event"]))
+        events[eventName] = list(argNames)
+
+    return {
+        "events": events,
+        "source": module.__file__,
+        "mtime": os.path.getmtime(module.__file__),
+    }
+
+
+
+def read(path):
+    """
+    Reads a manifest, introspecting plugins whose source changed since
+    they were last introspected.
+
+    The manifest is written back if anything changed.
+    """
+    with open(path) as f:
+        manifest = dict((str(name), entry)
+                        for name, entry in json.load(f).items())
+
+    changed = False
+    for name, entry in manifest.items():
+        source = entry.get("source")
+        if source is None:
+            continue
+        if (not os.path.exists(source)
+                or os.path.getmtime(source) != entry["mtime"]):
+            manifest[name] = introspect(name)
+            changed = True
+
+    if changed:
+        write(path, manifest)
+    return manifest
+
+
+
+def write(path, manifest):
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+
+def loadLazily(manager, manifest):
+    """
+    Subscribes the stand-ins for every plugin in a manifest.
+    """
+    for name, entry in sorted(manifest.items()):
+        manager.loadLazily(name, stubs(entry))
@@ -0,0 +1,169 @@
+"""
+Coalescing netsplits and the mass joins after them.
+
+When two servers split, everyone behind the other server quits with both
+server names as their quit message, and joins again once the servers are
+back. A ``NetsplitCoalescer`` collects those quits and joins, and hands them
+over as one batch per split once they stop coming in, so a split costs one
+event instead of thousands.
+"""
+import re
+
+from infobarb import events
+
+
+# Both server names, and nothing else. Servers prefix quit messages users
+# write themselves ("Quit: ..."), so users can't fake one of these.
+_SPLIT_MESSAGE = re.compile(r"^([\w-]+(?:\.[\w-]+)+) ([\w-]+(?:\.[\w-]+)+)$")
+
+ARGS = ("servers", "users")
+
+Netsplit = events.recordClass("netsplit", ARGS)
+Netjoin = events.recordClass("netjoin", ARGS)
+
+
+def splitServers(quitMessage):
+    """
+    Returns the two servers in a netsplit quit message, or None if it isn't
+    one.
+    """
+    match = _SPLIT_MESSAGE.match(quitMessage)
+    if match is None or match.group(1) == match.group(2):
+        return None
+    return match.groups()
+
+
+
+class _Batch(object):
+    __slots__ = ("items", "started", "call")
+
+    def __init__(self, started):
+        self.items = []
+        self.started = started
+        self.call = None
+
+
+
+class NetsplitCoalescer(object):
+    """
+    Batches netsplit quits and the joins of users coming back from a split.
+
+    A batch is handed over ``quietPeriod`` seconds after the last quit or
+    join in it, but never more than ``maxDelay`` seconds after the first.
+    ``onSplit(servers, nicks)`` gets split quits, and ``onJoin(servers,
+    joins)`` gets ``(nick, channel)`` pairs for users coming back. Users
+    that split are expected back for ``rejoinWindow`` seconds.
+    """
+    def __init__(self, onSplit, onJoin, clock=None, quietPeriod=1.0,
+                 maxDelay=5.0, rejoinWindow=1800):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+
+        self.onSplit = onSplit
+        self.onJoin = onJoin
+        self.quietPeriod = quietPeriod
+        self.maxDelay = maxDelay
+        self.rejoinWindow = rejoinWindow
+
+        self._splits = {}
+        self._joins = {}
+        # Nickname key -> (servers, when it split).
+        self._away = {}
+
+
+    def quit(self, nick, quitMessage):
+        """
+        Batches a quit if it's part of a netsplit.
+
+        Returns True if it was batched, and False if it's an ordinary quit
+        that should be handled right away.
+        """
+        servers = splitServers(quitMessage)
+        if servers is None:
+            return False
+
+        self._away[nick.lower()] = servers, self.clock.seconds()
+        self._add(self._splits, servers, nick, self._flushSplit)
+        return True
+
+
+    def joined(self, nick, channel):
+        """
+        Batches a join if the user is coming back from a netsplit.
+
+        Returns True if it was batched.
+        """
+        away = self._away.get(nick.lower())
+        if away is None:
+            return False
+
+        servers, splitAt = away
+        if self.clock.seconds() - splitAt > self.rejoinWindow:
+            self._expire()
+            return False
+
+        # Nobody should hear about users coming back before they left.
+        split = self._splits.get(servers)
+        if split is not None:
+            split.call.cancel()
+            self._flushSplit(servers)
+
+        self._add(self._joins, servers, (nick, channel), self._flushJoin)
+        return True
+
+
+    def _expire(self):
+        oldest = self.clock.seconds() - self.rejoinWindow
+        for key, (_, splitAt) in list(self._away.items()):
+            if splitAt < oldest:
+                del self._away[key]
+
+
+    def _add(self, batches, servers, item, flush):
+        now = self.clock.seconds()
+        batch = batches.get(servers)
+        if batch is None:
+            batch = batches[servers] = _Batch(now)
+
+        batch.items.append(item)
+        if batch.call is not None:
+            batch.call.cancel()
+
+        delay = min(self.quietPeriod, batch.started + self.maxDelay - now)
+        batch.call = self.clock.callLater(max(delay, 0), flush, servers)
+
+
+    def _flushSplit(self, servers):
+        batch = self._splits.pop(servers)
+        self._expire()
+        self.onSplit(servers, tuple(batch.items))
+
+
+    def _flushJoin(self, servers):
+        batch = self._joins.pop(servers)
+        for nick, _ in batch.items:
+            self._away.pop(nick.lower(), None)
+        self.onJoin(servers, tuple(batch.items))
+
+
+    def flush(self):
+        """
+        Hands over every pending batch now.
+        """
+        for batches, flush in [(self._splits, self._flushSplit),
+                               (self._joins, self._flushJoin)]:
+            for servers, batch in list(batches.items()):
+                batch.call.cancel()
+                flush(servers)
+
+
+    def stop(self):
+        """
+        Drops every pending batch, and forgets who split.
+        """
+        for batches in self._splits, self._joins:
+            for batch in batches.values():
+                batch.call.cancel()
+            batches.clear()
+        self._away.clear()
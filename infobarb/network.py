@@ -0,0 +1,129 @@
+"""
+Running connections to many IRC networks in one process.
+
+All networks share one set of hooks, so plugins are loaded once. Each network
+gets its own pangler bound to a ``Network``, so hooks see the network an
+event came from as their instance: ``self.name`` identifies it,
+``self.client`` is its current connection, ``self.http`` is the HTTP
+client all networks share, and ``self.logs`` is the searchable channel log,
+if there is one.
+"""
+from twisted.application import internet, service
+from twisted.internet import protocol
+
+from infobarb import irc, web
+
+
+class Network(object):
+    """
+    One IRC network the bot is connected to, or trying to connect to.
+
+    ``client`` is None while disconnected.
+    """
+    def __init__(self, name, sharedPangler, nickname, http=None, logs=None):
+        self.name = name
+        self.nickname = nickname
+        self.p = sharedPangler.share(self)
+        self.client = None
+        self.http = http
+        self.logs = logs
+
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.name)
+
+
+
+class InfobarbClientFactory(protocol.ReconnectingClientFactory):
+    """
+    Builds clients for a network, reconnecting with exponential backoff.
+    """
+    protocol = irc.InfobarbClient
+
+    def __init__(self, network, maxDelay=600):
+        self.network = network
+        self.maxDelay = maxDelay
+
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+
+        client = self.protocol(self.network.p)
+        client.factory = self
+        client.nickname = self.network.nickname
+        self.network.client = client
+        return client
+
+
+    def clientConnectionLost(self, connector, reason):
+        self.network.client = None
+        protocol.ReconnectingClientFactory.clientConnectionLost(
+            self, connector, reason)
+
+
+
+class ConnectionManager(service.MultiService):
+    """
+    A service that keeps connections to many networks in one reactor.
+
+    ``sharedPangler`` must be an ``infobarb.dispatch.Pangler``. Hooks
+    subscribed to it, before or after networks are added, receive events from
+    every network. Networks share ``http``, an ``infobarb.web.HTTPService``,
+    which is made if it isn't given, and ``logs``, an
+    ``infobarb.channellog.ChannelLog``, which logs their channel messages.
+    """
+    factoryClass = InfobarbClientFactory
+
+    def __init__(self, sharedPangler, http=None, logs=None):
+        service.MultiService.__init__(self)
+        self.p = sharedPangler
+        self.networks = {}
+
+        if http is None:
+            http = web.HTTPService()
+        self.http = http
+        http.setServiceParent(self)
+
+        self.logs = logs
+        if logs is not None:
+            logs.subscribe(sharedPangler)
+            logs.setServiceParent(self)
+
+
+    def addNetwork(self, name, host, port, nickname=irc.InfobarbClient.nickname,
+                   contextFactory=None, maxDelay=600):
+        """
+        Adds a network, and connects to it if the manager is running.
+
+        Connects over TLS when a ``contextFactory`` is given.
+        """
+        if name in self.networks:
+            raise KeyError("duplicate network name: %r" % (name,))
+
+        network = self.networks[name] = Network(name, self.p, nickname,
+                                                self.http, self.logs)
+        factory = network.factory = self.factoryClass(network, maxDelay)
+
+        if contextFactory is None:
+            connection = internet.TCPClient(host, port, factory)
+        else:
+            connection = internet.SSLClient(host, port, factory,
+                                            contextFactory)
+        connection.setName(name)
+        connection.setServiceParent(self)
+        return network
+
+
+    def removeNetwork(self, name):
+        """
+        Disconnects from a network and forgets about it.
+        """
+        network = self.networks.pop(name)
+        network.factory.stopTrying()
+        return self.removeService(self.getServiceNamed(name))
+
+
+    def stopService(self):
+        for network in self.networks.values():
+            network.factory.stopTrying()
+        return service.MultiService.stopService(self)
@@ -0,0 +1,246 @@
+"""
+Flood-controlled outbound messages.
+
+Messages are queued by priority and sent as token buckets allow: one for the
+whole connection, and one per target. High priority messages go before low
+priority ones, and targets within a priority take turns.
+"""
+from collections import OrderedDict, deque
+
+
+HIGH, NORMAL, LOW = PRIORITIES = range(3)
+
+MAX_LINE_BYTES = 512
+
+# Room for the prefix the server puts in front of our lines when relaying
+# them: ":nickname!username@hostname ", with generous guesses for each.
+PREFIX_ALLOWANCE = 96
+
+
+class TokenBucket(object):
+    """
+    A token bucket holding up to ``burst`` tokens, refilled at ``rate``
+    tokens per second.
+    """
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+
+    def wait(self, now):
+        """
+        Returns how long until a token is available.
+        """
+        self._refill(now)
+        # Allow for rounding, so waiting exactly as long as we were told is
+        # always enough.
+        if self.tokens >= 1 - 1e-9:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+    def take(self, now):
+        """
+        Takes a token. Check ``wait`` first.
+        """
+        self._refill(now)
+        self.tokens -= 1
+
+
+    def full(self, now):
+        """
+        Returns whether the bucket has refilled all the way, so it's no
+        different from a new one.
+        """
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+
+def splitMessage(message, maxBytes):
+    """
+    Splits a message into lines of at most ``maxBytes`` encoded bytes.
+
+    Newlines always split. Lines are split at the last space that fits if
+    there is one, and never inside a UTF-8 sequence. Unicode messages give
+    unicode lines; byte strings give byte strings.
+    """
+    isText = not isinstance(message, bytes)
+    encoded = message.encode("utf-8") if isText else message
+
+    lines = []
+    for line in encoded.splitlines():
+        while len(line) > maxBytes:
+            cut = line.rfind(b" ", 0, maxBytes + 1)
+            if cut <= 0:
+                cut = maxBytes
+                while cut > 0 and (ord(line[cut:cut + 1]) & 0xC0) == 0x80:
+                    cut -= 1
+            lines.append(line[:cut])
+            line = line[cut:].lstrip(b" ")
+
+        if line:
+            lines.append(line)
+
+    if isText:
+        return [piece.decode("utf-8") for piece in lines]
+    return lines
+
+
+
+class OutboundScheduler(object):
+    """
+    Queues outbound messages and sends them without flooding.
+
+    ``sendLine`` sends a raw line. Identical lines that are still pending for
+    the same target are sent once; dropped duplicates are counted in
+    ``duplicates``.
+
+    Targets only have a bucket while they could still be limited by it:
+    once a target's bucket has refilled and it has nothing queued, the
+    bucket is dropped.
+    """
+    def __init__(self, sendLine, clock=None, globalRate=1.0, globalBurst=5,
+                 targetRate=0.5, targetBurst=3,
+                 prefixAllowance=PREFIX_ALLOWANCE):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.sendLine = sendLine
+        self.clock = clock
+        self.targetRate = targetRate
+        self.targetBurst = targetBurst
+        self.prefixAllowance = prefixAllowance
+
+        self.duplicates = 0
+
+        self._globalBucket = TokenBucket(globalRate, globalBurst,
+                                         clock.seconds())
+        self._targetBuckets = {}
+        self._pruned = clock.seconds()
+        self._queues = [OrderedDict() for _ in PRIORITIES]
+        self._pending = set()
+        self._call = None
+
+
+    @property
+    def pending(self):
+        """
+        The number of lines waiting to be sent.
+        """
+        return len(self._pending)
+
+
+    def enqueue(self, command, target, message, priority=NORMAL):
+        """
+        Queues a message, split into as many lines as it takes.
+        """
+        header = "%s %s :" % (command, target)
+        maxBytes = (MAX_LINE_BYTES - len("\r\n") - len(header)
+                    - self.prefixAllowance)
+
+        queue = self._queues[priority]
+        for line in splitMessage(message, maxBytes):
+            key = command, target, line
+            if key in self._pending:
+                self.duplicates += 1
+                continue
+
+            self._pending.add(key)
+            lines = queue.get(target)
+            if lines is None:
+                lines = queue[target] = deque()
+            lines.append(key)
+
+        self._pump()
+
+
+    def stop(self):
+        """
+        Stops sending. Pending lines are forgotten.
+        """
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        for queue in self._queues:
+            queue.clear()
+        self._pending.clear()
+
+
+    def _pump(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        self._prune(self.clock.seconds())
+
+        while self._pending:
+            now = self.clock.seconds()
+            wait = self._globalBucket.wait(now)
+            if wait == 0:
+                wait = self._sendOne(now)
+            if wait:
+                self._call = self.clock.callLater(wait, self._pump)
+                return
+
+
+    def _prune(self, now):
+        """
+        Drops the buckets of targets that have nothing queued and have
+        refilled, at most once every time it takes a bucket to refill.
+        """
+        if now - self._pruned < self.targetBurst / float(self.targetRate):
+            return
+        self._pruned = now
+
+        for target, bucket in list(self._targetBuckets.items()):
+            if bucket.full(now) and not any(target in queue
+                                            for queue in self._queues):
+                del self._targetBuckets[target]
+
+
+    def _sendOne(self, now):
+        """
+        Sends the next line whose target bucket allows it.
+
+        Returns 0 if a line was sent, otherwise how long until one can be.
+        """
+        waits = []
+        for queue in self._queues:
+            for target in list(queue):
+                bucket = self._targetBuckets.get(target)
+                if bucket is None:
+                    bucket = self._targetBuckets[target] = TokenBucket(
+                        self.targetRate, self.targetBurst, now)
+
+                wait = bucket.wait(now)
+                if wait:
+                    waits.append(wait)
+                    continue
+
+                # Popping and putting the target back moves it to the end,
+                # so targets with the same priority take turns.
+                lines = queue.pop(target)
+                key = lines.popleft()
+                if lines:
+                    queue[target] = lines
+
+                bucket.take(now)
+                self._globalBucket.take(now)
+                self._pending.discard(key)
+
+                command, target, line = key
+                self.sendLine("%s %s :%s" % (command, target, line))
+                return 0
+
+        return min(waits)
@@ -0,0 +1,222 @@
+"""
+Write-behind persistence for plugin stores.
+
+Plugins that write on every message shouldn't pay for a transaction per
+message, inside the reactor. A ``WriteBehind`` buffers writes to one store
+and commits them in batches, in a single transaction, off the reactor.
+
+Stores are Axiom stores, or anything else with a compatible ``transact``
+method. Axiom stores, like the SQLite connections under them, must only
+ever be used from the thread that opened them, so every store gets a thread
+of its own: ``WriteBehind.opening`` opens the store there, and every batch
+and read runs there, one at a time.
+"""
+from twisted.application import service
+from twisted.internet import defer, threads
+from twisted.python import log
+from twisted.python.threadpool import ThreadPool
+
+
+class WriteBehind(object):
+    """
+    Buffers writes to a store and commits them in batches.
+
+    A batch is committed once ``maxPending`` writes are waiting, or
+    ``interval`` seconds after the first write of a batch, whichever comes
+    first.
+
+    The store is used from ``threadpool``, which must only have one thread.
+    If it is None, the buffer makes a thread pool of its own, which is
+    started when it's first needed and stopped by ``stop``, or when the
+    reactor shuts down.
+    """
+    def __init__(self, store, threadpool=None, reactor=None, maxPending=100,
+                 interval=1.0):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._ownThreadpool = threadpool is None
+        if threadpool is None:
+            threadpool = ThreadPool(1, 1, "WriteBehind")
+
+        self.store = store
+        self.threadpool = threadpool
+        self.reactor = reactor
+        self.maxPending = maxPending
+        self.interval = interval
+
+        self._pending = []
+        self._call = None
+        self._lock = defer.DeferredLock()
+        self._shutdownTrigger = None
+
+
+    @classmethod
+    def opening(cls, opener, *args, **kwargs):
+        """
+        Makes a buffer for the store ``opener()`` returns, calling it in the
+        thread the store will be used from.
+
+        Writes and reads can be queued right away; they run once the store
+        is open. The other arguments are the same as the constructor's.
+        """
+        writer = cls(None, *args, **kwargs)
+
+        def openStore():
+            writer.store = opener()
+
+        d = writer._lock.run(writer._deferToThread, openStore)
+        d.addErrback(log.err, "Opening a store with %r failed" % (opener,))
+        return writer
+
+
+    @property
+    def pending(self):
+        """
+        The number of writes that haven't been committed yet.
+        """
+        return len(self._pending)
+
+
+    def write(self, func, *args, **kwargs):
+        """
+        Queues a write: ``func(store, *args, **kwargs)``, to be called in a
+        transaction later.
+        """
+        self._pending.append((func, args, kwargs))
+
+        if len(self._pending) >= self.maxPending:
+            self.flush()
+        elif self._call is None:
+            self._call = self.reactor.callLater(self.interval, self.flush)
+
+
+    def read(self, func, *args, **kwargs):
+        """
+        Calls ``func(store, *args, **kwargs)`` on the thread pool, after all
+        writes queued so far, so it sees them.
+
+        Returns a Deferred that fires with the result.
+        """
+        self.flush()
+        return self._lock.run(self._inThread, func, *args, **kwargs)
+
+
+    def flush(self):
+        """
+        Commits all pending writes now.
+
+        Returns a Deferred that fires once they are committed.
+        """
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return self._lock.run(defer.succeed, None)
+
+        d = self._lock.run(self._inThread, self._commit, batch)
+        d.addErrback(log.err, "Committing %d writes to %r failed"
+                     % (len(batch), self.store))
+        return d
+
+
+    def stop(self):
+        """
+        Commits all pending writes, and then stops the thread pool, if the
+        buffer made it.
+
+        Returns a Deferred that fires once that's done.
+        """
+        return self.flush().addCallback(lambda _: self._stopThreadpool())
+
+
+    def _inThread(self, func, *args, **kwargs):
+        return self._deferToThread(func, self.store, *args, **kwargs)
+
+
+    def _deferToThread(self, func, *args, **kwargs):
+        if self._ownThreadpool and not self.threadpool.started:
+            self.threadpool.start()
+            self._shutdownTrigger = self.reactor.addSystemEventTrigger(
+                "during", "shutdown", self.threadpool.stop)
+        return threads.deferToThreadPool(self.reactor, self.threadpool,
+                                         func, *args, **kwargs)
+
+
+    def _stopThreadpool(self):
+        if self._shutdownTrigger is not None:
+            self.reactor.removeSystemEventTrigger(self._shutdownTrigger)
+            self._shutdownTrigger = None
+            self.threadpool.stop()
+
+
+    @staticmethod
+    def _commit(store, batch):
+        def runBatch():
+            for func, args, kwargs in batch:
+                func(store, *args, **kwargs)
+
+        store.transact(runBatch)
+
+
+
+class PersistenceService(service.Service):
+    """
+    Owns the write-behind buffers for all plugin stores.
+
+    Each buffer has a thread of its own, unless ``threadpool`` is given, in
+    which case they all share it; it must then only have one thread.
+    Everything pending is committed when the service stops.
+    """
+    def __init__(self, threadpool=None, reactor=None, maxPending=100,
+                 interval=1.0):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.threadpool = threadpool
+        self.reactor = reactor
+        self.maxPending = maxPending
+        self.interval = interval
+        self._writers = {}
+
+
+    def writerFor(self, store):
+        """
+        Returns the write-behind buffer for a store.
+        """
+        writer = self._writers.get(store)
+        if writer is None:
+            writer = self._writers[store] = WriteBehind(
+                store, self.threadpool, self.reactor, self.maxPending,
+                self.interval)
+        return writer
+
+
+    def writerOpening(self, opener):
+        """
+        Returns the write-behind buffer for the store ``opener()`` returns,
+        opening it in the buffer's thread the first time. See
+        ``WriteBehind.opening``.
+        """
+        writer = self._writers.get(opener)
+        if writer is None:
+            writer = self._writers[opener] = WriteBehind.opening(
+                opener, self.threadpool, self.reactor, self.maxPending,
+                self.interval)
+        return writer
+
+
+    def flush(self):
+        """
+        Commits everything pending, in every store.
+        """
+        return defer.gatherResults([writer.flush()
+                                    for writer in self._writers.values()])
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        return defer.gatherResults([writer.stop()
+                                    for writer in self._writers.values()])
@@ -0,0 +1,167 @@
+"""
+Loading and reloading plugins while the bot is running.
+
+A plugin is a module with a ``setup(p)`` function that subscribes its hooks
+to ``p``, directly or through a ``FancyInfobarbPangler`` or a
+``CommandRegistry``. It may also have a ``teardown()`` function, called when
+the plugin is unloaded or replaced by a new version.
+
+``setup`` gets a scratch pangler, not the live one. Once it has returned,
+the plugin's hooks are tagged with its name and swapped into the live
+pangler in one step. Since nothing else runs on the reactor thread in the
+meantime, every event is seen by either the old version of a plugin or the
+new one, exactly once. If loading the new version fails, the old one stays.
+
+Plugins can also be loaded lazily: stand-in hooks load the plugin the first
+time an event it wants comes in, and hand that event to its real hooks.
+"""
+import os
+import pkgutil
+import sys
+import types
+
+from infobarb import dispatch, routing
+
+
+def _loadModule(name):
+    """
+    Executes the current source of a module in a new module object, without
+    touching ``sys.modules``.
+    """
+    name = str(name)
+    loader = pkgutil.get_loader(name)
+    if loader is None:
+        raise ImportError("no plugin named %r" % (name,))
+
+    filename = loader.get_filename(name)
+    code = compile(loader.get_source(name), filename, "exec")
+
+    module = types.ModuleType(name)
+    module.__file__ = filename
+    if loader.is_package(name):
+        module.__path__ = [os.path.dirname(filename)]
+        module.__package__ = name
+    else:
+        module.__package__ = name.rpartition(".")[0]
+
+    exec(code, module.__dict__)
+    return module
+
+
+
+class PluginManager(object):
+    """
+    The plugins whose hooks are subscribed to a compiled pangler.
+
+    Use the pangler that all networks share, so a plugin is swapped
+    everywhere at once. Plugins are only dispatched to in the channels an
+    ``infobarb.enablement.PluginEnablement`` enables them in, if one is
+    given.
+    """
+    def __init__(self, pangler, enablement=None):
+        self.pangler = pangler
+        self.plugins = {}
+        self.lazy = set()
+
+        self.enablement = enablement
+        if enablement is not None:
+            pangler.restrict(enablement)
+
+
+    def load(self, name):
+        """
+        Loads the current version of a plugin, replacing the loaded one if
+        there is one.
+
+        Returns the new module.
+        """
+        module = _loadModule(name)
+        scratch = dispatch.Pangler()
+        module.setup(scratch)
+
+        old = self.plugins.get(name)
+        self.pangler.swap(name, scratch.hooks)
+        self.plugins[name] = sys.modules[name] = module
+
+        self.lazy.discard(name)
+
+        if old is not None:
+            self._teardown(old)
+        return module
+
+
+    reload = load
+
+
+    def loadLazily(self, name, stubs):
+        """
+        Subscribes stand-ins that load a plugin when it's first needed.
+
+        ``stubs`` are ``(eventName, argNames, prefix)`` triples: ``argNames``
+        are all the arguments of the event, and ``prefix`` is a literal
+        messages have to start with, or None. Plugins loaded this way aren't
+        imported until then.
+        """
+        scratch = dispatch.Pangler()
+        for eventName, argNames, prefix in stubs:
+            routeFilter = None
+            if prefix is not None:
+                routeFilter = routing.Filter(prefix=prefix)
+            self._subscribeStub(scratch, name, eventName, argNames,
+                                routeFilter)
+
+        self.pangler.swap(name, scratch.hooks)
+        self.lazy.add(name)
+
+
+    def _subscribeStub(self, scratch, name, eventName, argNames,
+                       routeFilter):
+        def stub(*prefix, **event):
+            if name not in self.lazy:
+                return
+
+            # The event that is being dispatched won't reach the new hooks,
+            # so give it to them here, through the pangler it came from.
+            # If one of them modifies it, the hooks after this stand-in get
+            # the modified event from here too.
+            firing = prefix[-1]
+            hooks = firing.hooks
+            later = [hook for hook in hooks[hooks.index(stubHook) + 1:]
+                     if getattr(hook, "owner", None) != name]
+
+            self.load(name)
+
+            eventName = event.pop("event")
+            argNames = tuple(sorted(event))
+            args = tuple([event[argName] for argName in argNames])
+            modified = firing.fireOnly(name, eventName, argNames, args)
+            if modified is None:
+                return
+            firing.finish(modified, later)
+            return dispatch.FINISHED
+
+        scratch.subscribe(stub, routeFilter, event=eventName,
+                          needs=list(argNames) + ["event"])
+        stubHook = scratch.hooks[-1]
+
+
+    def unload(self, name):
+        """
+        Unsubscribes all of a plugin's hooks.
+        """
+        if name not in self.plugins and name not in self.lazy:
+            raise KeyError(name)
+
+        self.pangler.swap(name, [])
+        self.lazy.discard(name)
+
+        module = self.plugins.pop(name, None)
+        if module is not None:
+            self._teardown(module)
+
+
+    @staticmethod
+    def _teardown(module):
+        teardown = getattr(module, "teardown", None)
+        if teardown is not None:
+            teardown()
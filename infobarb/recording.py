@@ -0,0 +1,308 @@
+"""
+Recording the events a client fires, and replaying them later.
+
+An ``EventLog`` is an append-only binary file of length-prefixed records,
+written through a memory map. The first time an event with a given name and
+arguments is logged, a shape record names them; event records after that
+refer to the shape by number and only hold a timestamp and the argument
+values.
+
+``attach`` logs every event an ``InfobarbClient`` fires, before any hook
+runs. ``replay`` fires a log back through a pangler, such as one with the
+default dispatch hooks and plugins subscribed, without any network.
+"""
+import mmap
+import os
+import struct
+
+from twisted.internet import defer
+
+from infobarb import dispatch
+
+
+MAGIC = b"IBEVLOG1"
+
+_LENGTH = struct.Struct("<I")
+_COUNT = struct.Struct("<I")
+_EVENT = struct.Struct("<Id")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+
+_SHAPE_RECORD = b"S"
+_EVENT_RECORD = b"E"
+
+
+def _encodeValue(value, parts):
+    if value is None:
+        parts.append(b"N")
+    elif isinstance(value, bytes):
+        parts.extend([b"B", _LENGTH.pack(len(value)), value])
+    elif isinstance(value, type(u"")):
+        encoded = value.encode("utf-8")
+        parts.extend([b"U", _LENGTH.pack(len(encoded)), encoded])
+    elif isinstance(value, bool):
+        parts.append(b"T" if value else b"F")
+    elif isinstance(value, (int, long)):
+        parts.extend([b"I", _INT.pack(value)])
+    elif isinstance(value, float):
+        parts.extend([b"D", _FLOAT.pack(value)])
+    elif isinstance(value, (list, tuple)):
+        parts.extend([b"L", _COUNT.pack(len(value))])
+        for item in value:
+            _encodeValue(item, parts)
+    else:
+        raise TypeError("can't log %r" % (value,))
+
+
+
+def _decodeValue(data, offset):
+    """
+    Returns a value and the offset just after it.
+    """
+    tag = data[offset:offset + 1]
+    offset += 1
+
+    if tag == b"N":
+        return None, offset
+    elif tag in (b"B", b"U"):
+        length, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        value = data[offset:offset + length]
+        if tag == b"U":
+            value = value.decode("utf-8")
+        return value, offset + length
+    elif tag in (b"T", b"F"):
+        return tag == b"T", offset
+    elif tag == b"I":
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    elif tag == b"D":
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    elif tag == b"L":
+        count, = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        items = []
+        for _ in range(count):
+            item, offset = _decodeValue(data, offset)
+            items.append(item)
+        return items, offset
+
+    raise ValueError("corrupt event log: unknown tag %r" % (tag,))
+
+
+
+def encode(value):
+    """
+    Encodes a value the way event logs do: ``None``, strings, numbers,
+    booleans and lists or tuples of those.
+    """
+    parts = []
+    _encodeValue(value, parts)
+    return b"".join(parts)
+
+
+
+def decode(data):
+    """
+    Decodes a value made by ``encode``. Tuples come back as lists.
+    """
+    value, _ = _decodeValue(data, 0)
+    return value
+
+
+
+class EventLog(object):
+    """
+    Writes events to a log file.
+
+    The file grows by at least ``chunkSize`` bytes at a time, and is cut
+    down to what was written when the log is closed. Logs that weren't
+    closed, say because the bot crashed, end in zeros, which readers treat
+    as the end of the log.
+    """
+    def __init__(self, path, chunkSize=1 << 20):
+        self.path = path
+        self.chunkSize = chunkSize
+        self._shapes = {}
+
+        self._file = open(path, "w+b")
+        self._size = 0
+        self._map = None
+        self._offset = 0
+        self._write(MAGIC)
+
+
+    def _grow(self, needed):
+        size = max(self._size * 2, self._size + self.chunkSize, needed)
+        if self._map is not None:
+            self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._size = size
+
+
+    def _write(self, data):
+        end = self._offset + len(data)
+        if end > self._size:
+            self._grow(end)
+        self._map[self._offset:end] = data
+        self._offset = end
+
+
+    def _writeRecord(self, parts):
+        body = b"".join(parts)
+        self._write(_LENGTH.pack(len(body)) + body)
+
+
+    def append(self, timestamp, eventName, argNames, args):
+        """
+        Logs an event.
+        """
+        shape = eventName, tuple(argNames)
+        number = self._shapes.get(shape)
+        if number is None:
+            number = self._shapes[shape] = len(self._shapes)
+            parts = [_SHAPE_RECORD]
+            _encodeValue([eventName] + list(argNames), parts)
+            self._writeRecord(parts)
+
+        parts = [_EVENT_RECORD, _EVENT.pack(number, timestamp)]
+        for value in args:
+            _encodeValue(value, parts)
+        self._writeRecord(parts)
+
+
+    def flush(self):
+        if self._map is not None:
+            self._map.flush()
+
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        self._file.truncate(self._offset)
+        self._file.close()
+
+
+
+def readEvents(path):
+    """
+    Yields ``(timestamp, eventName, argNames, args)`` for every event in a
+    log.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(MAGIC):
+            raise ValueError("%r isn't an event log" % (path,))
+        data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+    try:
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("%r isn't an event log" % (path,))
+
+        shapes = []
+        offset = len(MAGIC)
+        while offset + _LENGTH.size <= size:
+            length, = _LENGTH.unpack_from(data, offset)
+            if length == 0:
+                break
+
+            offset += _LENGTH.size
+            kind, end = data[offset:offset + 1], offset + length
+            if kind == _SHAPE_RECORD:
+                names, _ = _decodeValue(data, offset + 1)
+                shapes.append((names[0], tuple(names[1:])))
+            elif kind == _EVENT_RECORD:
+                number, timestamp = _EVENT.unpack_from(data, offset + 1)
+                eventName, argNames = shapes[number]
+
+                args, position = [], offset + 1 + _EVENT.size
+                while position < end:
+                    value, position = _decodeValue(data, position)
+                    args.append(value)
+                yield timestamp, eventName, argNames, tuple(args)
+            else:
+                raise ValueError("corrupt event log: unknown record %r"
+                                 % (kind,))
+            offset = end
+    finally:
+        data.close()
+
+
+
+def attach(client, log, clock=None):
+    """
+    Logs every event a client fires, before it is dispatched.
+    """
+    if clock is None:
+        from twisted.internet import reactor as clock
+
+    fire = client._fire
+
+    def recordingFire(eventName, argNames, args):
+        log.append(clock.seconds(), eventName, argNames, args)
+        fire(eventName, argNames, args)
+
+    client._fire = recordingFire
+
+
+
+def replay(path, pangler, speed=None, reactor=None):
+    """
+    Fires the events in a log through a pangler.
+
+    Events are fired as fast as possible if ``speed`` is None, or spaced out
+    like they were recorded, ``speed`` times faster. Returns a Deferred that
+    fires with the number of events fired, or fails with the first error a
+    hook or the log raised.
+    """
+    fire = dispatch.firer(pangler)
+    events = readEvents(path)
+
+    if speed is None:
+        def fireAll():
+            count = 0
+            for _, eventName, argNames, args in events:
+                fire(eventName, argNames, args)
+                count += 1
+            return count
+
+        return defer.maybeDeferred(fireAll)
+
+    if reactor is None:
+        from twisted.internet import reactor
+
+    d = defer.Deferred()
+    state = {"count": 0, "start": None}
+
+    def step(pending=None):
+        try:
+            if pending is not None:
+                _, eventName, argNames, args = pending
+                fire(eventName, argNames, args)
+                state["count"] += 1
+
+            for event in events:
+                timestamp = event[0]
+                if state["start"] is None:
+                    state["start"] = reactor.seconds(), timestamp
+
+                started, first = state["start"]
+                delay = (started + (timestamp - first) / speed
+                         - reactor.seconds())
+                if delay > 0:
+                    reactor.callLater(delay, step, event)
+                    return
+
+                _, eventName, argNames, args = event
+                fire(eventName, argNames, args)
+                state["count"] += 1
+        except Exception:
+            d.errback()
+            return
+
+        d.callback(state["count"])
+
+    step()
+    return d
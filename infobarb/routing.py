@@ -0,0 +1,246 @@
+"""
+Declarative filters for hooks, and the index that routes events to them.
+
+Most hooks only care about some channels, some users or messages that look
+like a command. Hooks that say so up front, with a ``Filter``, are indexed
+by channel and by literal message prefix on compiled panglers, so an event
+only costs anything for the hooks that can match it.
+"""
+import fnmatch
+import operator
+import re
+
+
+_FILTER_KWARGS = ("channels", "nick", "prefix", "pattern")
+
+
+class Filter(object):
+    """
+    What a hook wants to see.
+
+     * ``channels`` is an iterable of channel names, compared
+       case-insensitively.
+     * ``nick`` is a glob pattern for the nickname of the user.
+     * ``prefix`` is a literal the message has to start with.
+     * ``pattern`` is a regular expression, compiled or not, that has to
+       match somewhere in the message.
+
+    Events without the arguments a filter looks at never match it.
+    """
+    def __init__(self, channels=None, nick=None, prefix=None, pattern=None):
+        if channels is not None:
+            channels = frozenset(channel.lower() for channel in channels)
+        self.channels = channels
+
+        self.nick = nick
+        self._nickRegex = None
+        if nick is not None:
+            self._nickRegex = re.compile(fnmatch.translate(nick), re.I)
+
+        self.prefix = prefix
+
+        if pattern is not None and not hasattr(pattern, "search"):
+            pattern = re.compile(pattern)
+        self.pattern = pattern
+
+
+    @classmethod
+    def fromKwargs(cls, kwargs):
+        """
+        Pops filter arguments out of a dict of keyword arguments.
+
+        Returns None if there weren't any.
+        """
+        found = dict((key, kwargs.pop(key))
+                     for key in _FILTER_KWARGS if key in kwargs)
+        if not found:
+            return None
+        return cls(**found)
+
+
+    @property
+    def fields(self):
+        """
+        The event arguments this filter looks at.
+        """
+        fields = set()
+        if self.channels is not None:
+            fields.add("channel")
+        if self._nickRegex is not None:
+            fields.add("user")
+        if self.prefix is not None or self.pattern is not None:
+            fields.add("message")
+        return fields
+
+
+    def matches(self, channel=None, user=None, message=None):
+        if self.channels is not None:
+            if channel is None or channel.lower() not in self.channels:
+                return False
+
+        if self._nickRegex is not None:
+            if user is None:
+                return False
+            if self._nickRegex.match(user.split("!", 1)[0]) is None:
+                return False
+
+        if self.prefix is not None or self.pattern is not None:
+            if message is None:
+                return False
+            if self.prefix is not None:
+                if not message.startswith(self.prefix):
+                    return False
+            if self.pattern is not None:
+                if self.pattern.search(message) is None:
+                    return False
+
+        return True
+
+
+    def matchesEvent(self, event):
+        """
+        Checks an event dict, as a plain pangler has them.
+        """
+        if not all(field in event for field in self.fields):
+            return False
+        return self.matches(event.get("channel"), event.get("user"),
+                            event.get("message"))
+
+
+
+def filtered(func, routeFilter):
+    """
+    Wraps a hook so it is only called for events that pass a filter.
+
+    This is how filters work on plain panglers, which have no index. The
+    hook has to need the arguments the filter looks at.
+    """
+    def wrapper(*args, **kwargs):
+        if routeFilter.matchesEvent(kwargs):
+            return func(*args, **kwargs)
+
+    wrapper.__name__ = getattr(func, "__name__", "filtered")
+    wrapper.__module__ = getattr(func, "__module__", None)
+    return wrapper
+
+
+
+def subscribe(pangler, _func, routeFilter, **kwargs):
+    """
+    Subscribes a hook with a filter, on any pangler.
+
+    Compiled panglers index the filter; plain ones get a wrapped hook.
+    """
+    if getattr(pangler, "fire", None) is not None:
+        return pangler.subscribe(_func, routeFilter=routeFilter, **kwargs)
+
+    deco = pangler.subscribe(**kwargs)
+
+    def filteringDeco(func):
+        deco(filtered(func, routeFilter))
+        return func
+
+    if _func is not None:
+        filteringDeco(_func)
+    else:
+        return filteringDeco
+
+
+
+_position = operator.itemgetter(0)
+
+
+class RouteIndex(object):
+    """
+    Routes events of one shape to the dispatch entries that can match them.
+
+    Filtered entries are indexed by channel if their filter names channels,
+    by literal prefix if it has one, and checked on every event otherwise.
+    Entries for plugins that are only enabled in some channels are indexed
+    by those channels, and entries for plugins that are disabled in some
+    channels are dropped for events in them.
+    """
+    def __init__(self, indices):
+        self._channelIndex = indices.get("channel")
+        self._userIndex = indices.get("user")
+        self._messageIndex = indices.get("message")
+
+        self._always = []
+        self._scan = []
+        self._byChannel = {}
+        self._byPrefix = {}
+        self._prefixLengths = ()
+        self._excluded = {}
+
+
+    def add(self, entry, routeFilter, rule=None):
+        """
+        Adds a dispatch entry, in subscription order.
+
+        ``rule`` is the ``(enabled, exceptions)`` rule of the plugin the
+        entry belongs to, from ``PluginEnablement.rule``, if it has one.
+        """
+        channels = None
+        if routeFilter is not None:
+            channels = routeFilter.channels
+
+        if rule is not None:
+            enabled, exceptions = rule
+            if not enabled:
+                if channels is None:
+                    channels = exceptions
+                else:
+                    channels = channels & exceptions
+            elif channels is not None:
+                channels = channels - exceptions
+            else:
+                for channel in exceptions:
+                    self._excluded.setdefault(channel, set()).add(
+                        _position(entry))
+
+        if channels is not None:
+            for channel in channels:
+                self._byChannel.setdefault(channel, []).append(
+                    (entry, routeFilter))
+        elif routeFilter is None:
+            self._always.append((entry, None))
+        elif routeFilter.prefix:
+            self._byPrefix.setdefault(routeFilter.prefix, []).append(
+                (entry, routeFilter))
+            self._prefixLengths = sorted(set(map(len, self._byPrefix)))
+        else:
+            self._scan.append((entry, routeFilter))
+
+
+    def route(self, values):
+        """
+        Returns the entries whose filters pass, in subscription order.
+        """
+        channel = user = message = None
+        if self._channelIndex is not None:
+            channel = values[self._channelIndex]
+        if self._userIndex is not None:
+            user = values[self._userIndex]
+        if self._messageIndex is not None:
+            message = values[self._messageIndex]
+
+        candidates = self._always + self._scan
+        if channel is not None and self._byChannel:
+            candidates.extend(self._byChannel.get(channel.lower(), ()))
+        if message is not None:
+            byPrefix = self._byPrefix
+            for length in self._prefixLengths:
+                bucket = byPrefix.get(message[:length])
+                if bucket is not None:
+                    candidates.extend(bucket)
+
+        routed = [entry for entry, routeFilter in candidates
+                  if routeFilter is None
+                  or routeFilter.matches(channel, user, message)]
+        if channel is not None and self._excluded:
+            excluded = self._excluded.get(channel.lower())
+            if excluded:
+                routed = [entry for entry in routed
+                          if _position(entry) not in excluded]
+        routed.sort(key=_position)
+        return routed
@@ -0,0 +1,230 @@
+"""
+Who is where, with which modes, and what the topics are.
+
+InfobarbClient keeps a ``ChannelState`` up to date as it sees NAMES replies,
+joins, parts, quits, kicks, nick changes, mode changes and topics, so plugins
+can ask instead of sending NAMES or WHO themselves.
+"""
+
+
+def _key(name):
+    return name.lower()
+
+
+
+class _Channel(object):
+    __slots__ = ("name", "members", "topic")
+
+    def __init__(self, name):
+        self.name = name
+        # Nickname key -> string of member mode letters, like "o" or "".
+        self.members = {}
+        self.topic = None
+
+
+
+class ChannelState(object):
+    """
+    Channel membership, member modes and topics for the channels we're in.
+
+    Names are compared case-insensitively. Lookups by nickname or channel
+    are constant time. Memory per member is one dict entry in its channel
+    and one set entry for the nickname, plus one shared copy of each
+    nickname.
+    """
+    def __init__(self, intern=None):
+        self._intern = intern if intern is not None else (lambda s: s)
+        self._channels = {}
+        self._nicks = {}
+        self._displayNames = {}
+
+
+    def clear(self):
+        """
+        Forgets everything, for example after a disconnect.
+        """
+        self._channels.clear()
+        self._nicks.clear()
+        self._displayNames.clear()
+
+
+    # Queries
+
+    def channels(self):
+        """
+        Returns the names of the channels we know about.
+        """
+        return [channel.name for channel in self._channels.values()]
+
+
+    def members(self, channel):
+        """
+        Returns the nicknames of the members of a channel.
+        """
+        state = self._channels.get(_key(channel))
+        if state is None:
+            return []
+        return [self._displayNames[nick] for nick in state.members]
+
+
+    def isOn(self, nick, channel):
+        state = self._channels.get(_key(channel))
+        return state is not None and _key(nick) in state.members
+
+
+    def channelsOf(self, nick):
+        """
+        Returns the names of the channels we share with a nickname.
+        """
+        keys = self._nicks.get(_key(nick), ())
+        return [self._channels[key].name for key in keys]
+
+
+    def modes(self, nick, channel):
+        """
+        Returns a nickname's member mode letters in a channel, or None if
+        it isn't there.
+        """
+        state = self._channels.get(_key(channel))
+        if state is None:
+            return None
+        return state.members.get(_key(nick))
+
+
+    def isOp(self, nick, channel):
+        return "o" in (self.modes(nick, channel) or "")
+
+
+    def isVoiced(self, nick, channel):
+        return "v" in (self.modes(nick, channel) or "")
+
+
+    def topic(self, channel):
+        state = self._channels.get(_key(channel))
+        if state is None:
+            return None
+        return state.topic
+
+
+    # Updates
+
+    def _addMember(self, nick, channelKey, modes=""):
+        nickKey = _key(nick)
+        self._displayNames[nickKey] = self._intern(nick)
+        self._channels[channelKey].members[nickKey] = modes
+        self._nicks.setdefault(nickKey, set()).add(channelKey)
+
+
+    def _removeMember(self, nickKey, channelKey):
+        state = self._channels.get(channelKey)
+        if state is not None:
+            state.members.pop(nickKey, None)
+
+        channels = self._nicks.get(nickKey)
+        if channels is not None:
+            channels.discard(channelKey)
+            if not channels:
+                del self._nicks[nickKey]
+                del self._displayNames[nickKey]
+
+
+    def _channel(self, channel):
+        channelKey = _key(channel)
+        if channelKey not in self._channels:
+            self._channels[channelKey] = _Channel(self._intern(channel))
+        return channelKey
+
+
+    def namesReply(self, channel, names, prefixes):
+        """
+        Adds members from a NAMES reply.
+
+        ``names`` are nicknames with their status prefixes, like ``"@lvh"``.
+        ``prefixes`` maps status prefixes to mode letters.
+        """
+        channelKey = self._channel(channel)
+        for name in names:
+            modes = ""
+            while name and name[0] in prefixes:
+                modes += prefixes[name[0]]
+                name = name[1:]
+            if name:
+                self._addMember(name, channelKey, modes)
+
+
+    def joined(self, nick, channel):
+        self._addMember(nick, self._channel(channel))
+
+
+    def left(self, nick, channel):
+        self._removeMember(_key(nick), _key(channel))
+
+
+    def quit(self, nick):
+        """
+        Removes a nickname from all channels.
+
+        Returns the names of the channels it was in.
+        """
+        nickKey = _key(nick)
+        keys = list(self._nicks.get(nickKey, ()))
+        for channelKey in keys:
+            self._removeMember(nickKey, channelKey)
+        return [self._channels[key].name for key in keys]
+
+
+    def forgetChannel(self, channel):
+        """
+        Forgets a channel, because we're not in it anymore.
+        """
+        channelKey = _key(channel)
+        state = self._channels.get(channelKey)
+        if state is None:
+            return
+
+        for nickKey in list(state.members):
+            self._removeMember(nickKey, channelKey)
+        del self._channels[channelKey]
+
+
+    def renamed(self, oldNick, newNick):
+        oldKey, newKey = _key(oldNick), _key(newNick)
+        channels = self._nicks.pop(oldKey, None)
+        if channels is None:
+            return
+
+        del self._displayNames[oldKey]
+        self._displayNames[newKey] = self._intern(newNick)
+        self._nicks[newKey] = channels
+        for channelKey in channels:
+            members = self._channels[channelKey].members
+            members[newKey] = members.pop(oldKey)
+
+
+    def modeChanged(self, channel, set, modes, args, memberModes="ohv"):
+        """
+        Applies the member modes, like op and voice, in a mode change.
+
+        ``memberModes`` are the mode letters that apply to a member.
+        """
+        state = self._channels.get(_key(channel))
+        if state is None:
+            return
+
+        for mode, arg in zip(modes, args):
+            if mode not in memberModes or arg is None:
+                continue
+
+            nickKey = _key(arg)
+            current = state.members.get(nickKey)
+            if current is None:
+                continue
+
+            if set and mode not in current:
+                state.members[nickKey] = current + mode
+            elif not set:
+                state.members[nickKey] = current.replace(mode, "")
+
+
+    def topicUpdated(self, channel, topic):
+        self._channels[self._channel(channel)].topic = topic
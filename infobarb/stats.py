@@ -0,0 +1,162 @@
+"""
+Per-hook timing and accounting.
+
+Instrumentation is switched on per compiled pangler with
+``Pangler.instrument``. While it is off, hooks are called exactly as before,
+with no per-call overhead.
+"""
+import fnmatch
+import timeit
+import weakref
+
+
+_CALLS, _TOTAL, _MAX, _ERRORS = range(4)
+
+
+def hookName(func):
+    """
+    A readable name for a hook.
+
+    Names are only for display: different hooks can have the same name.
+    """
+    name = getattr(func, "__name__", None)
+    if name is None:
+        return repr(func)
+
+    module = getattr(func, "__module__", None)
+    if module is None:
+        return name
+    return "%s.%s" % (module, name)
+
+
+
+class HookStats(object):
+    """
+    Call counts, wall time and exception counts per event and hook.
+
+    Counts are kept per subscription, so hooks with the same name, like two
+    lambdas, are counted separately. They go away when the hook does.
+    """
+    timer = staticmethod(timeit.default_timer)
+
+    def __init__(self):
+        # Hook -> {event name: counter}.
+        self._counters = weakref.WeakKeyDictionary()
+
+
+    def wrap(self, eventName, hook, func):
+        """
+        Wraps a hook's callable so its calls for an event get counted.
+        """
+        counters = self._counters.get(hook)
+        if counters is None:
+            counters = self._counters[hook] = {}
+        counter = counters.get(eventName)
+        if counter is None:
+            counter = counters[eventName] = [0, 0.0, 0.0, 0]
+
+        timer = self.timer
+
+        def instrumented(*args, **kwargs):
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            except:
+                counter[_ERRORS] += 1
+                raise
+            finally:
+                elapsed = timer() - start
+                counter[_CALLS] += 1
+                counter[_TOTAL] += elapsed
+                if elapsed > counter[_MAX]:
+                    counter[_MAX] = elapsed
+
+        return instrumented
+
+
+    def snapshot(self):
+        """
+        Returns the current counts, most expensive hooks first.
+
+        Each entry is a dict with ``event``, ``hook``, ``calls``,
+        ``totalTime``, ``maxTime`` and ``errors`` keys. Times are in seconds.
+        """
+        entries = []
+        for hook, counters in self._counters.items():
+            name = hookName(hook.func)
+            for eventName, counter in counters.items():
+                entries.append({
+                    "event": eventName,
+                    "hook": name,
+                    "calls": counter[_CALLS],
+                    "totalTime": counter[_TOTAL],
+                    "maxTime": counter[_MAX],
+                    "errors": counter[_ERRORS],
+                })
+
+        entries.sort(key=lambda entry: entry["totalTime"], reverse=True)
+        return entries
+
+
+    def reset(self):
+        """
+        Zeroes all counts.
+        """
+        for counters in self._counters.values():
+            for counter in counters.values():
+                counter[:] = [0, 0.0, 0.0, 0]
+
+
+    def report(self, limit=5):
+        """
+        Returns a few lines describing the most expensive hooks.
+        """
+        entries = self.snapshot()[:limit]
+        if not entries:
+            return ["no hook statistics recorded"]
+
+        return ["%(hook)s on %(event)s: %(calls)d calls, "
+                "%(totalMs).1f ms total, %(maxMs).1f ms max, "
+                "%(errors)d errors"
+                % dict(entry, totalMs=entry["totalTime"] * 1000,
+                       maxMs=entry["maxTime"] * 1000)
+                for entry in entries]
+
+
+
+def addStatsCommand(boundPangler, stats, admins, command="stats"):
+    """
+    Adds a private message command for admins to inspect hook statistics.
+
+    ``admins`` are hostmask patterns, like ``"lvh!*@example.com"``. The
+    command takes an optional argument: ``on`` and ``off`` switch
+    instrumentation on the pangler, ``reset`` zeroes the counts and no
+    argument replies with the most expensive hooks.
+    """
+    def statsCommand(self, p, user, message):
+        words = message.split()
+        if not words or words[0] != command:
+            return
+
+        if not any(fnmatch.fnmatchcase(user, mask) for mask in admins):
+            return
+
+        argument = words[1] if len(words) > 1 else None
+        if argument == "on":
+            p.instrument(stats)
+            lines = ["hook statistics on"]
+        elif argument == "off":
+            p.instrument(None)
+            lines = ["hook statistics off"]
+        elif argument == "reset":
+            stats.reset()
+            lines = ["hook statistics reset"]
+        else:
+            lines = stats.report()
+
+        nick = user.split("!", 1)[0]
+        for line in lines:
+            self.client.msg(nick, line)
+
+    boundPangler.subscribe(statsCommand, event="privateMessageReceived",
+                           needs=("user", "message"))
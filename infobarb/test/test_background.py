@@ -0,0 +1,275 @@
+"""
+Tests for running hooks off the reactor.
+"""
+from twisted.internet import defer, task
+from twisted.python import failure
+from twisted.trial import unittest
+
+from infobarb import background, dispatch, irc
+
+
+class SynchronousThreadPool(object):
+    """
+    A thread pool that runs everything right away, in the calling thread.
+    """
+    def __init__(self):
+        self.calls = []
+
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kwargs):
+        self.calls.append((func, args, kwargs))
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            onResult(False, failure.Failure())
+        else:
+            onResult(True, result)
+
+
+
+class SynchronousReactor(object):
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+
+class DeferredHook(object):
+    """
+    A hook that returns a Deferred per call and keeps them around.
+    """
+    def __init__(self):
+        self.calls = []
+
+
+    def __call__(self, *args, **kwargs):
+        d = defer.Deferred()
+        self.calls.append(((args, kwargs), d))
+        return d
+
+
+
+class OffReactorHookTestCase(unittest.TestCase):
+    def setUp(self):
+        self.func = DeferredHook()
+        self.hook = background.OffReactorHook(self.func, concurrency=2,
+                                              queueDepth=1)
+
+
+    def test_concurrencyLimit(self):
+        """
+        Calls beyond the concurrency limit wait until a running one finishes.
+        """
+        for i in range(3):
+            self.hook(i)
+
+        self.assertEqual(len(self.func.calls), 2)
+        self.assertEqual(self.hook.running, 2)
+        self.assertEqual(self.hook.pending, 1)
+
+        self.func.calls[0][1].callback(None)
+        self.assertEqual(len(self.func.calls), 3)
+        self.assertEqual(self.func.calls[2][0], ((2,), {}))
+        self.assertEqual(self.hook.pending, 0)
+
+
+    def test_overflowDropped(self):
+        """
+        Calls that don't fit in the queue are dropped and counted.
+        """
+        for i in range(5):
+            self.hook(i)
+
+        self.assertEqual(self.hook.dropped, 2)
+        self.assertEqual(self.hook.pending, 1)
+
+
+    def test_errorsLogged(self):
+        """
+        A failing call is logged and frees its slot.
+        """
+        self.hook(1)
+        self.func.calls[0][1].errback(RuntimeError("boom"))
+
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual(self.hook.running, 0)
+
+
+    def test_synchronousResult(self):
+        """
+        A callable that doesn't return a Deferred finishes right away.
+        """
+        calls = []
+        hook = background.OffReactorHook(calls.append)
+        hook(1)
+        hook(2)
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(hook.running, 0)
+
+
+    def test_invalidConcurrency(self):
+        self.assertRaises(ValueError, background.OffReactorHook, self.func,
+                          concurrency=0)
+
+
+    def test_threadPool(self):
+        """
+        With a thread pool, the callable runs in the pool.
+        """
+        pool = SynchronousThreadPool()
+        calls = []
+        hook = background.OffReactorHook(calls.append, threadpool=pool,
+                                         reactor=SynchronousReactor())
+        hook(1)
+
+        self.assertEqual(pool.calls, [(calls.append, (1,), {})])
+        self.assertEqual(calls, [1])
+        self.assertEqual(hook.running, 0)
+
+
+
+class OffReactorShortcutTestCase(unittest.TestCase):
+    def test_shortcut(self):
+        """
+        Off-reactor hooks can be subscribed with the fancy shortcuts, and
+        don't hold up the hooks after them.
+        """
+        p = dispatch.Pangler()
+        f = irc.FancyInfobarbPangler(p)
+        slow, fast = DeferredHook(), []
+
+        f.onUserJoin(background.offReactor()(slow))
+        f.onUserJoin(lambda p, **kwargs: fast.append(kwargs))
+        p.trigger(event="userJoined", user="lvh", channel="#python")
+
+        kwargs = {"user": "lvh", "channel": "#python"}
+        self.assertEqual(slow.calls[0][0], ((p,), kwargs))
+        self.assertEqual(fast, [kwargs])
+
+
+
+class CooperativeWorkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.work = background.CooperativeWork(budget=1.0, interval=0.5,
+                                               reactor=self.clock)
+        # Every step takes a second, so each tick takes one step.
+        self.work.timer = self.clock.seconds
+        self.steps = []
+
+
+    def _job(self, name, count):
+        for i in range(count):
+            self.steps.append((name, i))
+            self.clock.rightNow += 1
+            yield
+
+
+    def _ticks(self, count):
+        for _ in range(count):
+            self.clock.advance(self.work.interval)
+
+
+    def test_stepsPerTick(self):
+        d = self.work.cooperate(self._job("a", 3))
+        self._ticks(2)
+        self.assertEqual(self.steps, [("a", 0), ("a", 1)])
+        self.assertNoResult(d)
+
+        self._ticks(2)
+        self.successResultOf(d)
+        self.assertEqual(self.work.pending, 0)
+
+
+    def test_fairAcrossOwners(self):
+        """
+        Owners take turns, however many jobs each of them has.
+        """
+        for name in "abc":
+            self.work.cooperate(self._job(name, 2), owner="busy")
+        self.work.cooperate(self._job("x", 2), owner="quiet")
+        self._ticks(4)
+        self.assertEqual(self.steps,
+                         [("a", 0), ("x", 0), ("b", 0), ("x", 1)])
+
+
+    def test_error(self):
+        def broken():
+            yield
+            raise RuntimeError()
+
+        d = self.work.cooperate(broken())
+        self._ticks(3)
+        self.failureResultOf(d, RuntimeError)
+        self.assertEqual(self.work.pending, 0)
+
+
+    def test_deferredPauses(self):
+        waiting = defer.Deferred()
+
+        def waits():
+            yield waiting
+            self.steps.append("resumed")
+
+        self.work.cooperate(waits(), owner="a")
+        self._ticks(3)
+        self.assertEqual(self.steps, [])
+
+        waiting.callback(None)
+        self._ticks(3)
+        self.assertEqual(self.steps, ["resumed"])
+
+
+    def test_stop(self):
+        d = self.work.cooperate(self._job("a", 3))
+        self.work.stop()
+        self.failureResultOf(d, task.SchedulerStopped)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_cooperateAfterStop(self):
+        self.work.stop()
+        d = self.work.cooperate(self._job("a", 3), owner="a")
+        self.failureResultOf(d, task.SchedulerStopped)
+        self.assertEqual(self.work.pending, 0)
+        self.assertEqual(self.steps, [])
+
+
+
+class CooperativeHookTestCase(unittest.TestCase):
+    def test_hook(self):
+        """
+        Cooperative hooks return at once, and their generators run later,
+        owned by the hook's module.
+        """
+        clock = task.Clock()
+        work = background.CooperativeWork(reactor=clock)
+        steps = []
+
+        def hook(p, x):
+            steps.append(x)
+            yield
+            steps.append(x + 1)
+
+        p = dispatch.Pangler()
+        p.subscribe(background.cooperative(work)(hook), event="foo",
+                    needs=["x"])
+        p.trigger(event="foo", x=1)
+        self.assertEqual(steps, [])
+        self.assertEqual(list(work._owners), [__name__])
+
+        clock.advance(work.interval)
+        self.assertEqual(steps, [1, 2])
+        self.assertEqual(work.pending, 0)
+
+
+    def test_errorsLogged(self):
+        work = background.CooperativeWork(reactor=task.Clock())
+
+        def hook(p, x):
+            raise RuntimeError()
+            yield
+
+        hook = background.CooperativeHook(hook, work)
+        hook(None, x=1)
+        work.reactor.advance(work.interval)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
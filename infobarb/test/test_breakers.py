@@ -0,0 +1,222 @@
+"""
+Tests for hook circuit breakers and rate limits.
+"""
+from twisted.internet import task
+from twisted.trial import unittest
+
+from infobarb import breakers, dispatch, irc, stats
+from infobarb.test.test_dispatch import Recorder
+
+
+class CircuitBreakersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.breakers = breakers.CircuitBreakers(
+            window=4, minCalls=4, failureRate=0.5, slowCall=0.5,
+            coolDown=10, clock=self.clock)
+        self.p = dispatch.Pangler()
+        self.p.protect(self.breakers)
+
+        self.recorder = Recorder()
+        self.p.subscribe(self.recorder.hook("opened"), event="circuitOpened",
+                         needs=breakers.ARGS)
+        self.p.subscribe(self.recorder.hook("closed"), event="circuitClosed",
+                         needs=breakers.ARGS)
+
+        self.failing = False
+        self.delay = 0
+        self.calls = []
+        self.p.subscribe(self.flaky, event="foo", needs=["x"])
+        self.p.subscribe(self.recorder.hook("after"), event="foo",
+                         needs=["x"])
+
+
+    def flaky(self, p, x):
+        self.calls.append(x)
+        self.clock.advance(self.delay)
+        if self.failing:
+            raise RuntimeError()
+
+
+    def _trips(self):
+        return [(name, kwargs) for name, _, kwargs in self.recorder.calls
+                if name != "after"]
+
+
+    def _fire(self, count=1):
+        for i in range(count):
+            self.p.trigger(event="foo", x=i)
+
+
+    def test_errorsLogged(self):
+        """
+        Hooks after a failing one still see the event.
+        """
+        self.failing = True
+        self._fire()
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        self.assertEqual([name for name, _, _ in self.recorder.calls],
+                         ["after"])
+
+
+    def test_opensOnErrors(self):
+        self._fire(2)
+        self.failing = True
+        self._fire(2)
+        self.flushLoggedErrors(RuntimeError)
+
+        name = stats.hookName(self.flaky)
+        self.assertEqual(self._trips(), [
+            ("opened", {"hook": name, "owner": None,
+                        "reason": breakers.ERRORS}),
+        ])
+
+        del self.calls[:]
+        self._fire(3)
+        self.assertEqual(self.calls, [])
+
+
+    def test_belowThreshold(self):
+        self._fire(3)
+        self.failing = True
+        self._fire()
+        self.failing = False
+        self._fire(4)
+        self.flushLoggedErrors(RuntimeError)
+        self.assertEqual(self._trips(), [])
+
+
+    def test_opensOnSlowCalls(self):
+        self.delay = 1
+        self._fire(4)
+        self.assertEqual([kwargs["reason"] for _, kwargs in self._trips()],
+                         [breakers.SLOW])
+
+
+    def test_trialCall(self):
+        """
+        After the cool-down, a failed trial call keeps the circuit open, and
+        a good one closes it.
+        """
+        self.failing = True
+        self._fire(4)
+        self.clock.advance(10)
+
+        del self.calls[:]
+        self._fire(2)
+        self.assertEqual(self.calls, [0])
+        self.clock.advance(10)
+
+        self.failing = False
+        self._fire(2)
+        self.assertEqual(self.calls, [0, 0, 1])
+        self.assertEqual([name for name, _ in self._trips()],
+                         ["opened", "closed"])
+        self.flushLoggedErrors(RuntimeError)
+
+
+    def test_snapshot(self):
+        self.failing = True
+        self._fire(5)
+        self.flushLoggedErrors(RuntimeError)
+        [entry] = [entry for entry in self.breakers.snapshot()
+                   if entry["hook"] == stats.hookName(self.flaky)]
+        self.assertEqual(entry["calls"], 4)
+        self.assertEqual(entry["failures"], 4)
+        self.assertEqual(entry["skipped"], 1)
+        self.assertTrue(entry["open"])
+
+
+    def test_unprotect(self):
+        self.p.protect(None)
+        self.failing = True
+        self.assertRaises(RuntimeError, self._fire)
+
+
+
+class RateLimitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.breakers = breakers.CircuitBreakers(clock=self.clock)
+        self.p = dispatch.Pangler()
+        self.p.protect(self.breakers)
+        self.calls = []
+
+
+    def hook(self, p, x):
+        self.calls.append(x)
+
+
+    def _fire(self, count):
+        for i in range(count):
+            self.p.trigger(event="foo", x=i)
+
+
+    def test_byOwner(self):
+        scratch = dispatch.Pangler()
+        scratch.subscribe(self.hook, event="foo", needs=["x"])
+        self.p.swap("plugin", scratch.hooks)
+        self.breakers.limit("plugin", 2)
+
+        self._fire(5)
+        self.assertEqual(self.calls, [0, 1])
+        self.clock.advance(1)
+        self._fire(5)
+        self.assertEqual(self.calls, [0, 1, 0, 1])
+
+
+    def test_byHook(self):
+        self.breakers.limit(self.hook, 1, burst=3)
+        self.p.subscribe(self.hook, event="foo", needs=["x"])
+        self._fire(5)
+        self.assertEqual(self.calls, [0, 1, 2])
+
+
+    def test_sameName(self):
+        """
+        Capping a hook doesn't cap other hooks with the same name.
+        """
+        recorder = Recorder()
+        hooks = [recorder.hook("first"), recorder.hook("second")]
+        self.assertEqual(*[stats.hookName(hook) for hook in hooks])
+        for hook in hooks:
+            self.p.subscribe(hook, event="foo", needs=["x"])
+
+        self.breakers.limit(hooks[0], 1)
+        self._fire(2)
+        self.assertEqual([name for name, _, _ in recorder.calls],
+                         ["first", "second", "second"])
+
+
+    def test_removeLimit(self):
+        self.p.subscribe(self.hook, event="foo", needs=["x"])
+        self.breakers.limit(self.hook, 1)
+        self._fire(2)
+        self.breakers.limit(self.hook, None)
+        self._fire(2)
+        self.assertEqual(self.calls, [0, 0, 1])
+
+
+    def test_shared(self):
+        """
+        Panglers sharing hooks share their limits.
+        """
+        recorder = Recorder()
+        hook = recorder.hook("foo")
+        self.p.subscribe(hook, event="foo", needs=["x"])
+        self.breakers.limit(hook, 1)
+        self.p.share(object()).trigger(event="foo", x=0)
+        self._fire(1)
+        self.assertEqual(len(recorder.calls), 1)
+
+
+
+class ShortcutTestCase(unittest.TestCase):
+    def test_shortcuts(self):
+        p = dispatch.Pangler()
+        f = irc.FancyInfobarbPangler(p)
+        recorder = Recorder()
+        f.onCircuitOpen(recorder.hook("opened"))
+        p.trigger(event="circuitOpened", hook="h", owner="o", reason="r")
+        [(_, _, kwargs)] = recorder.calls
+        self.assertEqual(kwargs, {"hook": "h", "owner": "o", "reason": "r"})
@@ -0,0 +1,188 @@
+"""
+Tests for the searchable channel log.
+"""
+import os
+
+from twisted.trial import unittest
+
+from infobarb import channellog, dispatch
+from infobarb.test.test_background import SynchronousThreadPool
+from infobarb.test.test_persistence import FakeReactor
+
+
+# Midnight, June 1st and July 1st 2013, UTC.
+JUNE = 1370044800
+JULY = 1372636800
+
+
+class MatchExpressionTestCase(unittest.TestCase):
+    def test_quoted(self):
+        self.assertEqual(channellog.matchExpression('twisted "deferred'),
+                         u'"twisted" """deferred"')
+
+
+    def test_syntax(self):
+        """
+        Query syntax is searched for like any other text.
+        """
+        self.assertEqual(channellog.matchExpression("a OR b*"),
+                         u'"a" "OR" "b*"')
+
+
+    def test_empty(self):
+        self.assertEqual(channellog.matchExpression("  "), u"")
+
+
+
+class ChannelLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = self.mktemp()
+        self.reactor = FakeReactor()
+        self.log = channellog.ChannelLog(
+            self.directory, threadpool=SynchronousThreadPool(),
+            reactor=self.reactor, maxPending=3, interval=5.0)
+        self.addCleanup(self.log.stopService)
+
+
+    def _search(self, *args, **kwargs):
+        results = []
+        self.log.search(*args, **kwargs).addCallback(results.append)
+        return results[0]
+
+
+    def _messages(self, page):
+        return [message.message for message in page.messages]
+
+
+    def test_batched(self):
+        """
+        Messages are written in batches, but searches see all of them.
+        """
+        self.log.log("freenode", "#python", "lvh!l@h", "hello world")
+        self.assertEqual(self.log.writer.pending, 1)
+        self.assertEqual(self._messages(self._search("hello")),
+                         [u"hello world"])
+        self.assertEqual(self.log.writer.pending, 0)
+
+
+    def test_message(self):
+        self.log.log("freenode", "#Python", "lvh!l@h", "hi there", when=JUNE)
+        [message] = self._search("hi").messages
+        self.assertEqual(message, channellog.Message(
+            JUNE, u"freenode", u"#python", u"lvh!l@h", u"hi there"))
+
+
+    def test_allTerms(self):
+        self.log.log("freenode", "#python", "lvh!l@h", "deferred callbacks")
+        self.log.log("freenode", "#python", "lvh!l@h", "deferred errbacks")
+        self.assertEqual(self._messages(self._search("deferred errbacks")),
+                         [u"deferred errbacks"])
+        self.assertEqual(self._search("").messages, [])
+
+
+    def test_filters(self):
+        self.log.log("freenode", "#python", "lvh!l@h", "spam")
+        self.log.log("freenode", "#twisted", "lvh!l@h", "spam")
+        self.log.log("oftc", "#python", "dash!d@h", "spam")
+
+        def users(**kwargs):
+            return [(message.network, message.channel, message.user)
+                    for message in self._search("spam", **kwargs).messages]
+
+        self.assertEqual(users(channel="#PYTHON"), [
+            (u"oftc", u"#python", u"dash!d@h"),
+            (u"freenode", u"#python", u"lvh!l@h"),
+        ])
+        self.assertEqual(users(network="freenode", channel="#python"),
+                         [(u"freenode", u"#python", u"lvh!l@h")])
+        self.assertEqual(users(nick="Dash"),
+                         [(u"oftc", u"#python", u"dash!d@h")])
+
+
+    def test_undecodable(self):
+        self.log.log("freenode", "#python", "lvh!l@h", "caf\xe9 latte")
+        self.assertEqual(self._messages(self._search("latte")),
+                         [u"caf\ufffd latte"])
+
+
+    def test_partitioned(self):
+        self.log.log("freenode", "#python", "lvh!l@h", "june spam", JUNE)
+        self.log.log("freenode", "#python", "lvh!l@h", "july spam", JULY)
+        self.log.writer.flush()
+        self.assertEqual([name for name in sorted(os.listdir(self.directory))
+                          if name.endswith(".sqlite")],
+                         ["2013-06.sqlite", "2013-07.sqlite"])
+        self.assertEqual(self._messages(self._search("spam")),
+                         [u"july spam", u"june spam"])
+
+
+    def test_pages(self):
+        """
+        Pages continue where the last one stopped, across partitions.
+        """
+        for i in range(3):
+            self.log.log("freenode", "#python", "lvh!l@h",
+                         "june spam %d" % i, JUNE + i)
+        for i in range(2):
+            self.log.log("freenode", "#python", "lvh!l@h",
+                         "july spam %d" % i, JULY + i)
+
+        pages = []
+        before = None
+        while True:
+            page = self._search("spam", limit=2, before=before)
+            pages.append(self._messages(page))
+            if page.next is None:
+                break
+            before = page.next
+        self.assertEqual(pages, [
+            [u"july spam 1", u"july spam 0"],
+            [u"june spam 2", u"june spam 1"],
+            [u"june spam 0"],
+        ])
+
+
+    def test_lastMention(self):
+        self.log.log("freenode", "#python", "lvh!l@h", "use treq", JUNE)
+        self.log.log("freenode", "#python", "dash!d@h", "treq is nice", JULY)
+
+        results = []
+        self.log.lastMention("treq", nick="lvh").addCallback(results.append)
+        self.log.lastMention("urllib").addCallback(results.append)
+        self.assertEqual(results[0].time, JUNE)
+        self.assertIdentical(results[1], None)
+
+
+    def test_archive(self):
+        self.log.log("freenode", "#python", "lvh!l@h", "june spam", JUNE)
+        self.log.log("freenode", "#python", "lvh!l@h", "july spam", JULY)
+        self.log.search("spam")
+
+        destination = self.mktemp()
+        moved = []
+        self.log.archive(JULY, destination).addCallback(moved.append)
+        self.assertEqual(moved, [["2013-06"]])
+        self.assertIn("2013-06.sqlite", os.listdir(destination))
+        self.assertEqual(self._messages(self._search("spam")),
+                         [u"july spam"])
+
+
+    def test_hook(self):
+        """
+        The log's hook logs channel messages with the network they came
+        from.
+        """
+        p = dispatch.Pangler()
+        self.log.subscribe(p)
+
+        class Network(object):
+            name = "freenode"
+
+        p.share(Network()).trigger(event="channelMessageReceived",
+                                   user="lvh!l@h", channel="#python",
+                                   message="hi")
+        p.trigger(event="channelMessageReceived", user="lvh!l@h",
+                  channel="#python", message="hi")
+        self.assertEqual([message.network
+                          for message in self._search("hi").messages],
+                         [u"", u"freenode"])
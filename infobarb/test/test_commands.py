@@ -0,0 +1,180 @@
+"""
+Tests for commands and regex triggers.
+"""
+import re
+
+from twisted.trial import unittest
+
+from infobarb import commands, dispatch, irc
+
+
+class RequiredLiteralTestCase(unittest.TestCase):
+    def _literal(self, pattern, flags=0):
+        return commands.requiredLiteral(re.compile(pattern, flags))
+
+
+    def test_longestRun(self):
+        self.assertEqual(self._literal(r"https?://(\S+)"), "http")
+
+
+    def test_insideGroups(self):
+        self.assertEqual(self._literal(r"a(?P<x>bcd)e"), "bcd")
+
+
+    def test_optionalParts(self):
+        self.assertEqual(self._literal(r"(?:abcdef)?xy"), "xy")
+        self.assertIdentical(self._literal(r"abc|def"), None)
+
+
+    def test_ignoreCase(self):
+        self.assertIdentical(self._literal(r"hello", re.I), None)
+        self.assertIdentical(self._literal(r"(?i)hello"), None)
+
+
+
+class CommandRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.p = dispatch.Pangler()
+        self.f = irc.FancyInfobarbPangler(self.p)
+        self.registry = commands.CommandRegistry(self.f)
+        self.calls = []
+
+
+    def _handler(self, name):
+        def handler(p, **kwargs):
+            self.calls.append((name, kwargs))
+        return handler
+
+
+    def _message(self, message):
+        self.p.trigger(event="channelMessageReceived", user="lvh",
+                       channel="#python", message=message)
+
+
+    def _names(self):
+        return [name for name, _ in self.calls]
+
+
+    def test_command(self):
+        self.registry.command("!help", self._handler("help"))
+        self._message("!help  paste ")
+
+        self.assertEqual(self.calls, [("help", {
+            "user": "lvh",
+            "channel": "#python",
+            "message": "!help  paste ",
+            "args": "paste",
+        })])
+
+
+    def test_commandDecorator(self):
+        handler = self._handler("help")
+        self.assertIdentical(self.registry.command("!help")(handler), handler)
+        self._message("!help")
+        self.assertEqual(self._names(), ["help"])
+
+
+    def test_commandNeedsWordBoundary(self):
+        self.registry.command("!help", self._handler("help"))
+        self._message("!helpme")
+        self._message("say !help")
+        self.assertEqual(self.calls, [])
+
+
+    def test_nestedCommands(self):
+        """
+        Commands that are prefixes of one another both match when their
+        names are complete words.
+        """
+        self.registry.command("!tell", self._handler("tell"))
+        self.registry.command("!tell all", self._handler("tellAll"))
+        self._message("!tell all hi")
+
+        self.assertEqual([(name, kw["args"]) for name, kw in self.calls],
+                         [("tell", "all hi"), ("tellAll", "hi")])
+
+
+    def test_trigger(self):
+        self.registry.trigger(r"https?://(?P<host>[^/\s]+)(\S*)",
+                              self._handler("url"))
+        self._message("see http://example.com/foo please")
+
+        [(name, kwargs)] = self.calls
+        self.assertEqual(kwargs["host"], "example.com")
+        self.assertEqual(kwargs["groups"], ("example.com", "/foo"))
+
+
+    def test_allTriggersMatch(self):
+        """
+        Every trigger that matches is called, in registration order, and
+        gets only its own groups.
+        """
+        self.registry.trigger(r"(\d+)", self._handler("number"))
+        self.registry.trigger(r"(?P<word>[a-z]+)", self._handler("word"))
+        self.registry.trigger(r"xyz", self._handler("never"))
+        self._message("abc 123")
+
+        self.assertEqual(self._names(), ["number", "word"])
+        self.assertEqual(self.calls[0][1]["groups"], ("123",))
+        self.assertEqual(self.calls[1][1]["groups"], ("abc",))
+        self.assertEqual(self.calls[1][1]["word"], "abc")
+
+
+    def test_sameGroupNames(self):
+        self.registry.trigger(r"(?P<x>a)(?P=x)", self._handler("a"))
+        self.registry.trigger(r"(?P<x>b)", self._handler("b"))
+        self._message("aa b")
+
+        self.assertEqual([kwargs["x"] for _, kwargs in self.calls],
+                         ["a", "b"])
+
+
+    def test_flagsAndBackreferences(self):
+        self.registry.trigger(re.compile("HELLO", re.I), self._handler("i"))
+        self.registry.trigger(r"(o)\1", self._handler("backref"))
+        self.registry.trigger(r"hel+", self._handler("plain"))
+        self._message("hello foo")
+
+        self.assertEqual(self._names(), ["i", "backref", "plain"])
+
+
+    def test_manyGroups(self):
+        """
+        There's no limit on the number of groups across all triggers.
+        """
+        for i in range(120):
+            self.registry.trigger(r"w(o)rd%d\b" % (i,), self._handler(i))
+        self._message("word7 word119")
+
+        self.assertEqual(self._names(), [7, 119])
+        self.assertEqual(self.calls[0][1]["groups"], ("o",))
+
+
+    def test_commandsAndTriggers(self):
+        self.registry.command("!paste", self._handler("paste"))
+        self.registry.trigger("paste", self._handler("mention"))
+        self._message("!paste it")
+        self.assertEqual(self._names(), ["paste", "mention"])
+
+
+    def test_triggerAddedLater(self):
+        self.registry.trigger("a", self._handler("a"))
+        self._message("ab")
+        self.registry.trigger("b", self._handler("b"))
+        self._message("ab")
+        self.assertEqual(self._names(), ["a", "a", "b"])
+
+
+    def test_privateMessages(self):
+        p = dispatch.Pangler()
+        registry = commands.CommandRegistry(irc.FancyInfobarbPangler(p),
+                                            "onPrivateMessage")
+        registry.command("!help", self._handler("help"))
+        p.trigger(event="privateMessageReceived", user="lvh",
+                  message="!help")
+
+        self.assertEqual(self.calls, [("help", {
+            "user": "lvh",
+            "message": "!help",
+            "args": "",
+        })])
@@ -0,0 +1,327 @@
+"""
+Tests for compiled event dispatch.
+"""
+import panglery
+
+from twisted.trial import unittest
+
+from infobarb import dispatch, events, irc, routing
+from infobarb.test.test_irc import CallStub
+
+
+class Recorder(object):
+    def __init__(self):
+        self.calls = []
+
+
+    def hook(self, name, result=None):
+        def hook(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return result
+
+        return hook
+
+
+
+class CompiledPanglerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.p = dispatch.Pangler()
+
+
+    def _subscribeAll(self, p, recorder):
+        p.subscribe(recorder.hook("a"), event="foo", needs=["x"])
+        p.subscribe(recorder.hook("b"), event="foo", needs=["x", "y"])
+        p.subscribe(recorder.hook("c"), event="bar", needs=["x"])
+        p.subscribe(recorder.hook("d"), event="foo", x=1, needs=["y"])
+        p.subscribe(recorder.hook("e"), needs=["y"])
+
+
+    def assertSameAsPlain(self, **event):
+        """
+        Asserts that a compiled and a plain pangler with the same hooks make
+        the same calls for an event.
+        """
+        plain = panglery.Pangler()
+        expected = Recorder()
+        self._subscribeAll(plain, expected)
+        plain.trigger(**event)
+
+        actual = Recorder()
+        self._subscribeAll(self.p, actual)
+        self.p.trigger(**event)
+
+        normalize = lambda calls: [(n, a[1:], k) for n, a, k in calls]
+        self.assertEqual(normalize(actual.calls), normalize(expected.calls))
+
+
+    def test_sameCalls(self):
+        self.assertSameAsPlain(event="foo", x=1, y=2)
+
+
+    def test_sameCallsConditionFails(self):
+        self.assertSameAsPlain(event="foo", x=2, y=2)
+
+
+    def test_sameCallsMissingArgument(self):
+        self.assertSameAsPlain(event="foo", x=1)
+
+
+    def test_sameCallsWithoutEvent(self):
+        self.assertSameAsPlain(x=1, y=2)
+
+
+    def test_fire(self):
+        """
+        Firing positional arguments calls hooks with keyword arguments.
+        """
+        stub = CallStub()
+        self.p.subscribe(stub, event="foo", needs=["y", "x"])
+        self.p.fire("foo", ("x", "y"), (1, 2))
+        self.assertEqual(stub.calledWith, ((self.p,), {"x": 1, "y": 2}))
+
+
+    def test_wants(self):
+        self.p.subscribe(CallStub(), event="foo", needs=["x", "y"])
+        self.assertTrue(self.p.wants("foo", ("x", "y"), "y"))
+        self.assertFalse(self.p.wants("bar", ("x", "y"), "y"))
+
+        self.p.subscribe(CallStub(), event="bar", needs=["y"])
+        self.assertTrue(self.p.wants("bar", ("x", "y"), "y"))
+
+
+    def test_wantsFiltered(self):
+        """
+        Hooks whose filters don't pass an event don't want its arguments.
+        """
+        argNames = "message", "y"
+        self.p.subscribe(CallStub(), routing.Filter(prefix="!paste"),
+                         event="foo", needs=["message", "y"])
+        self.p.subscribe(CallStub(), event="foo", needs=["message"])
+        self.assertTrue(self.p.wants("foo", argNames, "y", ("!paste", None)))
+        self.assertFalse(self.p.wants("foo", argNames, "y", ("hi", None)))
+        self.assertTrue(self.p.wants("foo", argNames, "y"))
+
+
+    def test_fireRecord(self):
+        """
+        Records are fired as they are, and routed without being copied.
+        """
+        record = events.recordClass("foo", ["channel", "x"])("#python", 1)
+        routed = []
+        route = routing.RouteIndex.route
+
+        def recordingRoute(index, args):
+            routed.append(args)
+            return route(index, args)
+
+        self.patch(routing.RouteIndex, "route", recordingRoute)
+        stub = CallStub()
+        self.p.subscribe(stub, routing.Filter(channels=["#python"]),
+                         event="foo", needs=["x", "event"])
+        self.p.fire("foo", record._fields, record)
+
+        self.assertIdentical(routed[0], record)
+        self.assertEqual(stub.calledWith,
+                         ((self.p,), {"x": 1, "event": "foo"}))
+
+
+    def test_boundInstance(self):
+        """
+        Hooks on a bound compiled pangler get the instance first.
+        """
+        instance = object()
+        bound = self.p.bind(instance)
+        stub = CallStub()
+        bound.subscribe(stub, event="foo", needs=["x"])
+        bound.fire("foo", ("x",), (1,))
+        self.assertEqual(stub.calledWith, ((instance, bound), {"x": 1}))
+
+
+    def test_tableCached(self):
+        """
+        The dispatch table is built once per event shape.
+        """
+        self.p.subscribe(CallStub(), event="foo", needs=["x"])
+        self.p.fire("foo", ("x",), (1,))
+        plan = self.p._table["foo", ("x",)]
+        self.p.fire("foo", ("x",), (2,))
+        self.assertIdentical(self.p._table["foo", ("x",)], plan)
+
+
+    def test_subscribeInvalidates(self):
+        """
+        Subscribing a hook, directly or as a decorator, is seen by the next
+        event.
+        """
+        first, second = CallStub(), CallStub()
+        self.p.subscribe(first, event="foo", needs=["x"])
+        self.p.fire("foo", ("x",), (1,))
+
+        self.p.subscribe(event="foo", needs=["x"])(second)
+        self.p.fire("foo", ("x",), (2,))
+        self.assertEqual(second.calledWith, ((self.p,), {"x": 2}))
+
+
+    def test_cloneHasOwnTable(self):
+        self.p.subscribe(CallStub(), event="foo", needs=["x"])
+        self.p.fire("foo", ("x",), (1,))
+
+        clone = self.p.clone()
+        stub = CallStub()
+        clone.subscribe(stub, event="foo", needs=["x"])
+        clone.fire("foo", ("x",), (1,))
+
+        self.assertTrue(stub.called)
+        self.assertEqual(len(self.p._table["foo", ("x",)][1]), 1)
+
+
+    def test_combineInvalidates(self):
+        other = dispatch.Pangler()
+        stub = CallStub()
+        other.subscribe(stub, event="foo", needs=["x"])
+
+        self.p.fire("foo", ("x",), (1,))
+        combined = self.p.combine(other)
+        combined.fire("foo", ("x",), (1,))
+        self.assertTrue(stub.called)
+
+
+    def test_share(self):
+        """
+        Panglers sharing hooks see each other's subscriptions, even after
+        they have compiled their tables.
+        """
+        instance = object()
+        shared = self.p.share(instance)
+        self.p.fire("foo", ("x",), (1,))
+        shared.fire("foo", ("x",), (1,))
+
+        first, second = CallStub(), CallStub()
+        self.p.subscribe(first, event="foo", needs=["x"])
+        shared.subscribe(second, event="foo", needs=["x"])
+
+        shared.fire("foo", ("x",), (2,))
+        self.assertEqual(first.calledWith, ((instance, shared), {"x": 2}))
+        self.p.fire("foo", ("x",), (3,))
+        self.assertEqual(second.calledWith, ((self.p,), {"x": 3}))
+
+
+    def test_modifiedEvent(self):
+        """
+        A hook that modifies the event changes what later hooks see.
+        """
+        recorder = Recorder()
+        self.p.subscribe(recorder.hook("a", {"x": 2, "y": 3}),
+                         event="foo", modifies=["x"], returns=["y"])
+        self.p.subscribe(recorder.hook("b"), event="foo", needs=["x", "y"])
+        self.p.fire("foo", ("x",), (1,))
+
+        self.assertEqual(recorder.calls, [
+            ("a", (self.p,), {"x": 1}),
+            ("b", (self.p,), {"x": 2, "y": 3}),
+        ])
+
+
+
+class FirerTestCase(unittest.TestCase):
+    def test_compiled(self):
+        p = dispatch.Pangler()
+        self.assertEqual(dispatch.firer(p), p.fire)
+
+
+    def test_plain(self):
+        p = panglery.Pangler()
+        stub = CallStub()
+        p.subscribe(stub, event="foo", needs=["x"])
+        dispatch.firer(p)("foo", ("x",), (1,))
+        self.assertEqual(stub.calledWith, ((p,), {"x": 1}))
+
+
+
+class CompiledClientTestCase(unittest.TestCase):
+    def setUp(self):
+        # The default dispatch hooks look for the client on the instance.
+        self.p = dispatch.Pangler().bind(self)
+        self.client = irc.InfobarbClient(self.p)
+        self.client.nickname = "testbarb"
+        irc.addDefaultDispatchHooks(self.p)
+        self.f = irc.FancyInfobarbPangler(self.p)
+
+
+    def test_channelMessage(self):
+        """
+        A channel message goes through the default dispatch hooks.
+        """
+        stub = CallStub()
+        self.f.onChannelMessage(stub)
+        self.client.privmsg("lvh", "#python", "hi")
+
+        kwargs = {"user": "lvh", "channel": "#python", "message": "hi"}
+        self.assertEqual(stub.calledWith, ((self, self.p), kwargs))
+
+
+    def test_userJoined(self):
+        stub = CallStub()
+        self.f.onUserJoin(stub)
+        self.client.userJoined("lvh", "#python")
+
+        kwargs = {"user": "lvh", "channel": "#python"}
+        self.assertEqual(stub.calledWith, ((self, self.p), kwargs))
+
+
+
+class SwapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.p = dispatch.Pangler()
+        self.recorder = Recorder()
+
+
+    def _names(self):
+        del self.recorder.calls[:]
+        self.p.fire("foo", ("x",), (1,))
+        return [name for name, _, _ in self.recorder.calls]
+
+
+    def _hooks(self, *names):
+        scratch = dispatch.Pangler()
+        for name in names:
+            scratch.subscribe(self.recorder.hook(name), event="foo",
+                              needs=["x"])
+        return scratch.hooks
+
+
+    def test_swapKeepsPosition(self):
+        self.p.subscribe(self.recorder.hook("before"), event="foo",
+                         needs=["x"])
+        self.p.swap("plugin", self._hooks("old"))
+        self.p.subscribe(self.recorder.hook("after"), event="foo",
+                         needs=["x"])
+        self.assertEqual(self._names(), ["before", "old", "after"])
+
+        self.p.swap("plugin", self._hooks("new1", "new2"))
+        self.assertEqual(self._names(), ["before", "new1", "new2", "after"])
+
+
+    def test_swapOutEverything(self):
+        self.p.swap("plugin", self._hooks("old"))
+        self.p.swap("plugin", [])
+        self.assertEqual(self._names(), [])
+
+
+    def test_swapOnlyOwnHooks(self):
+        self.p.swap("a", self._hooks("a"))
+        self.p.swap("b", self._hooks("b"))
+        self.p.swap("a", self._hooks("a2"))
+        self.assertEqual(self._names(), ["a2", "b"])
+
+
+    def test_swapShared(self):
+        shared = self.p.share(object())
+        shared.fire("foo", ("x",), (1,))
+        self.p.swap("plugin", self._hooks("new"))
+        shared.fire("foo", ("x",), (1,))
+        self.assertEqual(len(self.recorder.calls), 1)
+
+
+    def test_swapNeedsOwner(self):
+        self.assertRaises(ValueError, self.p.swap, None, [])
@@ -0,0 +1,199 @@
+"""
+Tests for per-channel plugin enablement.
+"""
+import json
+
+from twisted.trial import unittest
+
+from infobarb import dispatch, enablement, irc
+from infobarb.test.test_dispatch import Recorder
+
+
+class PluginEnablementTestCase(unittest.TestCase):
+    def setUp(self):
+        self.enablement = enablement.PluginEnablement()
+
+
+    def test_enabledByDefault(self):
+        self.assertTrue(self.enablement.isEnabled("paste", "#python"))
+        self.assertTrue(self.enablement.isEnabled("paste"))
+        self.assertIdentical(self.enablement.rule("paste"), None)
+
+
+    def test_disabledInChannel(self):
+        self.enablement.disable("paste", "#Python")
+        self.assertFalse(self.enablement.isEnabled("paste", "#PYTHON"))
+        self.assertTrue(self.enablement.isEnabled("paste", "#twisted"))
+        self.assertTrue(self.enablement.isEnabled("paste"))
+        self.assertEqual(self.enablement.rule("paste"),
+                         (True, frozenset(["#python"])))
+
+
+    def test_enabledInChannel(self):
+        self.enablement.disable("paste")
+        self.assertFalse(self.enablement.isEnabled("paste"))
+
+        self.enablement.enable("paste", "#python")
+        self.assertTrue(self.enablement.isEnabled("paste", "#python"))
+        self.assertFalse(self.enablement.isEnabled("paste", "#twisted"))
+        self.assertTrue(self.enablement.isEnabled("paste"))
+
+
+    def test_everywhere(self):
+        """
+        Enabling or disabling a plugin everywhere forgets its exceptions.
+        """
+        self.enablement.disable("paste", "#python")
+        self.enablement.enable("paste")
+        self.assertIdentical(self.enablement.rule("paste"), None)
+
+        self.enablement.enable("paste", "#python")
+        self.assertIdentical(self.enablement.rule("paste"), None)
+
+
+    def test_persisted(self):
+        path = self.mktemp()
+        saved = enablement.PluginEnablement(path)
+        saved.disable("paste")
+        saved.enable("paste", "#Python")
+        saved.disable("title", "#twisted")
+
+        with open(path) as f:
+            self.assertEqual(json.load(f), {
+                "paste": {"enabled": False, "channels": {"#python": True}},
+                "title": {"enabled": True, "channels": {"#twisted": False}},
+            })
+
+        loaded = enablement.PluginEnablement(path)
+        for plugin in ["paste", "title"]:
+            self.assertEqual(loaded.rule(plugin), saved.rule(plugin))
+
+
+
+class RestrictedDispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.enablement = enablement.PluginEnablement()
+        self.p = dispatch.Pangler()
+        self.p.restrict(self.enablement)
+        self.recorder = Recorder()
+
+        for plugin in ["paste", "title"]:
+            scratch = dispatch.Pangler()
+            f = irc.FancyInfobarbPangler(scratch)
+            f.onChannelMessage(self.recorder.hook(plugin))
+            f.onUserQuit(self.recorder.hook(plugin))
+            self.p.swap(plugin, scratch.hooks)
+
+
+    def _message(self, channel, p=None):
+        del self.recorder.calls[:]
+        (p or self.p).trigger(event="channelMessageReceived", user="lvh",
+                              channel=channel, message="hi")
+        return [name for name, _, _ in self.recorder.calls]
+
+
+    def _quit(self):
+        del self.recorder.calls[:]
+        self.p.trigger(event="userQuit", user="lvh", quitMessage="bye")
+        return [name for name, _, _ in self.recorder.calls]
+
+
+    def _planned(self, eventName, argNames):
+        """
+        Returns the positions of hooks in the dispatch plan for an event
+        shape, in any channel.
+        """
+        _, entries, _ = self.p._compile(eventName, argNames)
+        return [entry[0] for entry in entries]
+
+
+    def test_disabledEverywhere(self):
+        """
+        Hooks of plugins that are disabled everywhere aren't dispatched to
+        at all.
+        """
+        self.enablement.disable("paste")
+        self.assertEqual(self._message("#python"), ["title"])
+        self.assertEqual(self._quit(), ["title"])
+        self.assertEqual(len(self._planned("userQuit",
+                                           ("quitMessage", "user"))), 1)
+        self.assertEqual(
+            len(self._planned("channelMessageReceived",
+                              ("channel", "message", "user"))), 1)
+
+
+    def test_disabledInChannel(self):
+        self.enablement.disable("paste", "#python")
+        self.assertEqual(self._message("#Python"), ["title"])
+        self.assertEqual(self._message("#twisted"), ["paste", "title"])
+        self.assertEqual(self._quit(), ["paste", "title"])
+
+
+    def test_enabledInChannel(self):
+        self.enablement.disable("paste")
+        self.enablement.enable("paste", "#python")
+        self.assertEqual(self._message("#python"), ["paste", "title"])
+        self.assertEqual(self._message("#twisted"), ["title"])
+        self.assertEqual(self._quit(), ["paste", "title"])
+
+
+    def test_otherChannelsIndexed(self):
+        """
+        Plugins only enabled in other channels aren't looked at for
+        messages in a channel.
+        """
+        for plugin, channel in [("paste", "#python"), ("title", "#twisted")]:
+            self.enablement.disable(plugin)
+            self.enablement.enable(plugin, channel)
+
+        _, _, index = self.p._compile("channelMessageReceived",
+                                      ("channel", "message", "user"))
+        self.assertEqual(index._always, [])
+        self.assertEqual(
+            dict((channel, len(entries))
+                 for channel, entries in index._byChannel.items()),
+            {"#python": 1, "#twisted": 1})
+
+
+    def test_immediate(self):
+        """
+        Changes apply to the next event, on panglers sharing hooks too.
+        """
+        shared = self.p.share(object())
+        self.assertEqual(self._message("#python", shared), ["paste", "title"])
+        self.enablement.disable("title", "#python")
+        self.assertEqual(self._message("#python", shared), ["paste"])
+        self.enablement.enable("title", "#python")
+        self.assertEqual(self._message("#python", shared), ["paste", "title"])
+
+
+    def test_unowned(self):
+        """
+        Hooks that don't belong to a plugin are always dispatched to.
+        """
+        self.p.subscribe(self.recorder.hook("unowned"),
+                         event="channelMessageReceived", needs=["channel"])
+        self.enablement.disable("unowned")
+        self.assertEqual(self._message("#python"),
+                         ["paste", "title", "unowned"])
+
+
+    def test_modifiedEvent(self):
+        """
+        Hooks after one that modifies an event are left out too.
+        """
+        modifier = dispatch.Pangler()
+        modifier.subscribe(self.recorder.hook("modifier", {"message": "x"}),
+                           event="channelMessageReceived",
+                           modifies=["message"])
+        self.p.hooks[0:0] = modifier.hooks
+        self.p.invalidate()
+
+        self.enablement.disable("paste", "#python")
+        self.assertEqual(self._message("#python"), ["modifier", "title"])
+
+
+    def test_unrestricted(self):
+        self.enablement.disable("paste")
+        self.p.restrict(None)
+        self.assertEqual(self._message("#python"), ["paste", "title"])
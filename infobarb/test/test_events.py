@@ -0,0 +1,98 @@
+"""
+Tests for compact event records.
+"""
+import sys
+
+from twisted.trial import unittest
+
+from infobarb import dispatch, events, irc
+
+
+class RecordClassTestCase(unittest.TestCase):
+    def setUp(self):
+        self.record = events.recordClass("userJoined", ["user", "channel"])
+
+
+    def test_fields(self):
+        r = self.record("lvh", "#python")
+        self.assertEqual((r.user, r.channel), ("lvh", "#python"))
+        self.assertEqual(r, ("lvh", "#python"))
+
+
+    def test_event(self):
+        self.assertEqual(self.record.event, "userJoined")
+        self.assertEqual(self.record.__name__, "UserJoined")
+
+
+    def test_asSmallAsTuple(self):
+        r = self.record("lvh", "#python")
+        self.assertEqual(sys.getsizeof(r), sys.getsizeof(tuple(r)))
+
+
+    def test_clientRecords(self):
+        """
+        InfobarbClient has a record class for each event it fires.
+        """
+        records = irc.InfobarbClient._eventRecords
+        supported = irc.InfobarbClient._supportedEvents
+        self.assertEqual(set(records), set(supported))
+        for eventName, record in records.items():
+            self.assertEqual(list(record._fields),
+                             irc.InfobarbClient._builtinEventArgs[eventName])
+
+
+
+class InternTableTestCase(unittest.TestCase):
+    def test_intern(self):
+        table = events.InternTable()
+        a, b = "".join(["l", "v", "h"]), "".join(["l", "v", "h"])
+
+        self.assertIdentical(table.intern(a), a)
+        self.assertIdentical(table.intern(b), a)
+
+
+    def test_bounded(self):
+        table = events.InternTable(maxSize=2)
+        for s in ["a", "b", "c"]:
+            table.intern(s)
+
+        self.assertEqual(len(table), 1)
+
+
+
+class ClientInterningTestCase(unittest.TestCase):
+    def setUp(self):
+        self.p = dispatch.Pangler()
+        self.client = irc.InfobarbClient(self.p)
+        self.client.internTable = events.InternTable()
+
+        self.calls = []
+        self.p.subscribe(lambda p, **kwargs: self.calls.append(kwargs),
+                         event="userKicked",
+                         needs=["kickee", "channel", "kicker", "message"])
+
+
+    def _kick(self):
+        fresh = lambda s: "".join(list(s))
+        self.client.userKicked(fresh("cheater"), fresh("#python"),
+                               fresh("lvh"), fresh("bye"))
+
+
+    def test_namesInterned(self):
+        """
+        Nicknames and channels from separate events are the same objects.
+        """
+        self._kick()
+        self._kick()
+
+        first, second = self.calls
+        for name in ["kickee", "channel", "kicker"]:
+            self.assertIdentical(first[name], second[name])
+
+
+    def test_messagesNotInterned(self):
+        self._kick()
+        self._kick()
+
+        first, second = self.calls
+        self.assertNotIdentical(first["message"], second["message"])
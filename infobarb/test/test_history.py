@@ -0,0 +1,142 @@
+"""
+Tests for channel message history.
+"""
+import re
+
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from infobarb import dispatch, history, irc
+
+
+class HistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.history = history.History(size=4)
+
+
+    def _say(self, *lines):
+        for user, message in lines:
+            self.history.add(user + "!u@example.com", "#python", message)
+
+
+    def _messages(self, lines):
+        return [line.message for line in lines]
+
+
+    def test_recent(self):
+        self._say(("lvh", "a"), ("dash", "b"), ("lvh", "c"))
+        self.assertEqual(self._messages(self.history.recent("#PYTHON")),
+                         ["c", "b", "a"])
+        self.assertEqual(self._messages(self.history.recent("#python", 2)),
+                         ["c", "b"])
+
+
+    def test_ringBuffer(self):
+        """
+        Only the last ``size`` lines are kept.
+        """
+        self._say(*[("lvh", str(i)) for i in range(10)])
+        self.assertEqual(self._messages(self.history.recent("#python")),
+                         ["9", "8", "7", "6"])
+
+
+    def test_byNick(self):
+        self._say(("lvh", "a"), ("dash", "b"), ("LVH", "c"))
+        lines = self.history.byNick("#python", "lvh", 5)
+        self.assertEqual(self._messages(lines), ["c", "a"])
+        self.assertEqual(lines[0].user, "LVH!u@example.com")
+
+
+    def test_byNickForgotten(self):
+        """
+        Nicknames whose lines all fell out of the buffer aren't indexed
+        anymore.
+        """
+        self._say(("lvh", "a"), *[("dash", str(i)) for i in range(4)])
+        self.assertEqual(self.history.byNick("#python", "lvh"), [])
+        self.assertEqual(sorted(self.history._channels["#python"]._byNick),
+                         ["dash"])
+
+
+    def test_urls(self):
+        self._say(("lvh", "see http://a.example/ and http://b.example/"),
+                  ("dash", "no links"),
+                  ("lvh", "again http://a.example/"))
+
+        self.assertEqual(self.history.lastToken("#python"),
+                         "http://a.example/")
+        lines = self.history.byToken("#python", "http://a.example/", 5)
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(self.history.withTokens("#python", 5)[1].tokens,
+                         ("http://a.example/", "http://b.example/"))
+
+
+    def test_tokensForgotten(self):
+        self._say(("lvh", "http://a.example/"),
+                  *[("dash", "x")] * 4)
+        self.assertIdentical(self.history.lastToken("#python"), None)
+        self.assertEqual(self.history.byToken("#python",
+                                              "http://a.example/"), [])
+
+
+    def test_customTokens(self):
+        h = history.History(tokenPattern=re.compile(r"#\d+"))
+        h.add("lvh", "#twisted", "fixed #123 and #456")
+        self.assertEqual(h.lastToken("#twisted"), "#456")
+
+
+    def test_unknownChannel(self):
+        self.assertEqual(self.history.recent("#nowhere"), [])
+        self.assertIdentical(self.history.lastToken("#nowhere"), None)
+
+
+    def test_forgetChannel(self):
+        self._say(("lvh", "a"))
+        self.history.forgetChannel("#Python")
+        self.assertEqual(self.history.recent("#python"), [])
+
+
+
+class ClientHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = irc.InfobarbClient(dispatch.Pangler())
+        self.client.nickname = "barb"
+        self.client.makeConnection(StringTransport())
+        self.history = self.client.history
+
+
+    def _line(self, line):
+        self.client.lineReceived(line)
+
+
+    def test_channelMessage(self):
+        self._line(":lvh!l@example.com PRIVMSG #python :hi")
+        [line] = self.history.recent("#python")
+        self.assertEqual(line.user, "lvh!l@example.com")
+        self.assertEqual(line.message, "hi")
+
+
+    def test_privateMessageIgnored(self):
+        self._line(":lvh!l@example.com PRIVMSG barb :hi")
+        self.assertEqual(self.history._channels, {})
+
+
+    def test_ctcpIgnored(self):
+        self._line(":lvh!l@example.com PRIVMSG #python :\x01ACTION waves\x01")
+        self.assertEqual(self.history.recent("#python"), [])
+
+
+    def test_hooksSeeMessageInHistory(self):
+        seen = []
+        self.client.p.subscribe(
+            lambda p, user, channel, message: seen.append(
+                self.history.byNick(channel, "lvh")[0].message),
+            event="privmsgReceived", needs=["user", "channel", "message"])
+        self._line(":lvh!l@example.com PRIVMSG #python :hi")
+        self.assertEqual(seen, ["hi"])
+
+
+    def test_ownPart(self):
+        self._line(":lvh!l@example.com PRIVMSG #python :hi")
+        self._line(":barb!b@example.com PART #python")
+        self.assertEqual(self.history.recent("#python"), [])
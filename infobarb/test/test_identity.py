@@ -0,0 +1,261 @@
+"""
+Tests for identity and permission resolution.
+"""
+from twisted.internet import task
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from infobarb import dispatch, identity, irc, manifest, plugins, routing
+from infobarb.test.test_dispatch import Recorder
+
+
+LVH = "lvh!lvh@example.com"
+
+
+class ParseHostmaskTestCase(unittest.TestCase):
+    def test_full(self):
+        self.assertEqual(identity.parseHostmask(LVH),
+                         ("lvh", "lvh", "example.com"))
+
+
+    def test_nickOnly(self):
+        self.assertEqual(identity.parseHostmask("lvh"), ("lvh", None, None))
+
+
+    def test_partial(self):
+        self.assertEqual(identity.parseHostmask("lvh@example.com"),
+                         ("lvh", None, "example.com"))
+        self.assertEqual(identity.parseHostmask("lvh!lvh"),
+                         ("lvh", "lvh", None))
+
+
+
+class MaskPermissionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.source = identity.MaskPermissions({
+            "admin": ["lvh!*@example.com"],
+            "paste": ["*!*@*", "ignored"],
+            "voice": ["$a:Dash"],
+        })
+
+
+    def _permissions(self, mask, account=None):
+        nick, ident, host = identity.parseHostmask(mask)
+        return sorted(self.source(identity.Identity(
+            mask, nick, ident, host, account, frozenset())))
+
+
+    def test_masks(self):
+        self.assertEqual(self._permissions(LVH), ["admin", "paste"])
+        self.assertEqual(self._permissions("dash!d@example.org"), ["paste"])
+
+
+    def test_accounts(self):
+        self.assertEqual(self._permissions("x!d@example.org", "dash"),
+                         ["paste", "voice"])
+
+
+
+class IdentityServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.service = identity.IdentityService(maxSize=3, ttl=60,
+                                                clock=self.clock)
+        self.lookups = []
+        self.service.addSource(self._source)
+
+
+    def _source(self, identity):
+        self.lookups.append(identity.mask)
+        if identity.account == "lvh":
+            return ["admin"]
+        return []
+
+
+    def test_resolve(self):
+        i = self.service.resolve(LVH)
+        self.assertEqual((i.mask, i.nick, i.ident, i.host, i.account),
+                         (LVH, "lvh", "lvh", "example.com", None))
+        self.assertFalse(i.has("admin"))
+
+
+    def test_cached(self):
+        first = self.service.resolve(LVH)
+        self.assertIdentical(self.service.resolve(LVH), first)
+        self.assertEqual(self.lookups, [LVH])
+
+
+    def test_expires(self):
+        self.service.resolve(LVH)
+        self.clock.advance(60)
+        self.service.resolve(LVH)
+        self.assertEqual(self.lookups, [LVH, LVH])
+
+
+    def test_leastRecentlyUsedEvicted(self):
+        masks = ["a!a@a", "b!b@b", "c!c@c"]
+        for mask in masks:
+            self.service.resolve(mask)
+        self.service.resolve("a!a@a")
+        self.service.resolve("d!d@d")
+        del self.lookups[:]
+
+        self.service.resolve("a!a@a")
+        self.service.resolve("b!b@b")
+        self.assertEqual(self.lookups, ["b!b@b"])
+
+
+    def test_accountChanged(self):
+        self.service.resolve(LVH)
+        self.service.accountChanged("LVH", "lvh")
+        i = self.service.resolve(LVH)
+        self.assertEqual(i.account, "lvh")
+        self.assertTrue(i.has("admin"))
+
+        self.service.accountChanged("lvh", None)
+        self.assertFalse(self.service.resolve(LVH).has("admin"))
+
+
+    def test_renamed(self):
+        self.service.accountChanged("lvh", "lvh")
+        self.service.resolve("lvh2!lvh@example.com")
+        self.service.renamed("lvh", "lvh2")
+        self.assertEqual(
+            self.service.resolve("lvh2!lvh@example.com").account, "lvh")
+        self.assertIdentical(self.service.resolve(LVH).account, None)
+
+
+    def test_forget(self):
+        self.service.accountChanged("lvh", "lvh")
+        self.service.resolve(LVH)
+        self.service.forget("lvh")
+        self.assertIdentical(self.service.resolve(LVH).account, None)
+        self.assertEqual(self.lookups, [LVH, LVH])
+
+
+    def test_addSource(self):
+        self.service.resolve(LVH)
+        self.service.addSource(lambda identity: ["paste"])
+        self.assertTrue(self.service.resolve(LVH).has("paste"))
+
+
+    def test_asList(self):
+        i = self.service.resolve(LVH)
+        self.assertEqual(identity.Identity.fromList(i.asList()), i)
+
+
+
+class ClientIdentityTestCase(unittest.TestCase):
+    def setUp(self):
+        self.recorder = Recorder()
+        self.p = dispatch.Pangler().bind(self)
+        irc.addDefaultDispatchHooks(self.p)
+        self.p.subscribe(self.recorder.hook("message"),
+                         event="channelMessageReceived",
+                         needs=["identity", "message"])
+
+        self.client = irc.InfobarbClient(self.p)
+        self.client.nickname = "barb"
+        self.transport = StringTransport()
+        self.client.makeConnection(self.transport)
+        self.client.identities.clock = task.Clock()
+        self.client.identities.addSource(
+            identity.MaskPermissions({"admin": ["$a:lvh"]}))
+
+
+    def _identity(self):
+        self.client.lineReceived(":" + LVH + " PRIVMSG #python :hi")
+        _, _, kwargs = self.recorder.calls.pop()
+        return kwargs["identity"]
+
+
+    def test_identityDelivered(self):
+        i = self._identity()
+        self.assertEqual(i.mask, LVH)
+        self.assertIdentical(self._identity(), i)
+
+
+    def test_account(self):
+        self.assertFalse(self._identity().has("admin"))
+        self.client.lineReceived(":" + LVH + " ACCOUNT lvh")
+        self.assertTrue(self._identity().has("admin"))
+        self.client.lineReceived(":" + LVH + " ACCOUNT *")
+        self.assertFalse(self._identity().has("admin"))
+
+
+    def test_capabilitiesRequested(self):
+        """
+        The capabilities that tell the client about accounts are asked for
+        before registering, and negotiation ends when the server answers.
+        """
+        lines = self.transport.value().splitlines()
+        self.assertEqual(lines[0], "CAP REQ :account-notify extended-join")
+        self.assertIn("NICK barb", lines)
+
+        self.transport.clear()
+        self.client.lineReceived(
+            ":irc.example.com CAP * ACK :account-notify extended-join")
+        self.assertEqual(self.transport.value(), "CAP END\r\n")
+
+        self.transport.clear()
+        self.client.lineReceived(":irc.example.com CAP * NAK :account-notify")
+        self.assertEqual(self.transport.value(), "CAP END\r\n")
+
+
+    def test_extendedJoin(self):
+        self.client.lineReceived(":" + LVH + " JOIN #python lvh :Laurens")
+        self.assertTrue(self._identity().has("admin"))
+        self.assertTrue(self.client.channelState.isOn("lvh", "#python"))
+        self.client.lineReceived(":" + LVH + " JOIN #twisted * :Laurens")
+        self.assertFalse(self._identity().has("admin"))
+
+
+    def test_quit(self):
+        self.client.lineReceived(":" + LVH + " ACCOUNT lvh")
+        self._identity()
+        self.client.lineReceived(":" + LVH + " QUIT :bye")
+        self.assertFalse(self._identity().has("admin"))
+
+
+    def test_nick(self):
+        self.client.lineReceived(":" + LVH + " ACCOUNT lvh")
+        self.client.lineReceived(":" + LVH + " NICK lvh2")
+        self.client.lineReceived(":lvh2!lvh@example.com PRIVMSG #python :hi")
+        _, _, kwargs = self.recorder.calls.pop()
+        self.assertTrue(kwargs["identity"].has("admin"))
+
+
+    def test_resolvedOnlyWhenWanted(self):
+        """
+        Identities aren't resolved for events no hook wants one for.
+        """
+        calls = []
+        self.client.identities.addSource(
+            lambda identity: calls.append(identity.mask) or [])
+
+        self.client.lineReceived(":" + LVH + " PRIVMSG barb :hi")
+        self.assertEqual(calls, [])
+        self._identity()
+        self.assertEqual(calls, [LVH])
+
+
+    def test_resolvedOnlyForFilteredHooksThatMatch(self):
+        """
+        Hooks that need an identity but filter messages only make it be
+        resolved for messages that pass the filter, and lazily loaded
+        commands don't need one unless their manifest entry says so.
+        """
+        manager = plugins.PluginManager(self.p)
+        manifest.loadLazily(manager, {"nosuchplugin": {"commands": ["!x"]}})
+        self.p.subscribe(self.recorder.hook("paste"),
+                         routing.Filter(prefix="!paste"),
+                         event="privateMessageReceived",
+                         needs=["identity", "message"])
+        calls = []
+        self.client.identities.addSource(
+            lambda identity: calls.append(identity.mask) or [])
+
+        self.client.lineReceived(":" + LVH + " PRIVMSG barb :hi")
+        self.assertEqual(calls, [])
+        self.client.lineReceived(":" + LVH + " PRIVMSG barb :!paste")
+        self.assertEqual(calls, [LVH])
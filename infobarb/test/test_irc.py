@@ -3,6 +3,8 @@ Tests for the IRC abstraction.
 """
 import panglery
 
+from twisted.internet import task
+from twisted.internet.testing import StringTransport
 from twisted.trial import unittest
 
 from infobarb import irc
@@ -338,3 +340,106 @@ class ClientTestCase(PanglerCallStubTestCase):
         self._test_clientMessage(eventData=eventData,
                                  hook=self.f.onUserKick,
                                  trigger=self.client.userKicked)
+
+
+
+# Lines the fast path handles, and lines it should leave to the generic
+# parser, which must look the same to hooks either way.
+CONFORMANCE_LINES = [
+    ":infobarb!i@example.com JOIN #python",
+    ":infobarb!i@example.com JOIN :#twisted",
+    ":lvh!lvh@example.com JOIN #python",
+    ":dash JOIN :#python",
+    ":lvh!lvh@example.com PRIVMSG #python :hi there",
+    ":lvh!lvh@example.com PRIVMSG #python :http://example.com/ and :colons",
+    ":lvh!lvh@example.com PRIVMSG infobarb :private",
+    ":lvh!lvh@example.com PRIVMSG #python :",
+    ":lvh!lvh@example.com PRIVMSG #python :\x01ACTION waves\x01",
+    ":lvh!lvh@example.com PRIVMSG infobarb :\x01VERSION\x01",
+    ":lvh!lvh@example.com PRIVMSG #python :mid \x01 delim",
+    ":lvh!lvh@example.com PRIVMSG #python bare",
+    ":lvh!lvh@example.com PRIVMSG :#python :leading colon",
+    ":lvh!lvh@example.com PRIVMSG #py\tthon :tab",
+    ":lvh!lvh@example.com PRIVMSG #python :quoted \x10n",
+    ":server.example.com NOTICE infobarb :*** Looking up your hostname",
+    ":lvh!lvh@example.com NOTICE #python :notice",
+    ":lvh!lvh@example.com NOTICE #python :",
+    ":lvh!lvh@example.com PART #python :bye",
+    ":dash PART #python",
+    ":infobarb!i@example.com PART :#twisted",
+    ":lvh!lvh@example.com JOIN #python",
+    ":lvh!lvh@example.com PART #python extra :bye",
+    ":lvh!lvh@example.com QUIT :Quit: bye",
+    ":dash QUIT :",
+    ":radix QUIT bare",
+    ":exarkun QUIT :irc.example.com irc2.example.com",
+    "PING :server.example.com",
+    ":lvh!lvh@example.com PRIVMSG",
+    ":lvh!lvh@example.com NICK :lvh2",
+]
+
+
+
+class FastPathTestCase(unittest.TestCase):
+    """
+    Tests that lines parsed on the fast path fire the same events, and leave
+    the client in the same state, as the generic parser.
+    """
+    def _feed(self, lineReceived):
+        p = panglery.Pangler()
+        client = irc.InfobarbClient(p)
+        client.nickname = NICKNAME
+        client.makeConnection(StringTransport())
+        client.netsplits.clock = task.Clock()
+
+        fired = []
+        client._fire = lambda *args: fired.append(args)
+        for line in CONFORMANCE_LINES:
+            lineReceived(client, line)
+
+        channels = sorted(client.channelState.channels())
+        return {
+            "fired": fired,
+            "sent": client.transport.value(),
+            "members": [sorted(client.channelState.members(channel))
+                        for channel in channels],
+            "history": [client.history.recent(channel, 100)
+                        for channel in channels],
+        }
+
+
+    def test_conformance(self):
+        fast = self._feed(irc.InfobarbClient.lineReceived)
+        generic = self._feed(irc.irc.IRCClient.lineReceived)
+        self.assertEqual(fast, generic)
+        self.assertNotEqual(fast["fired"], [])
+        # IRCClient chokes on the empty NOTICE and the PRIVMSG without
+        # parameters, whichever path they came in on.
+        self.assertEqual(len(self.flushLoggedErrors(IndexError)), 4)
+
+
+    def test_usesFastPath(self):
+        """
+        Hot lines don't go through the generic parser.
+        """
+        client = irc.InfobarbClient(panglery.Pangler())
+        client.nickname = NICKNAME
+        client._fire = lambda *args: None
+        self.patch(irc.irc, "parsemsg", None)
+        client.lineReceived(":lvh!lvh@example.com PRIVMSG #python :hi")
+
+
+    def test_hookErrorsLogged(self):
+        """
+        Errors from hooks on the fast path are logged, like on the generic
+        one.
+        """
+        client = irc.InfobarbClient(panglery.Pangler())
+        client.nickname = NICKNAME
+
+        def broken(*args):
+            raise RuntimeError()
+
+        client._fire = broken
+        client.lineReceived(":lvh!lvh@example.com PRIVMSG #python :hi")
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
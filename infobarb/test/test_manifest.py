@@ -0,0 +1,132 @@
+"""
+Tests for plugin manifests.
+"""
+import json
+import os
+import sys
+
+from twisted.trial import unittest
+
+from infobarb import dispatch, manifest, plugins
+
+
+PLUGIN = """
+from infobarb import irc
+
+def setup(p):
+    f = irc.FancyInfobarbPangler(p)
+    f.onChannelMessage(hook)
+    p.subscribe(hook, event="privateMessageReceived",
+                needs=["user", "message", "identity"])
+    p.subscribe(hook, event="custom", needs=["x"])
+
+def hook(p, **kwargs):
+    pass
+"""
+
+
+class StubsTestCase(unittest.TestCase):
+    def test_shortcuts(self):
+        self.assertEqual(manifest.stubs({"shortcuts": ["onUserJoin"]}),
+                         [("userJoined", ("user", "channel"), None)])
+
+
+    def test_derivedEventsHaveAllArguments(self):
+        """
+        Events fired by default dispatch hooks have the arguments they were
+        fired with, even if their shortcuts don't ask for all of them.
+        """
+        self.assertEqual(
+            manifest.stubs({"shortcuts": ["onPrivateMessage"]}),
+            [("privateMessageReceived", ("user", "channel", "message"),
+              None)])
+
+
+    def test_identity(self):
+        """
+        Entries that say so get the sender's identity with messages.
+        """
+        self.assertEqual(
+            manifest.stubs({"shortcuts": ["onPrivateMessage"],
+                            "identity": True}),
+            [("privateMessageReceived",
+              ("user", "channel", "message", "identity"), None)])
+
+
+    def test_events(self):
+        self.assertEqual(manifest.stubs({"events": {"custom": ["x"]}}),
+                         [("custom", ("x",), None)])
+
+
+    def test_unknownEvent(self):
+        self.assertRaises(ValueError, manifest.stubs,
+                          {"events": {"custom": None}})
+
+
+    def test_commands(self):
+        args = "user", "channel", "message"
+        self.assertEqual(manifest.stubs({"commands": ["!paste"]}), [
+            ("channelMessageReceived", args, "!paste"),
+            ("privateMessageReceived", args, "!paste"),
+        ])
+
+
+
+class ManifestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath(self.mktemp())
+        os.makedirs(self.path)
+        sys.path.insert(0, self.path)
+        self.addCleanup(sys.path.remove, self.path)
+        self.addCleanup(sys.modules.pop, "infobarbmanifestplugin", None)
+
+        self.source = os.path.join(self.path, "infobarbmanifestplugin.py")
+        with open(self.source, "w") as f:
+            f.write(PLUGIN)
+
+        self.manifestPath = os.path.join(self.path, "manifest.json")
+
+
+    def test_introspect(self):
+        entry = manifest.introspect("infobarbmanifestplugin")
+        self.assertEqual(entry["events"], {
+            "channelMessageReceived": ["user", "channel", "message"],
+            "privateMessageReceived": ["user", "channel", "message",
+                                       "identity"],
+            "custom": ["x"],
+        })
+        self.assertEqual(entry["source"], self.source)
+        self.assertEqual(entry["mtime"], os.path.getmtime(self.source))
+
+
+    def test_readUpToDate(self):
+        entry = {"events": {}, "source": self.source,
+                 "mtime": os.path.getmtime(self.source)}
+        manifest.write(self.manifestPath, {"infobarbmanifestplugin": entry})
+        self.assertEqual(manifest.read(self.manifestPath),
+                         {"infobarbmanifestplugin": entry})
+
+
+    def test_readStale(self):
+        """
+        Plugins that changed since they were introspected are introspected
+        again, and the manifest is updated.
+        """
+        entry = {"events": {}, "source": self.source, "mtime": 0}
+        manifest.write(self.manifestPath, {"infobarbmanifestplugin": entry})
+
+        read = manifest.read(self.manifestPath)
+        self.assertIn("custom", read["infobarbmanifestplugin"]["events"])
+        with open(self.manifestPath) as f:
+            self.assertEqual(json.load(f), read)
+
+
+    def test_loadLazily(self):
+        manager = plugins.PluginManager(dispatch.Pangler())
+        manifest.loadLazily(manager, {
+            "infobarbmanifestplugin": {"events": {"custom": ["x"]}},
+        })
+        self.assertEqual(manager.lazy, set(["infobarbmanifestplugin"]))
+
+        manager.pangler.trigger(event="custom", x=1)
+        self.assertIn("infobarbmanifestplugin", manager.plugins)
@@ -0,0 +1,200 @@
+"""
+Tests for netsplit coalescing.
+"""
+from twisted.internet import task
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from infobarb import dispatch, irc, netsplit
+from infobarb.test.test_dispatch import Recorder
+
+
+SPLIT = "hub.example.net leaf.example.net"
+SERVERS = ("hub.example.net", "leaf.example.net")
+
+
+class SplitServersTestCase(unittest.TestCase):
+    def test_split(self):
+        self.assertEqual(netsplit.splitServers(SPLIT), SERVERS)
+
+
+    def test_notSplit(self):
+        for message in ["Quit: bye", "bye now", "a.b a.b", "a.b c.d e.f",
+                        "Ping timeout: 240 seconds", ""]:
+            self.assertIdentical(netsplit.splitServers(message), None)
+
+
+
+class NetsplitCoalescerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.splits, self.joins = [], []
+        self.coalescer = netsplit.NetsplitCoalescer(
+            lambda *args: self.splits.append(args),
+            lambda *args: self.joins.append(args),
+            self.clock, quietPeriod=1.0, maxDelay=5.0, rejoinWindow=60)
+
+
+    def test_ordinaryQuit(self):
+        self.assertFalse(self.coalescer.quit("lvh", "Quit: bye"))
+        self.assertFalse(self.coalescer.joined("lvh", "#python"))
+
+
+    def test_splitBatched(self):
+        self.assertTrue(self.coalescer.quit("lvh", SPLIT))
+        self.clock.advance(0.5)
+        self.assertTrue(self.coalescer.quit("dash", SPLIT))
+        self.clock.advance(0.9)
+        self.assertEqual(self.splits, [])
+
+        self.clock.advance(0.1)
+        self.assertEqual(self.splits, [(SERVERS, ("lvh", "dash"))])
+
+
+    def test_maxDelay(self):
+        """
+        A split that keeps going is still handed over in batches.
+        """
+        for i in range(10):
+            self.coalescer.quit("user%d" % (i,), SPLIT)
+            self.clock.advance(0.75)
+
+        self.assertEqual(len(self.splits), 1)
+        self.assertEqual(len(self.splits[0][1]), 7)
+
+
+    def test_separateSplits(self):
+        self.coalescer.quit("lvh", SPLIT)
+        self.coalescer.quit("dash", "hub.example.net other.example.net")
+        self.clock.advance(1)
+        self.assertEqual(len(self.splits), 2)
+
+
+    def test_netjoin(self):
+        self.coalescer.quit("lvh", SPLIT)
+        self.coalescer.quit("dash", SPLIT)
+        self.clock.advance(10)
+
+        self.assertTrue(self.coalescer.joined("LVH", "#python"))
+        self.assertTrue(self.coalescer.joined("lvh", "#twisted"))
+        self.assertTrue(self.coalescer.joined("dash", "#python"))
+        self.assertFalse(self.coalescer.joined("radix", "#python"))
+        self.clock.advance(1)
+
+        self.assertEqual(self.joins, [(SERVERS, (
+            ("LVH", "#python"), ("lvh", "#twisted"), ("dash", "#python")))])
+        self.assertFalse(self.coalescer.joined("lvh", "#python"))
+
+
+    def test_rejoinWindow(self):
+        self.coalescer.quit("lvh", SPLIT)
+        self.clock.advance(61)
+        self.assertFalse(self.coalescer.joined("lvh", "#python"))
+        self.assertEqual(self.coalescer._away, {})
+
+
+    def test_quickRejoin(self):
+        """
+        Users that come back before their split was handed over are handed
+        over as split first.
+        """
+        self.coalescer.quit("lvh", SPLIT)
+        self.coalescer.joined("lvh", "#python")
+        self.assertEqual(self.splits, [(SERVERS, ("lvh",))])
+        self.clock.advance(1)
+        self.assertEqual(len(self.joins), 1)
+
+
+    def test_flush(self):
+        self.coalescer.quit("lvh", SPLIT)
+        self.coalescer.flush()
+        self.assertEqual(self.splits, [(SERVERS, ("lvh",))])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_stop(self):
+        self.coalescer.quit("lvh", SPLIT)
+        self.coalescer.stop()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertFalse(self.coalescer.joined("lvh", "#python"))
+
+
+
+class ClientNetsplitTestCase(unittest.TestCase):
+    def setUp(self):
+        self.recorder = Recorder()
+        self.p = dispatch.Pangler().bind(self)
+        irc.addDefaultDispatchHooks(self.p)
+
+        f = irc.FancyInfobarbPangler(self.p)
+        f.onNetsplit(self.recorder.hook("netsplit"))
+        f.onNetjoin(self.recorder.hook("netjoin"))
+        f.onUserQuit(self.recorder.hook("quit"))
+        f.onUserJoin(self.recorder.hook("join"))
+
+        self.client = irc.InfobarbClient(self.p)
+        self.client.nickname = "barb"
+        self.client.makeConnection(StringTransport())
+        self.clock = self.client.netsplits.clock = task.Clock()
+        self.state = self.client.channelState
+
+        self._line(":barb!b@example.com JOIN #python")
+        self._line(":server 353 barb = #python :barb lvh dash")
+        del self.recorder.calls[:]
+
+
+    def _line(self, line):
+        self.client.lineReceived(line)
+
+
+    def _calls(self):
+        return [(name, kwargs) for name, _, kwargs in self.recorder.calls]
+
+
+    def test_netsplit(self):
+        """
+        Split quits are delivered once as a batch, and to per-user hooks,
+        once the split is over.
+        """
+        self._line(":lvh!l@example.com QUIT :" + SPLIT)
+        self._line(":dash!d@example.com QUIT :" + SPLIT)
+        self.assertEqual(self._calls(), [])
+        self.assertTrue(self.state.isOn("lvh", "#python"))
+
+        self.clock.advance(1)
+        self.assertEqual(self._calls(), [
+            ("quit", {"user": "lvh", "quitMessage": SPLIT}),
+            ("quit", {"user": "dash", "quitMessage": SPLIT}),
+            ("netsplit", {"servers": SERVERS, "users": ("lvh", "dash")}),
+        ])
+        self.assertEqual(self.state.members("#python"), ["barb"])
+
+
+    def test_netjoin(self):
+        self._line(":lvh!l@example.com QUIT :" + SPLIT)
+        self.clock.advance(1)
+        del self.recorder.calls[:]
+
+        self._line(":lvh!l@example.com JOIN #python")
+        self.assertFalse(self.state.isOn("lvh", "#python"))
+        self.clock.advance(1)
+
+        self.assertEqual(self._calls(), [
+            ("join", {"user": "lvh", "channel": "#python"}),
+            ("netjoin", {"servers": SERVERS,
+                         "users": (("lvh", "#python"),)}),
+        ])
+        self.assertTrue(self.state.isOn("lvh", "#python"))
+
+
+    def test_ordinaryQuit(self):
+        self._line(":lvh!l@example.com QUIT :Quit: bye")
+        self.assertEqual(self._calls(), [
+            ("quit", {"user": "lvh", "quitMessage": "Quit: bye"}),
+        ])
+
+
+    def test_connectionLost(self):
+        self._line(":lvh!l@example.com QUIT :" + SPLIT)
+        self.client.connectionLost(None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
@@ -0,0 +1,154 @@
+"""
+Tests for running many networks in one process.
+"""
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from infobarb import channellog, dispatch, irc, network
+from infobarb.test.test_background import SynchronousThreadPool
+from infobarb.test.test_irc import CallStub
+from infobarb.test.test_persistence import FakeReactor
+
+
+class ClientFactoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.p = dispatch.Pangler()
+        self.network = network.Network("freenode", self.p, "testbarb")
+        self.factory = network.InfobarbClientFactory(self.network)
+
+
+    def test_buildProtocol(self):
+        client = self.factory.buildProtocol(None)
+
+        self.assertIsInstance(client, irc.InfobarbClient)
+        self.assertIdentical(client.factory, self.factory)
+        self.assertIdentical(client.p, self.network.p)
+        self.assertIdentical(self.network.client, client)
+        self.assertEqual(client.nickname, "testbarb")
+
+
+    def test_buildProtocolResetsDelay(self):
+        self.factory.delay = 100
+        self.factory.buildProtocol(None)
+        self.assertEqual(self.factory.delay, self.factory.initialDelay)
+
+
+    def test_connectionLost(self):
+        self.factory.buildProtocol(None)
+        self.factory.stopTrying()
+        self.factory.clientConnectionLost(None, None)
+        self.assertIdentical(self.network.client, None)
+
+
+
+class ConnectionManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.p = dispatch.Pangler()
+        irc.addDefaultDispatchHooks(self.p)
+        self.manager = network.ConnectionManager(self.p)
+
+
+    def _connect(self, name, nickname):
+        n = self.manager.addNetwork(name, name + ".example.com", 6667,
+                                    nickname)
+        client = n.factory.buildProtocol(None)
+        client.makeConnection(StringTransport())
+        return n, client
+
+
+    def test_addNetwork(self):
+        n = self.manager.addNetwork("freenode", "irc.example.com", 6667)
+
+        self.assertIdentical(self.manager.networks["freenode"], n)
+        connection = self.manager.getServiceNamed("freenode")
+        self.assertEqual(connection.args[:2], ("irc.example.com", 6667))
+        self.assertIdentical(connection.args[2], n.factory)
+
+
+    def test_sharedHTTP(self):
+        """
+        Networks share the manager's HTTP client, which stops along with the
+        manager.
+        """
+        a = self.manager.addNetwork("freenode", "irc.example.com", 6667)
+        b = self.manager.addNetwork("oftc", "irc.example.org", 6667)
+        self.assertIdentical(a.http, self.manager.http)
+        self.assertIdentical(b.http, self.manager.http)
+        self.assertIn(self.manager.http, list(self.manager))
+
+
+    def test_logs(self):
+        """
+        Networks share the manager's channel log, which logs their channel
+        messages.
+        """
+        logs = channellog.ChannelLog(self.mktemp(),
+                                     threadpool=SynchronousThreadPool(),
+                                     reactor=FakeReactor())
+        self.manager = network.ConnectionManager(self.p, logs=logs)
+        freenode, client = self._connect("freenode", "barb")
+        self.assertIdentical(freenode.logs, logs)
+        self.assertIn(logs, list(self.manager))
+
+        client.privmsg("lvh!l@h", "#python", "hi")
+        found = []
+        logs.search("hi").addCallback(found.append)
+        self.assertEqual([(message.network, message.message)
+                          for message in found[0].messages],
+                         [(u"freenode", u"hi")])
+        return self.manager.stopService()
+
+
+    def test_addDuplicateNetwork(self):
+        self.manager.addNetwork("freenode", "irc.example.com", 6667)
+        self.assertRaises(KeyError, self.manager.addNetwork, "freenode",
+                          "irc.example.com", 6667)
+
+
+    def test_removeNetwork(self):
+        n = self.manager.addNetwork("freenode", "irc.example.com", 6667)
+        self.manager.removeNetwork("freenode")
+
+        self.assertEqual(self.manager.networks, {})
+        self.assertFalse(n.factory.continueTrying)
+        self.assertRaises(KeyError, self.manager.getServiceNamed, "freenode")
+
+
+    def test_stopService(self):
+        n = self.manager.addNetwork("freenode", "irc.example.com", 6667)
+        self.manager.stopService()
+        self.assertFalse(n.factory.continueTrying)
+
+
+    def test_eventsTaggedWithNetwork(self):
+        """
+        Hooks are subscribed once and see which network each event came
+        from.
+        """
+        freenode, freenodeClient = self._connect("freenode", "barb")
+        oftc, oftcClient = self._connect("oftc", "barb2")
+
+        stub = CallStub()
+        f = irc.FancyInfobarbPangler(self.p)
+        f.onChannelMessage(stub)
+
+        freenodeClient.privmsg("lvh", "#python", "hi")
+        self.assertIdentical(stub.calledWith[0][0], freenode)
+
+        oftcClient.privmsg("lvh", "#python", "hi")
+        self.assertIdentical(stub.calledWith[0][0], oftc)
+
+
+    def test_privateMessagePerNetwork(self):
+        """
+        Private messages are told apart using the nickname on the network
+        they arrived on.
+        """
+        freenode, freenodeClient = self._connect("freenode", "barb")
+        oftc, oftcClient = self._connect("oftc", "barb2")
+
+        stub = CallStub()
+        irc.FancyInfobarbPangler(self.p).onPrivateMessage(stub)
+
+        oftcClient.privmsg("lvh", "barb2", "hi")
+        self.assertIdentical(stub.calledWith[0][0], oftc)
@@ -0,0 +1,223 @@
+"""
+Tests for flood-controlled outbound messages.
+"""
+from twisted.internet import task
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from infobarb import dispatch, irc, outbound
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_burst(self):
+        bucket = outbound.TokenBucket(rate=1.0, burst=2, now=0)
+        for _ in range(2):
+            self.assertEqual(bucket.wait(0), 0)
+            bucket.take(0)
+
+        self.assertEqual(bucket.wait(0), 1.0)
+
+
+    def test_refill(self):
+        bucket = outbound.TokenBucket(rate=2.0, burst=1, now=0)
+        bucket.take(0)
+        self.assertEqual(bucket.wait(0.25), 0.25)
+        self.assertEqual(bucket.wait(0.5), 0)
+
+
+    def test_refillCapped(self):
+        bucket = outbound.TokenBucket(rate=1.0, burst=2, now=0)
+        bucket.wait(100)
+        self.assertEqual(bucket.tokens, 2)
+
+
+    def test_full(self):
+        bucket = outbound.TokenBucket(rate=1.0, burst=2, now=0)
+        self.assertTrue(bucket.full(0))
+        bucket.take(0)
+        self.assertFalse(bucket.full(0.5))
+        self.assertTrue(bucket.full(1))
+
+
+
+class SplitMessageTestCase(unittest.TestCase):
+    def test_short(self):
+        self.assertEqual(outbound.splitMessage(b"hello", 10), [b"hello"])
+
+
+    def test_newlines(self):
+        self.assertEqual(outbound.splitMessage(b"a\nb\r\n\nc", 10),
+                         [b"a", b"b", b"c"])
+
+
+    def test_splitAtSpace(self):
+        self.assertEqual(outbound.splitMessage(b"hello there world", 11),
+                         [b"hello there", b"world"])
+
+
+    def test_splitLongWord(self):
+        self.assertEqual(outbound.splitMessage(b"abcdefgh", 3),
+                         [b"abc", b"def", b"gh"])
+
+
+    def test_unicode(self):
+        """
+        Unicode messages are measured in UTF-8 bytes and never split inside
+        a character.
+        """
+        message = u"\N{SNOWMAN}" * 3
+        lines = outbound.splitMessage(message, 4)
+        self.assertEqual(lines, [u"\N{SNOWMAN}"] * 3)
+
+
+
+class OutboundSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.lines = []
+        self.scheduler = outbound.OutboundScheduler(
+            self.lines.append, self.clock, globalRate=1.0, globalBurst=2,
+            targetRate=0.5, targetBurst=2)
+
+
+    def test_burstSentImmediately(self):
+        self.scheduler.enqueue("PRIVMSG", "#python", "a")
+        self.scheduler.enqueue("PRIVMSG", "#python", "b")
+        self.assertEqual(self.lines, ["PRIVMSG #python :a",
+                                      "PRIVMSG #python :b"])
+
+
+    def test_globalLimit(self):
+        for target in ["#a", "#b", "#c"]:
+            self.scheduler.enqueue("PRIVMSG", target, "hi")
+
+        self.assertEqual(len(self.lines), 2)
+        self.assertEqual(self.scheduler.pending, 1)
+
+        self.clock.advance(1)
+        self.assertEqual(self.lines[-1], "PRIVMSG #c :hi")
+
+
+    def test_targetLimit(self):
+        """
+        A target that used up its bucket waits, while others don't.
+        """
+        self.scheduler._globalBucket.burst = 10
+        self.scheduler._globalBucket.tokens = 10
+
+        for text in "abc":
+            self.scheduler.enqueue("PRIVMSG", "#a", text)
+        self.scheduler.enqueue("PRIVMSG", "#b", "x")
+
+        self.assertEqual(self.lines, ["PRIVMSG #a :a", "PRIVMSG #a :b",
+                                      "PRIVMSG #b :x"])
+        self.clock.advance(2)
+        self.assertEqual(self.lines[-1], "PRIVMSG #a :c")
+
+
+    def test_priority(self):
+        """
+        Higher priority lines jump the queue.
+        """
+        for text in "abc":
+            self.scheduler.enqueue("PRIVMSG", "#" + text, text, outbound.LOW)
+        self.scheduler.enqueue("PRIVMSG", "lvh", "urgent", outbound.HIGH)
+
+        self.clock.advance(1)
+        self.assertEqual(self.lines[-1], "PRIVMSG lvh :urgent")
+
+
+    def test_roundRobin(self):
+        """
+        Targets with the same priority take turns.
+        """
+        self.scheduler._targetBuckets = {}
+        self.scheduler.targetBurst = 10
+        self.scheduler._globalBucket.tokens = 0
+
+        for text in "abc":
+            self.scheduler.enqueue("PRIVMSG", "#a", text)
+        self.scheduler.enqueue("PRIVMSG", "#b", "x")
+
+        self.clock.pump([1] * 4)
+        self.assertEqual(self.lines, ["PRIVMSG #a :a", "PRIVMSG #b :x",
+                                      "PRIVMSG #a :b", "PRIVMSG #a :c"])
+
+
+    def test_duplicatesDropped(self):
+        self.scheduler._globalBucket.tokens = 0
+        self.scheduler.enqueue("PRIVMSG", "#a", "spam")
+        self.scheduler.enqueue("PRIVMSG", "#a", "spam")
+        self.scheduler.enqueue("NOTICE", "#a", "spam")
+
+        self.assertEqual(self.scheduler.pending, 2)
+        self.assertEqual(self.scheduler.duplicates, 1)
+
+
+    def test_longMessageSplit(self):
+        self.scheduler.prefixAllowance = 0
+        self.scheduler.enqueue("PRIVMSG", "#a", "x" * 600)
+
+        self.assertEqual(len(self.lines), 2)
+        for line in self.lines:
+            self.assertTrue(len(line) + 2 <= outbound.MAX_LINE_BYTES)
+
+
+    def test_idleBucketsDropped(self):
+        """
+        Targets that have been quiet long enough for their buckets to refill
+        don't keep a bucket around.
+        """
+        for target in ["#a", "#b"]:
+            self.scheduler.enqueue("PRIVMSG", target, "hi")
+        self.assertEqual(set(self.scheduler._targetBuckets), set(["#a", "#b"]))
+
+        self.clock.advance(4)
+        self.scheduler.enqueue("PRIVMSG", "#c", "hi")
+        self.assertEqual(set(self.scheduler._targetBuckets), set(["#c"]))
+
+
+    def test_busyBucketsKept(self):
+        for text in "abc":
+            self.scheduler.enqueue("PRIVMSG", "#a", text)
+
+        self.clock.advance(4)
+        self.assertEqual(set(self.scheduler._targetBuckets), set(["#a"]))
+        self.assertEqual(self.lines[-1], "PRIVMSG #a :c")
+
+
+    def test_stop(self):
+        for target in ["#a", "#b", "#c"]:
+            self.scheduler.enqueue("PRIVMSG", target, "hi")
+
+        self.scheduler.stop()
+        self.assertEqual(self.scheduler.pending, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
+class ClientOutboundTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = irc.InfobarbClient(dispatch.Pangler())
+        self.client.performLogin = False
+        self.transport = StringTransport()
+        self.client.makeConnection(self.transport)
+
+
+    def test_scheduleMsg(self):
+        self.client.scheduleMsg("#python", "hi")
+        self.assertEqual(self.transport.value(), b"PRIVMSG #python :hi\r\n")
+
+
+    def test_scheduleNotice(self):
+        self.client.scheduleNotice("lvh", "hi", outbound.HIGH)
+        self.assertEqual(self.transport.value(), b"NOTICE lvh :hi\r\n")
+
+
+    def test_connectionLostStops(self):
+        self.client.outboundScheduler.clock = task.Clock()
+        self.client.outboundScheduler._globalBucket.tokens = 0
+        self.client.scheduleMsg("#python", "hi")
+
+        self.client.connectionLost(None)
+        self.assertEqual(self.client.outboundScheduler.pending, 0)
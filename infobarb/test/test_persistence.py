@@ -0,0 +1,219 @@
+"""
+Tests for write-behind persistence.
+"""
+import threading
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from infobarb import persistence
+from infobarb.test.test_background import SynchronousThreadPool
+
+
+class FakeStore(object):
+    """
+    A store that counts transactions and keeps rows in a list.
+    """
+    def __init__(self):
+        self.rows = []
+        self.transactions = 0
+
+
+    def transact(self, f, *args, **kwargs):
+        self.transactions += 1
+        return f(*args, **kwargs)
+
+
+
+class FakeReactor(task.Clock):
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+
+def addRow(store, row):
+    store.rows.append(row)
+
+
+
+def failingWrite(store):
+    raise RuntimeError("disk full")
+
+
+
+class WriteBehindTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = FakeStore()
+        self.pool = SynchronousThreadPool()
+        self.reactor = FakeReactor()
+        self.writer = persistence.WriteBehind(self.store, self.pool,
+                                              self.reactor, maxPending=3,
+                                              interval=5.0)
+
+
+    def test_buffered(self):
+        self.writer.write(addRow, "a")
+        self.writer.write(addRow, "b")
+        self.assertEqual(self.store.rows, [])
+        self.assertEqual(self.writer.pending, 2)
+
+
+    def test_flushOnSize(self):
+        """
+        Reaching ``maxPending`` commits everything in one transaction.
+        """
+        for row in "abc":
+            self.writer.write(addRow, row)
+
+        self.assertEqual(self.store.rows, ["a", "b", "c"])
+        self.assertEqual(self.store.transactions, 1)
+        self.assertEqual(self.writer.pending, 0)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+
+    def test_flushOnTime(self):
+        self.writer.write(addRow, "a")
+        self.reactor.advance(4.9)
+        self.assertEqual(self.store.rows, [])
+        self.reactor.advance(0.1)
+        self.assertEqual(self.store.rows, ["a"])
+        self.assertEqual(self.store.transactions, 1)
+
+
+    def test_runsInThreadPool(self):
+        self.writer.write(addRow, "a")
+        self.writer.flush()
+        self.assertEqual(len(self.pool.calls), 1)
+
+
+    def test_readSeesPendingWrites(self):
+        self.writer.write(addRow, "a")
+        d = self.writer.read(lambda store: list(store.rows))
+        self.assertEqual(self.successResultOf(d), ["a"])
+
+
+    def test_flushNothing(self):
+        d = self.writer.flush()
+        self.assertIdentical(self.successResultOf(d), None)
+        self.assertEqual(self.store.transactions, 0)
+
+
+    def test_failedBatch(self):
+        """
+        A batch that fails is logged, and doesn't stop later batches.
+        """
+        self.writer.write(failingWrite)
+        self.writer.flush()
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+        self.writer.write(addRow, "a")
+        self.writer.flush()
+        self.assertEqual(self.store.rows, ["a"])
+
+
+    def test_opening(self):
+        """
+        Stores can be opened by the buffer, before anything else runs.
+        """
+        writer = persistence.WriteBehind.opening(FakeStore, self.pool,
+                                                 self.reactor)
+        writer.write(addRow, "a")
+        writer.flush()
+        self.assertEqual(writer.store.rows, ["a"])
+        self.assertEqual(len(self.pool.calls), 2)
+
+
+    def test_stop(self):
+        """
+        Stopping commits pending writes, and leaves thread pools the buffer
+        was given alone.
+        """
+        self.writer.write(addRow, "a")
+        self.successResultOf(self.writer.stop())
+        self.assertEqual(self.store.rows, ["a"])
+        self.assertFalse(hasattr(self.pool, "started"))
+
+
+
+def currentThread(store=None):
+    return threading.current_thread()
+
+
+
+class OwnThreadTestCase(unittest.TestCase):
+    """
+    Tests for buffers that make their own thread pool, with a real reactor.
+    """
+    def test_oneThread(self):
+        """
+        The store is opened, written and read in the same thread, which
+        isn't the reactor's.
+        """
+        threads = []
+
+        def opener():
+            threads.append(currentThread())
+            return FakeStore()
+
+        def record(store):
+            threads.append(currentThread())
+
+        writer = persistence.WriteBehind.opening(opener, maxPending=2)
+        self.addCleanup(writer.stop)
+        reads = []
+        for _ in range(3):
+            for _ in range(2):
+                writer.write(record)
+            reads.append(writer.read(currentThread))
+
+        d = defer.gatherResults(reads)
+
+        @d.addCallback
+        def check(readThreads):
+            threads.extend(readThreads)
+            self.assertEqual(len(threads), 10)
+            self.assertEqual(len(set(threads)), 1)
+            self.assertNotIdentical(threads[0], threading.current_thread())
+            return writer.stop()
+
+        @d.addCallback
+        def stopped(_):
+            self.assertFalse(writer.threadpool.started)
+
+        return d
+
+
+
+class PersistenceServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.service = persistence.PersistenceService(
+            SynchronousThreadPool(), self.reactor, interval=5.0)
+
+
+    def test_writerFor(self):
+        store = FakeStore()
+        writer = self.service.writerFor(store)
+        self.assertIdentical(self.service.writerFor(store), writer)
+        self.assertNotIdentical(self.service.writerFor(FakeStore()), writer)
+
+
+    def test_stopServiceFlushes(self):
+        stores = FakeStore(), FakeStore()
+        for store in stores:
+            self.service.writerFor(store).write(addRow, "a")
+
+        self.service.startService()
+        d = self.service.stopService()
+        self.successResultOf(d)
+        self.assertEqual([store.rows for store in stores], [["a"], ["a"]])
+
+
+    def test_writerOpening(self):
+        writer = self.service.writerOpening(FakeStore)
+        self.assertIdentical(self.service.writerOpening(FakeStore), writer)
+        writer.write(addRow, "a")
+
+        self.service.startService()
+        self.successResultOf(self.service.stopService())
+        self.assertEqual(writer.store.rows, ["a"])
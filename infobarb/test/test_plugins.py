@@ -0,0 +1,256 @@
+"""
+Tests for loading and reloading plugins.
+"""
+import os
+import sys
+
+from twisted.trial import unittest
+
+from infobarb import dispatch, enablement, plugins, stats
+
+
+PLUGIN = """
+calls = []
+torndown = []
+
+def setup(p):
+    p.subscribe(hook, event="foo", needs=["x"])
+
+def hook(p, x):
+    calls.append((%(version)r, x))
+
+def teardown():
+    torndown.append(%(version)r)
+"""
+
+
+class PluginManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        os.makedirs(self.path)
+        sys.path.insert(0, self.path)
+        self.addCleanup(sys.path.remove, self.path)
+        self.addCleanup(sys.modules.pop, "infobarbtestplugin", None)
+
+        self.p = dispatch.Pangler()
+        self.manager = plugins.PluginManager(self.p)
+
+
+    def _write(self, source):
+        path = os.path.join(self.path, "infobarbtestplugin.py")
+        with open(path, "w") as f:
+            f.write(source)
+
+
+    def _version(self, version):
+        self._write(PLUGIN % {"version": version})
+
+
+    def test_load(self):
+        self._version(1)
+        module = self.manager.load("infobarbtestplugin")
+        self.assertIdentical(sys.modules["infobarbtestplugin"], module)
+
+        self.p.trigger(event="foo", x=1)
+        self.assertEqual(module.calls, [(1, 1)])
+        self.assertEqual(self.p.hooks[0].owner, "infobarbtestplugin")
+
+
+    def test_reload(self):
+        """
+        After a reload, events only reach the new version, and the old
+        version is torn down.
+        """
+        self._version(1)
+        old = self.manager.load("infobarbtestplugin")
+        self.p.trigger(event="foo", x=1)
+
+        self._version(2)
+        new = self.manager.reload("infobarbtestplugin")
+        self.p.trigger(event="foo", x=2)
+
+        self.assertEqual(old.calls, [(1, 1)])
+        self.assertEqual(old.torndown, [1])
+        self.assertEqual(new.calls, [(2, 2)])
+        self.assertEqual(len(self.p.hooks), 1)
+
+
+    def test_failedReload(self):
+        """
+        If the new version can't be loaded, the old one stays subscribed.
+        """
+        self._version(1)
+        old = self.manager.load("infobarbtestplugin")
+
+        self._write("def setup(p):\n    raise RuntimeError()\n")
+        self.assertRaises(RuntimeError, self.manager.reload,
+                          "infobarbtestplugin")
+
+        self.p.trigger(event="foo", x=1)
+        self.assertEqual(old.calls, [(1, 1)])
+        self.assertEqual(old.torndown, [])
+        self.assertIdentical(self.manager.plugins["infobarbtestplugin"], old)
+
+
+    def test_unload(self):
+        self._version(1)
+        module = self.manager.load("infobarbtestplugin")
+        self.manager.unload("infobarbtestplugin")
+
+        self.p.trigger(event="foo", x=1)
+        self.assertEqual(module.calls, [])
+        self.assertEqual(module.torndown, [1])
+        self.assertEqual(self.manager.plugins, {})
+
+
+    def test_missing(self):
+        self.assertRaises(ImportError, self.manager.load,
+                          "infobarbnosuchplugin")
+
+
+    def test_enablement(self):
+        """
+        Disabled plugins stay disabled when they are reloaded.
+        """
+        rules = enablement.PluginEnablement()
+        self.manager = plugins.PluginManager(self.p, rules)
+        self._version(1)
+        self.manager.load("infobarbtestplugin")
+        rules.disable("infobarbtestplugin")
+
+        self._version(2)
+        module = self.manager.reload("infobarbtestplugin")
+        self.p.trigger(event="foo", x=1)
+        self.assertEqual(module.calls, [])
+
+        rules.enable("infobarbtestplugin")
+        self.p.trigger(event="foo", x=2)
+        self.assertEqual(module.calls, [(2, 2)])
+
+
+
+class LazyLoadingTestCase(PluginManagerTestCase):
+    def _lazy(self, stubs):
+        self._version(1)
+        self.manager.loadLazily("infobarbtestplugin", stubs)
+
+
+    def test_notLoadedUntilNeeded(self):
+        self._lazy([("foo", ("x", "y"), None)])
+        self.assertNotIn("infobarbtestplugin", sys.modules)
+
+        self.p.trigger(event="bar", x=1)
+        self.assertNotIn("infobarbtestplugin", sys.modules)
+
+
+    def test_firstEventDelivered(self):
+        """
+        The event that loads a plugin reaches its hooks, exactly once.
+        """
+        self._lazy([("foo", ("x", "y"), None)])
+        self.p.trigger(event="foo", x=1, y=2)
+        self.p.trigger(event="foo", x=3, y=4)
+
+        module = self.manager.plugins["infobarbtestplugin"]
+        self.assertEqual(module.calls, [(1, 1), (1, 3)])
+        self.assertEqual(self.manager.lazy, set())
+
+
+    def test_severalStubs(self):
+        """
+        Stand-ins for the same event load the plugin only once.
+        """
+        self._lazy([("foo", ("x", "y"), None), ("foo", ("x", "y"), "!")])
+        self.p.trigger(event="foo", x=1, y="!hi")
+
+        module = self.manager.plugins["infobarbtestplugin"]
+        self.assertEqual(module.calls, [(1, 1)])
+
+
+    def test_prefix(self):
+        self._lazy([("foo", ("x", "y"), "!paste")])
+        self.p.trigger(event="foo", x=1, y="hi")
+        self.assertNotIn("infobarbtestplugin", sys.modules)
+
+
+    def test_sharedPangler(self):
+        """
+        Plugins loaded through a shared pangler see its instance.
+        """
+        self._write("calls = []\n"
+                    "def setup(p):\n"
+                    "    p.subscribe(hook, event='foo', needs=['x'])\n"
+                    "def hook(self, p, x):\n"
+                    "    calls.append((self, p, x))\n")
+        self.manager.loadLazily("infobarbtestplugin", [("foo", ("x",), None)])
+
+        instance = object()
+        shared = self.p.share(instance)
+        shared.fire("foo", ("x",), (1,))
+
+        module = self.manager.plugins["infobarbtestplugin"]
+        [(self_, p, x)] = module.calls
+        self.assertIdentical(self_, instance)
+        self.assertIdentical(p, shared)
+        self.assertEqual(x, 1)
+
+
+    def test_firstEventTriggers(self):
+        """
+        Events hooks trigger while handling the first event reach every hook.
+        """
+        self._write("def setup(p):\n"
+                    "    p.subscribe(hook, event='foo', needs=['x'])\n"
+                    "def hook(p, x):\n"
+                    "    p.trigger(event='bar', x=x)\n")
+        self.manager.loadLazily("infobarbtestplugin", [("foo", ("x",), None)])
+        calls = []
+        self.p.subscribe(lambda p, x: calls.append(x), event="bar",
+                         needs=["x"])
+
+        self.p.trigger(event="foo", x=1)
+        self.assertEqual(calls, [1])
+
+
+    def test_firstEventModified(self):
+        """
+        Hooks after a plugin see the first event as the plugin modified it,
+        exactly once.
+        """
+        self._write("def setup(p):\n"
+                    "    p.subscribe(hook, event='foo', modifies=['x'])\n"
+                    "def hook(p, x):\n"
+                    "    return {'x': x + 1}\n")
+        self.manager.loadLazily("infobarbtestplugin", [("foo", ("x",), None)])
+        calls = []
+        self.p.subscribe(lambda p, x: calls.append(x), event="foo",
+                         needs=["x"])
+
+        self.p.trigger(event="foo", x=1)
+        self.assertEqual(calls, [2])
+
+
+    def test_firstEventCounted(self):
+        """
+        The first event goes through the pangler's instrumentation.
+        """
+        hookStats = stats.HookStats()
+        self.p.instrument(hookStats)
+        self._lazy([("foo", ("x",), None)])
+        self.p.trigger(event="foo", x=1)
+
+        [entry] = [entry for entry in hookStats.snapshot()
+                   if entry["hook"] == "infobarbtestplugin.hook"]
+        self.assertEqual(entry["calls"], 1)
+
+
+    def test_unloadLazy(self):
+        self._lazy([("foo", ("x",), None)])
+        self.manager.unload("infobarbtestplugin")
+        self.p.trigger(event="foo", x=1)
+        self.assertNotIn("infobarbtestplugin", sys.modules)
+        self.assertEqual(self.p.hooks, [])
+
+
+    def test_unloadUnknown(self):
+        self.assertRaises(KeyError, self.manager.unload, "nothing")
@@ -0,0 +1,180 @@
+"""
+Tests for recording and replaying events.
+"""
+import os
+
+from twisted.internet import task
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from infobarb import dispatch, irc, recording
+from infobarb.test.test_dispatch import Recorder
+
+
+class _Bot(object):
+    def __init__(self, pangler):
+        self.p = pangler.bind(self)
+        self.client = irc.InfobarbClient(self.p)
+        self.client.nickname = "barb"
+        irc.addDefaultDispatchHooks(self.p)
+
+
+
+class EventLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+
+
+    def _roundTrip(self, events, **kwargs):
+        log = recording.EventLog(self.path, **kwargs)
+        for event in events:
+            log.append(*event)
+        log.close()
+        return list(recording.readEvents(self.path))
+
+
+    def test_roundTrip(self):
+        events = [
+            (1.5, "privmsgReceived", ("user", "channel", "message"),
+             ("lvh!l@example.com", "#python", "hi")),
+            (2.0, "userQuit", ("user", "quitMessage"), ("dash", None)),
+            (2.5, "custom", ("a", "b", "c", "d"),
+             (u"\N{SNOWMAN}", 12, [1.5, True, b"x"], -3)),
+        ]
+        self.assertEqual(self._roundTrip(events), events)
+
+
+    def test_shapesWrittenOnce(self):
+        """
+        Repeated events only log their values, not their names.
+        """
+        event = (0.0, "userJoined", ("user", "channel"), ("lvh", "#python"))
+        self._roundTrip([event])
+        once = os.path.getsize(self.path)
+        self._roundTrip([event] * 2)
+        twice = os.path.getsize(self.path)
+        self._roundTrip([event] * 3)
+        self.assertEqual(os.path.getsize(self.path) - twice, twice - once)
+        self.assertTrue(twice - once < once - len(recording.MAGIC))
+
+
+    def test_growing(self):
+        events = [(float(i), "userJoined", ("user", "channel"),
+                   ("user%d" % (i,), "#python")) for i in range(1000)]
+        self.assertEqual(self._roundTrip(events, chunkSize=64), events)
+
+
+    def test_unclosed(self):
+        """
+        A log that wasn't closed ends at the last record written.
+        """
+        log = recording.EventLog(self.path, chunkSize=4096)
+        log.append(1.0, "userJoined", ("user", "channel"), ("lvh", "#a"))
+        log.flush()
+        self.assertEqual(os.path.getsize(self.path), 4096)
+        self.assertEqual(list(recording.readEvents(self.path)),
+                         [(1.0, "userJoined", ("user", "channel"),
+                           ("lvh", "#a"))])
+        log.close()
+
+
+    def test_notALog(self):
+        with open(self.path, "wb") as f:
+            f.write(b"something else entirely")
+        self.assertRaises(ValueError, list, recording.readEvents(self.path))
+
+
+    def test_unloggable(self):
+        log = recording.EventLog(self.path)
+        self.addCleanup(log.close)
+        self.assertRaises(TypeError, log.append, 0.0, "foo", ("x",),
+                          (object(),))
+
+
+
+class RecordAndReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        self.clock = task.Clock()
+
+        bot = _Bot(dispatch.Pangler())
+        bot.client.makeConnection(StringTransport())
+        log = recording.EventLog(self.path)
+        recording.attach(bot.client, log, self.clock)
+
+        bot.client.lineReceived(":lvh!l@example.com PRIVMSG #python :hi")
+        self.clock.advance(10)
+        bot.client.lineReceived(":dash!d@example.com JOIN #python")
+        log.close()
+
+        self.recorder = Recorder()
+        self.bot = _Bot(dispatch.Pangler())
+        self.bot.p.subscribe(self.recorder.hook("message"),
+                             event="channelMessageReceived",
+                             needs=["user", "message"])
+        self.bot.p.subscribe(self.recorder.hook("join"),
+                             event="userJoined", needs=["user"])
+
+
+    def _names(self):
+        return [name for name, _, _ in self.recorder.calls]
+
+
+    def test_recorded(self):
+        self.assertEqual(list(recording.readEvents(self.path)), [
+            (0.0, "privmsgReceived", ("user", "channel", "message"),
+             ("lvh!l@example.com", "#python", "hi")),
+            (10.0, "userJoined", ("user", "channel"), ("dash", "#python")),
+        ])
+
+
+    def test_replayAsFastAsPossible(self):
+        """
+        Replayed events go through the default dispatch hooks, so plugins
+        see the events those fire.
+        """
+        d = recording.replay(self.path, self.bot.p)
+        self.assertEqual(self.successResultOf(d), 2)
+        self.assertEqual(self.recorder.calls, [
+            ("message", (self.bot, self.bot.p),
+             {"user": "lvh!l@example.com", "message": "hi"}),
+            ("join", (self.bot, self.bot.p), {"user": "dash"}),
+        ])
+
+
+    def test_replayFaster(self):
+        clock = task.Clock()
+        d = recording.replay(self.path, self.bot.p, speed=2, reactor=clock)
+        self.assertEqual(self._names(), ["message"])
+
+        clock.advance(4.9)
+        self.assertEqual(self._names(), ["message"])
+        clock.advance(0.1)
+        self.assertEqual(self._names(), ["message", "join"])
+        self.assertEqual(self.successResultOf(d), 2)
+
+
+    def _failOnJoin(self):
+        def join(self, p, user):
+            raise RuntimeError("boom")
+
+        self.bot.p.subscribe(join, event="userJoined", needs=["user"])
+
+
+    def test_replayError(self):
+        self._failOnJoin()
+        d = recording.replay(self.path, self.bot.p)
+        self.failureResultOf(d, RuntimeError)
+
+
+    def test_replayFasterError(self):
+        """
+        Errors from events fired later still fail the Deferred.
+        """
+        self._failOnJoin()
+        clock = task.Clock()
+        d = recording.replay(self.path, self.bot.p, speed=2, reactor=clock)
+        self.assertNoResult(d)
+
+        clock.advance(5)
+        self.failureResultOf(d, RuntimeError)
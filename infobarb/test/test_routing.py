@@ -0,0 +1,203 @@
+"""
+Tests for hook filters and routing.
+"""
+import re
+
+import panglery
+
+from twisted.trial import unittest
+
+from infobarb import dispatch, irc, routing
+
+
+class FilterTestCase(unittest.TestCase):
+    def test_channels(self):
+        f = routing.Filter(channels=["#Python"])
+        self.assertTrue(f.matches(channel="#python"))
+        self.assertFalse(f.matches(channel="#twisted"))
+        self.assertFalse(f.matches())
+
+
+    def test_nick(self):
+        f = routing.Filter(nick="lv*")
+        self.assertTrue(f.matches(user="LVH!lvh@example.com"))
+        self.assertFalse(f.matches(user="habnabit!h@example.com"))
+        self.assertFalse(f.matches(user="x!lvh@example.com"))
+
+
+    def test_prefix(self):
+        f = routing.Filter(prefix="!help")
+        self.assertTrue(f.matches(message="!help paste"))
+        self.assertFalse(f.matches(message="help!"))
+
+
+    def test_pattern(self):
+        for pattern in ["https?://", re.compile("https?://")]:
+            f = routing.Filter(pattern=pattern)
+            self.assertTrue(f.matches(message="see http://example.com"))
+            self.assertFalse(f.matches(message="no links"))
+
+
+    def test_combined(self):
+        f = routing.Filter(channels=["#python"], prefix="!")
+        self.assertTrue(f.matches(channel="#python", message="!help"))
+        self.assertFalse(f.matches(channel="#python", message="help"))
+        self.assertFalse(f.matches(channel="#twisted", message="!help"))
+
+
+    def test_fields(self):
+        f = routing.Filter(channels=["#python"], nick="*", pattern="x")
+        self.assertEqual(f.fields, set(["channel", "user", "message"]))
+
+
+    def test_fromKwargs(self):
+        kwargs = {"channels": ["#python"], "needs": ["user"]}
+        f = routing.Filter.fromKwargs(kwargs)
+        self.assertEqual(f.channels, frozenset(["#python"]))
+        self.assertEqual(kwargs, {"needs": ["user"]})
+
+
+    def test_fromKwargsNone(self):
+        self.assertIdentical(routing.Filter.fromKwargs({"needs": []}), None)
+
+
+    def test_matchesEventMissingField(self):
+        f = routing.Filter(prefix="!")
+        self.assertFalse(f.matchesEvent({"user": "lvh"}))
+
+
+
+class RouteIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = routing.RouteIndex({"channel": 1, "message": 2})
+
+
+    def _route(self, channel, message):
+        return [entry[1] for entry in
+                self.index.route(("event", channel, message))]
+
+
+    def test_routing(self):
+        self.index.add((0, "always"), None)
+        self.index.add((1, "python"), routing.Filter(channels=["#python"]))
+        self.index.add((2, "help"), routing.Filter(prefix="!help"))
+        self.index.add((3, "link"), routing.Filter(pattern="http://"))
+        self.index.add((4, "twisted"), routing.Filter(channels=["#twisted"]))
+
+        self.assertEqual(self._route("#python", "!help http://x"),
+                         ["always", "python", "help", "link"])
+        self.assertEqual(self._route("#twisted", "hi"),
+                         ["always", "twisted"])
+
+
+    def test_prefixLengths(self):
+        self.index.add((0, "short"), routing.Filter(prefix="!"))
+        self.index.add((1, "long"), routing.Filter(prefix="!paste"))
+
+        self.assertEqual(self._route("#a", "!paste"), ["short", "long"])
+        self.assertEqual(self._route("#a", "!p"), ["short"])
+        self.assertEqual(self._route("#a", ""), [])
+
+
+    def test_channelAndPrefix(self):
+        """
+        Filters indexed by channel still check their other criteria.
+        """
+        self.index.add((0, "x"), routing.Filter(channels=["#a"], prefix="!"))
+        self.assertEqual(self._route("#a", "hi"), [])
+        self.assertEqual(self._route("#a", "!hi"), ["x"])
+
+
+    def test_disabledInChannels(self):
+        self.index.add((0, "x"), None, (True, frozenset(["#a"])))
+        self.index.add((1, "y"), routing.Filter(channels=["#a", "#b"]),
+                       (True, frozenset(["#a"])))
+        self.assertEqual(self._route("#A", "hi"), [])
+        self.assertEqual(self._route("#b", "hi"), ["x", "y"])
+
+
+    def test_enabledInChannels(self):
+        self.index.add((0, "x"), routing.Filter(prefix="!"),
+                       (False, frozenset(["#a"])))
+        self.index.add((1, "y"), routing.Filter(channels=["#b"]),
+                       (False, frozenset(["#a"])))
+        self.assertEqual(self._route("#a", "!hi"), ["x"])
+        self.assertEqual(self._route("#a", "hi"), [])
+        self.assertEqual(self._route("#b", "!hi"), [])
+        self.assertEqual(self.index._byPrefix, {})
+
+
+
+class FilteredShortcutMixin(object):
+    def setUp(self):
+        self.p = self.panglerFactory()
+        self.f = irc.FancyInfobarbPangler(self.p)
+        self.calls = []
+
+
+    def _hook(self, name):
+        return lambda p, **kwargs: self.calls.append(name)
+
+
+    def _message(self, channel, message, user="lvh!lvh@example.com"):
+        self.p.trigger(event="channelMessageReceived", user=user,
+                       channel=channel, message=message)
+
+
+    def test_channels(self):
+        self.f.onChannelMessage(self._hook("a"), channels=["#python"])
+        self._message("#python", "hi")
+        self._message("#twisted", "hi")
+        self.assertEqual(self.calls, ["a"])
+
+
+    def test_decorator(self):
+        hook = self._hook("a")
+        self.assertIdentical(self.f.onChannelMessage(prefix="!")(hook), hook)
+        self._message("#python", "!help")
+        self._message("#python", "help")
+        self.assertEqual(self.calls, ["a"])
+
+
+    def test_order(self):
+        """
+        Filtered and unfiltered hooks are called in subscription order.
+        """
+        self.f.onChannelMessage(self._hook("a"), nick="lvh")
+        self.f.onChannelMessage(self._hook("b"))
+        self.f.onChannelMessage(self._hook("c"), channels=["#python"])
+        self.f.onChannelMessage(self._hook("d"), prefix="!")
+        self._message("#python", "!help")
+        self.assertEqual(self.calls, ["a", "b", "c", "d"])
+
+
+    def test_missingField(self):
+        """
+        A filter on an argument the event doesn't have never matches.
+        """
+        self.f.onUserJoin(self._hook("a"), prefix="!")
+        self.p.trigger(event="userJoined", user="lvh", channel="#python")
+        self.assertEqual(self.calls, [])
+
+
+
+class CompiledFilteredShortcutTestCase(FilteredShortcutMixin,
+                                       unittest.TestCase):
+    panglerFactory = dispatch.Pangler
+
+
+    def test_modifiedEvent(self):
+        """
+        Filters still apply after a hook has modified the event.
+        """
+        self.p.subscribe(lambda p, message: {"message": "!" + message},
+                         event="channelMessageReceived", modifies=["message"])
+        self.f.onChannelMessage(self._hook("a"), prefix="!")
+        self.f.onChannelMessage(self._hook("b"), prefix="?")
+        self._message("#python", "help")
+        self.assertEqual(self.calls, ["a"])
+
+
+
+class PlainFilteredShortcutTestCase(FilteredShortcutMixin, unittest.TestCase):
+    panglerFactory = panglery.Pangler
@@ -0,0 +1,192 @@
+"""
+Tests for channel state tracking.
+"""
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from infobarb import dispatch, irc, state
+
+
+class ChannelStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.state = state.ChannelState()
+        self.state.namesReply("#python", ["@lvh", "+dash", "habnabit"],
+                              {"@": "o", "+": "v"})
+        self.state.joined("lvh", "#twisted")
+
+
+    def test_namesReply(self):
+        self.assertEqual(sorted(self.state.members("#Python")),
+                         ["dash", "habnabit", "lvh"])
+        self.assertTrue(self.state.isOp("lvh", "#python"))
+        self.assertTrue(self.state.isVoiced("dash", "#python"))
+        self.assertFalse(self.state.isOp("habnabit", "#python"))
+
+
+    def test_multiplePrefixes(self):
+        self.state.namesReply("#a", ["@+radix"], {"@": "o", "+": "v"})
+        self.assertEqual(self.state.modes("radix", "#a"), "ov")
+
+
+    def test_isOn(self):
+        self.assertTrue(self.state.isOn("LVH", "#python"))
+        self.assertFalse(self.state.isOn("lvh", "#nowhere"))
+        self.assertFalse(self.state.isOn("nobody", "#python"))
+
+
+    def test_channelsOf(self):
+        self.assertEqual(sorted(self.state.channelsOf("lvh")),
+                         ["#python", "#twisted"])
+        self.assertEqual(self.state.channelsOf("nobody"), [])
+
+
+    def test_left(self):
+        self.state.left("lvh", "#python")
+        self.assertFalse(self.state.isOn("lvh", "#python"))
+        self.assertEqual(self.state.channelsOf("lvh"), ["#twisted"])
+
+
+    def test_leftLastChannel(self):
+        """
+        Nicknames we share no channels with are forgotten entirely.
+        """
+        self.state.left("dash", "#python")
+        self.assertNotIn("dash", self.state._nicks)
+        self.assertNotIn("dash", self.state._displayNames)
+
+
+    def test_quit(self):
+        channels = self.state.quit("lvh")
+        self.assertEqual(sorted(channels), ["#python", "#twisted"])
+        self.assertEqual(self.state.channelsOf("lvh"), [])
+        self.assertFalse(self.state.isOn("lvh", "#twisted"))
+
+
+    def test_renamed(self):
+        self.state.renamed("lvh", "lvh_")
+        self.assertFalse(self.state.isOn("lvh", "#python"))
+        self.assertTrue(self.state.isOp("lvh_", "#python"))
+        self.assertIn("lvh_", self.state.members("#python"))
+
+
+    def test_renamedUnknown(self):
+        self.state.renamed("nobody", "somebody")
+        self.assertEqual(self.state.channelsOf("somebody"), [])
+
+
+    def test_modeChanged(self):
+        self.state.modeChanged("#python", True, "ov", ("habnabit", "lvh"))
+        self.assertTrue(self.state.isOp("habnabit", "#python"))
+        self.assertEqual(self.state.modes("lvh", "#python"), "ov")
+
+        self.state.modeChanged("#python", False, "o", ("lvh",))
+        self.assertEqual(self.state.modes("lvh", "#python"), "v")
+
+
+    def test_channelModesIgnored(self):
+        self.state.modeChanged("#python", True, "tl", (None, "10"))
+        self.assertEqual(self.state.modes("lvh", "#python"), "o")
+
+
+    def test_forgetChannel(self):
+        self.state.forgetChannel("#python")
+        self.assertEqual(self.state.channels(), ["#twisted"])
+        self.assertEqual(self.state.channelsOf("dash"), [])
+        self.assertEqual(self.state.channelsOf("lvh"), ["#twisted"])
+
+
+    def test_topic(self):
+        self.assertIdentical(self.state.topic("#python"), None)
+        self.state.topicUpdated("#python", "be nice")
+        self.assertEqual(self.state.topic("#PYTHON"), "be nice")
+
+
+    def test_clear(self):
+        self.state.clear()
+        self.assertEqual(self.state.channels(), [])
+        self.assertEqual(self.state.channelsOf("lvh"), [])
+
+
+
+class ClientStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = irc.InfobarbClient(dispatch.Pangler())
+        self.client.nickname = "barb"
+        self.client.makeConnection(StringTransport())
+        self.state = self.client.channelState
+
+        self._line(":barb!b@example.com JOIN #python")
+        self._line(":server 353 barb = #python :barb @lvh +dash")
+
+
+    def _line(self, line):
+        self.client.lineReceived(line)
+
+
+    def test_names(self):
+        self.assertEqual(sorted(self.state.members("#python")),
+                         ["barb", "dash", "lvh"])
+        self.assertTrue(self.state.isOp("lvh", "#python"))
+
+
+    def test_join(self):
+        self._line(":habnabit!h@example.com JOIN #python")
+        self.assertTrue(self.state.isOn("habnabit", "#python"))
+
+
+    def test_part(self):
+        self._line(":lvh!l@example.com PART #python :bye")
+        self.assertFalse(self.state.isOn("lvh", "#python"))
+
+
+    def test_ownPart(self):
+        self._line(":barb!b@example.com PART #python")
+        self.assertEqual(self.state.channels(), [])
+
+
+    def test_quit(self):
+        self._line(":lvh!l@example.com QUIT :bye")
+        self.assertEqual(self.state.channelsOf("lvh"), [])
+
+
+    def test_kick(self):
+        self._line(":lvh!l@example.com KICK #python dash :spam")
+        self.assertFalse(self.state.isOn("dash", "#python"))
+
+
+    def test_ownKick(self):
+        self._line(":lvh!l@example.com KICK #python barb :bye")
+        self.assertEqual(self.state.channels(), [])
+
+
+    def test_nick(self):
+        self._line(":lvh!l@example.com NICK lvh_")
+        self.assertTrue(self.state.isOp("lvh_", "#python"))
+
+
+    def test_mode(self):
+        self._line(":lvh!l@example.com MODE #python +o-v dash dash")
+        self.assertEqual(self.state.modes("dash", "#python"), "o")
+
+
+    def test_topic(self):
+        self._line(":server 332 barb #python :be nice")
+        self.assertEqual(self.state.topic("#python"), "be nice")
+
+
+    def test_hooksSeeUserBeforeLeaving(self):
+        """
+        Hooks for a departure still see the user in the channel.
+        """
+        seen = []
+        self.client.p.subscribe(
+            lambda p, user, channel: seen.append(
+                self.state.isOn(user, channel)),
+            event="userLeft", needs=["user", "channel"])
+        self._line(":lvh!l@example.com PART #python")
+        self.assertEqual(seen, [True])
+
+
+    def test_connectionLost(self):
+        self.client.connectionLost(None)
+        self.assertEqual(self.state.channels(), [])
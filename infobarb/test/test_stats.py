@@ -0,0 +1,181 @@
+"""
+Tests for per-hook statistics.
+"""
+from twisted.trial import unittest
+
+from infobarb import dispatch, stats
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self):
+        return self.now
+
+
+
+class MessageRecorder(object):
+    def __init__(self):
+        self.messages = []
+
+
+    def msg(self, user, message):
+        self.messages.append((user, message))
+
+
+
+def slowHook(p, timer, seconds, **kwargs):
+    timer.now += seconds
+
+
+
+def failingHook(p, **kwargs):
+    raise RuntimeError("boom")
+
+
+
+class HookStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.stats = stats.HookStats()
+        self.stats.timer = self.timer
+        self.p = dispatch.Pangler()
+
+
+    def test_hookName(self):
+        self.assertEqual(stats.hookName(slowHook),
+                         "infobarb.test.test_stats.slowHook")
+
+
+    def test_notInstrumented(self):
+        """
+        Hooks aren't counted until instrumentation is switched on.
+        """
+        self.p.subscribe(slowHook, event="foo", needs=["timer", "seconds"])
+        self.p.trigger(event="foo", timer=self.timer, seconds=1)
+        self.assertEqual(self.stats.snapshot(), [])
+
+
+    def test_counts(self):
+        """
+        Calls, total and maximum time are counted per event and hook.
+        """
+        self.p.subscribe(slowHook, event="foo", needs=["timer", "seconds"])
+        self.p.instrument(self.stats)
+
+        for seconds in [1, 3, 2]:
+            self.p.trigger(event="foo", timer=self.timer, seconds=seconds)
+
+        self.assertEqual(self.stats.snapshot(), [{
+            "event": "foo",
+            "hook": stats.hookName(slowHook),
+            "calls": 3,
+            "totalTime": 6.0,
+            "maxTime": 3.0,
+            "errors": 0,
+        }])
+
+
+    def test_sameName(self):
+        """
+        Hooks with the same name are counted separately.
+        """
+        for seconds in [1, 2]:
+            self.p.subscribe(lambda p, timer, seconds=seconds:
+                             slowHook(p, timer, seconds),
+                             event="foo", needs=["timer"])
+        self.p.instrument(self.stats)
+        self.p.trigger(event="foo", timer=self.timer)
+
+        entries = self.stats.snapshot()
+        self.assertEqual([entry["hook"] for entry in entries],
+                         ["infobarb.test.test_stats.<lambda>"] * 2)
+        self.assertEqual([entry["totalTime"] for entry in entries],
+                         [2.0, 1.0])
+
+
+    def test_errors(self):
+        self.p.subscribe(failingHook, event="foo", needs=["x"])
+        self.p.instrument(self.stats)
+
+        self.assertRaises(RuntimeError, self.p.trigger, event="foo", x=1)
+        [entry] = self.stats.snapshot()
+        self.assertEqual((entry["calls"], entry["errors"]), (1, 1))
+
+
+    def test_switchOff(self):
+        self.p.subscribe(slowHook, event="foo", needs=["timer", "seconds"])
+        self.p.instrument(self.stats)
+        self.p.trigger(event="foo", timer=self.timer, seconds=1)
+        self.p.instrument(None)
+        self.p.trigger(event="foo", timer=self.timer, seconds=1)
+
+        [entry] = self.stats.snapshot()
+        self.assertEqual(entry["calls"], 1)
+
+
+    def test_reset(self):
+        self.p.subscribe(slowHook, event="foo", needs=["timer", "seconds"])
+        self.p.instrument(self.stats)
+        self.p.trigger(event="foo", timer=self.timer, seconds=1)
+        self.stats.reset()
+
+        [entry] = self.stats.snapshot()
+        self.assertEqual((entry["calls"], entry["totalTime"]), (0, 0.0))
+
+
+    def test_emptyReport(self):
+        self.assertEqual(self.stats.report(), ["no hook statistics recorded"])
+
+
+
+class StatsCommandTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = MessageRecorder()
+        self.p = dispatch.Pangler().bind(self)
+        self.stats = stats.HookStats()
+        stats.addStatsCommand(self.p, self.stats, ["lvh!*@example.com"])
+
+
+    def _message(self, user, message):
+        self.p.trigger(event="privateMessageReceived", user=user,
+                       message=message)
+
+
+    def test_notAdmin(self):
+        self._message("mallory!m@example.org", "stats on")
+        self.assertEqual(self.client.messages, [])
+        self.assertIdentical(self.p._stats, None)
+
+
+    def test_switchOnAndOff(self):
+        self._message("lvh!lvh@example.com", "stats on")
+        self.assertIdentical(self.p._stats, self.stats)
+
+        self._message("lvh!lvh@example.com", "stats off")
+        self.assertIdentical(self.p._stats, None)
+        self.assertEqual(self.client.messages, [
+            ("lvh", "hook statistics on"),
+            ("lvh", "hook statistics off"),
+        ])
+
+
+    def test_report(self):
+        """
+        The report counts the command's own earlier calls, but not the one
+        that is still running.
+        """
+        self._message("lvh!lvh@example.com", "stats on")
+        self._message("lvh!lvh@example.com", "stats")
+        self._message("lvh!lvh@example.com", "stats")
+
+        user, line = self.client.messages[-1]
+        self.assertEqual(user, "lvh")
+        self.assertIn("statsCommand on privateMessageReceived: 1 calls", line)
+
+
+    def test_otherMessages(self):
+        self._message("lvh!lvh@example.com", "hello")
+        self.assertEqual(self.client.messages, [])
@@ -0,0 +1,136 @@
+"""
+Tests for the reactor lag watchdog.
+"""
+import threading
+import time
+
+import panglery
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from infobarb import dispatch, stats, watchdog
+from infobarb.test.test_dispatch import Recorder
+
+
+class SampleStackTestCase(unittest.TestCase):
+    def _sampleIn(self, p):
+        samples = []
+
+        def slowHook(p, x):
+            samples.append(watchdog.sampleStack(
+                threading.current_thread().ident))
+
+        def outerHook(p, x):
+            p.trigger(event="inner", x=x)
+
+        p.subscribe(outerHook, event="outer", needs=["x"])
+        p.subscribe(slowHook, event="inner", needs=["x"])
+        p.trigger(event="outer", x=1)
+
+        [(chain, stack)] = samples
+        self.assertIn("slowHook", "".join(stack))
+        return chain, [stats.hookName(outerHook), stats.hookName(slowHook)]
+
+
+    def test_compiledPangler(self):
+        chain, (outer, slow) = self._sampleIn(dispatch.Pangler())
+        self.assertEqual(chain, [["outer", outer], ["inner", slow]])
+
+
+    def test_plainPangler(self):
+        chain, (outer, slow) = self._sampleIn(panglery.Pangler())
+        self.assertEqual(chain, [["outer", outer], ["inner", slow]])
+
+
+    def test_noThread(self):
+        self.assertIdentical(watchdog.sampleStack(-1), None)
+
+
+
+class LagWatchdogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.p = dispatch.Pangler()
+        self.recorder = Recorder()
+        self.p.subscribe(self.recorder.hook("stalled"),
+                         event="reactorStalled", needs=watchdog.ARGS)
+
+        self.watchdog = watchdog.LagWatchdog(
+            self.p, interval=0.1, threshold=0.5, window=3,
+            sampleStacks=False, reactor=self.clock)
+        self.watchdog.timer = self.clock.seconds
+        self.watchdog.startService()
+        self.addCleanup(self.watchdog.stopService)
+
+
+    def _counts(self):
+        return dict((bound, count)
+                    for bound, count in self.watchdog.histogram() if count)
+
+
+    def test_onTime(self):
+        self.clock.advance(0.1)
+        self.clock.advance(0.1)
+        self.assertEqual(self._counts(), {0.001: 2})
+        self.assertEqual(self.recorder.calls, [])
+
+
+    def test_stall(self):
+        self.clock.advance(1.1)
+        self.assertEqual(self.watchdog.stalls, 1)
+        [(_, _, kwargs)] = self.recorder.calls
+        self.assertAlmostEqual(kwargs.pop("lag"), 1.0)
+        self.assertEqual(kwargs, {"eventName": None, "hook": None,
+                                  "chain": [], "stack": []})
+        self.assertEqual(self._counts(), {1.0: 1})
+
+
+    def test_belowThreshold(self):
+        self.clock.advance(0.5)
+        self.assertEqual(self.recorder.calls, [])
+        self.assertEqual(self._counts(), {0.5: 1})
+
+
+    def test_rolling(self):
+        self.clock.advance(20)
+        for _ in range(3):
+            self.clock.advance(0.1)
+        self.assertEqual(self._counts(), {0.001: 3})
+
+
+    def test_stopService(self):
+        self.watchdog.stopService()
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
+class StackSamplingTestCase(unittest.TestCase):
+    """
+    Tests that run a watchdog thread against the real reactor.
+    """
+    def test_slowHookAttributed(self):
+        p = dispatch.Pangler()
+        d = defer.Deferred()
+        p.subscribe(lambda p, **kwargs: d.callback(kwargs),
+                    event="reactorStalled", needs=watchdog.ARGS)
+
+        def slowHook(p, x):
+            time.sleep(0.5)
+
+        p.subscribe(slowHook, event="slow", needs=["x"])
+
+        dog = watchdog.LagWatchdog(p, interval=0.02, threshold=0.2)
+        dog.startService()
+        self.addCleanup(dog.stopService)
+        reactor.callLater(0.05, p.trigger, event="slow", x=1)
+
+        def check(stall):
+            self.assertTrue(stall["lag"] > 0.2)
+            self.assertEqual(stall["eventName"], "slow")
+            self.assertEqual(stall["hook"], stats.hookName(slowHook))
+            self.assertIn("slowHook", "".join(stall["stack"]))
+
+        return d.addCallback(check)
+
+    test_slowHookAttributed.timeout = 10
@@ -0,0 +1,193 @@
+"""
+Tests for the shared HTTP client, against a local HTTP server.
+"""
+from twisted.internet import defer, error, reactor, task
+from twisted.trial import unittest
+from twisted.web import resource, server
+from twisted.web.http_headers import Headers
+
+from infobarb import web
+
+
+class FreshnessTestCase(unittest.TestCase):
+    def _freshness(self, code=200, **headers):
+        headers = Headers(dict((name.replace("_", "-"), [value])
+                               for name, value in headers.items()))
+        return web.freshness(code, headers, 60, now=1000000000)
+
+
+    def test_maxAge(self):
+        self.assertEqual(self._freshness(cache_control="public, max-age=300"),
+                         300)
+
+
+    def test_noStore(self):
+        for value in ["no-store", "max-age=300, no-cache", "max-age=0"]:
+            self.assertIdentical(self._freshness(cache_control=value), None)
+
+
+    def test_expires(self):
+        self.assertEqual(
+            self._freshness(expires="Sun, 09 Sep 2001 01:48:20 GMT"), 100)
+        self.assertIdentical(self._freshness(expires="0"), None)
+
+
+    def test_default(self):
+        self.assertEqual(self._freshness(), 60)
+        self.assertIdentical(self._freshness(code=500), None)
+
+
+
+class StandIn(resource.Resource):
+    """
+    A stand-in web server that remembers its requests, and holds on to
+    requests for ``/slow`` until told to finish them. Requests for
+    ``/stalled`` get part of a body, and then nothing.
+    """
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.requests = []
+        self.headers = {}
+        self.held = []
+        self.arrived = defer.Deferred()
+
+
+    def render_GET(self, request):
+        self.requests.append(request.path)
+        for name, value in self.headers.get(request.path, {}).items():
+            request.setHeader(name, value)
+
+        if request.path == b"/slow":
+            self.held.append(request)
+            arrived, self.arrived = self.arrived, defer.Deferred()
+            arrived.callback(request)
+            return server.NOT_DONE_YET
+        if request.path == b"/stalled":
+            request.write(b"partial")
+            return server.NOT_DONE_YET
+        return b"hello from " + request.path
+
+
+    def finish(self):
+        request = self.held.pop(0)
+        request.write(b"finally")
+        request.finish()
+
+
+
+class HTTPServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.standIn = StandIn()
+        port = reactor.listenTCP(0, server.Site(self.standIn),
+                                 interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        self.root = "http://127.0.0.1:%d" % (port.getHost().port,)
+
+        self.http = web.HTTPService(maxPerHost=1)
+        self.addCleanup(self.http.stopService)
+
+
+    def test_get(self):
+        d = self.http.get(self.root + "/a")
+
+        def check(response):
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body, b"hello from /a")
+            self.assertFalse(response.truncated)
+
+        return d.addCallback(check)
+
+
+    @defer.inlineCallbacks
+    def test_cached(self):
+        first = yield self.http.get(self.root + "/a")
+        second = yield self.http.get(self.root + "/a")
+        self.assertIdentical(second, first)
+        self.assertEqual(self.standIn.requests, [b"/a"])
+
+
+    @defer.inlineCallbacks
+    def test_noStore(self):
+        self.standIn.headers[b"/a"] = {b"Cache-Control": b"no-store"}
+        yield self.http.get(self.root + "/a")
+        yield self.http.get(self.root + "/a")
+        self.assertEqual(self.standIn.requests, [b"/a", b"/a"])
+
+
+    @defer.inlineCallbacks
+    def test_expired(self):
+        clock = self.http.clock = task.Clock()
+        self.standIn.headers[b"/a"] = {b"Cache-Control": b"max-age=10"}
+        yield self.http.get(self.root + "/a")
+        clock.advance(9)
+        yield self.http.get(self.root + "/a")
+        clock.advance(1)
+        yield self.http.get(self.root + "/a")
+        self.assertEqual(self.standIn.requests, [b"/a", b"/a"])
+
+
+    @defer.inlineCallbacks
+    def test_coalesced(self):
+        """
+        Requests for a URL that is being fetched wait for that fetch.
+        """
+        gets = [self.http.get(self.root + "/slow") for _ in range(10)]
+        yield self.standIn.arrived
+        self.standIn.finish()
+
+        responses = yield defer.gatherResults(gets)
+        self.assertEqual(set(response.body for response in responses),
+                         set([b"finally"]))
+        self.assertEqual(self.standIn.requests, [b"/slow"])
+
+
+    @defer.inlineCallbacks
+    def test_perHostLimit(self):
+        slow = self.http.get(self.root + "/slow")
+        yield self.standIn.arrived
+        other = self.http.get(self.root + "/other")
+        yield task.deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(self.standIn.requests, [b"/slow"])
+
+        self.standIn.finish()
+        yield defer.gatherResults([slow, other])
+        self.assertEqual(self.standIn.requests, [b"/slow", b"/other"])
+
+
+    def test_truncated(self):
+        self.http.maxBodySize = 5
+        d = self.http.get(self.root + "/a")
+
+        def check(response):
+            self.assertEqual(response.body, b"hello")
+            self.assertTrue(response.truncated)
+
+        return d.addCallback(check)
+
+
+    @defer.inlineCallbacks
+    def test_stalledBody(self):
+        """
+        Requests that stall after their headers time out, and give up their
+        host's slot.
+        """
+        self.http.timeout = 0.1
+        yield self.assertFailure(self.http.get(self.root + "/stalled"),
+                                 defer.TimeoutError)
+        response = yield self.http.get(self.root + "/a")
+        self.assertEqual(response.body, b"hello from /a")
+
+
+    @defer.inlineCallbacks
+    def test_failed(self):
+        port = reactor.listenTCP(0, server.Site(self.standIn),
+                                 interface="127.0.0.1")
+        url = "http://127.0.0.1:%d/a" % (port.getHost().port,)
+        yield port.stopListening()
+
+        gets = [self.http.get(url), self.http.get(url)]
+        for d in gets:
+            yield self.assertFailure(d, error.ConnectionRefusedError)
+        self.assertEqual(self.http._waiting, {})
@@ -0,0 +1,501 @@
+"""
+Tests for running plugins in worker processes.
+"""
+import os
+import sys
+
+from twisted.internet import defer, error, task
+from twisted.internet.testing import StringTransport
+from twisted.python import failure
+from twisted.trial import unittest
+
+from infobarb import dispatch, identity, recording, routing, workers
+from infobarb.test.test_irc import CallStub
+
+
+PLUGIN = """
+def setup(p):
+    p.subscribe(echo, event="channelMessageReceived",
+                needs=["channel", "message"])
+
+def echo(self, p, channel, message):
+    self.client.msg(channel, message.upper())
+"""
+
+
+SUBSCRIPTIONS = [["infobarbworkerplugin", [
+    ["channelMessageReceived", ["user", "channel", "message", "identity"],
+     None],
+]]]
+
+
+IDENTITY = identity.Identity("lvh!l@example.com", "lvh", "l", "example.com",
+                             None, frozenset(["admin"]))
+
+
+def _frames(data):
+    """
+    Splits framed data into decoded messages.
+    """
+    messages = []
+    while data:
+        length, = workers._LENGTH.unpack_from(data)
+        end = workers._LENGTH.size + length
+        messages.append(recording.decode(data[workers._LENGTH.size:end]))
+        data = data[end:]
+    return messages
+
+
+
+class SubscriptionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.p = dispatch.Pangler()
+
+
+    def _subscribe(self, *prefixes):
+        scratch = dispatch.Pangler()
+        for prefix in prefixes:
+            routeFilter = None
+            if prefix is not None:
+                routeFilter = routing.Filter(prefix=prefix)
+            scratch.subscribe(CallStub(), routeFilter, event="foo",
+                              needs=["message"])
+        self.p.swap("plugin", scratch.hooks)
+
+
+    def _prefixes(self):
+        [[_, triples]] = workers.subscriptions(self.p)
+        return [prefix for _, _, prefix in triples]
+
+
+    def test_prefixes(self):
+        self._subscribe("!a", "!b")
+        self.assertEqual(self._prefixes(), ["!a", "!b"])
+
+
+    def test_overlappingPrefixes(self):
+        """
+        Messages matching several prefixes would be sent once per prefix,
+        so only the shortest is kept.
+        """
+        self._subscribe("!ab", "!a")
+        self.assertEqual(self._prefixes(), ["!a"])
+
+
+    def test_unfiltered(self):
+        self._subscribe("!a", None)
+        self.assertEqual(self._prefixes(), [None])
+
+
+    def test_anyEvent(self):
+        scratch = dispatch.Pangler()
+        scratch.subscribe(CallStub(), needs=["message"])
+        self.p.swap("plugin", scratch.hooks)
+        self.assertRaises(ValueError, workers.subscriptions, self.p)
+
+
+    def test_ownedOnly(self):
+        self.p.subscribe(CallStub(), event="foo", needs=["x"])
+        self.assertEqual(workers.subscriptions(self.p), [])
+
+
+
+class ShardTestCase(unittest.TestCase):
+    def test_sameChannelSameWorker(self):
+        a = workers.shard("x", {"channel": "#python", "user": "a"}, 8)
+        b = workers.shard("y", {"channel": "#PYTHON", "user": "b"}, 8)
+        self.assertEqual(a, b)
+
+
+    def test_userWithoutChannel(self):
+        a = workers.shard("userQuit", {"user": "lvh"}, 8)
+        b = workers.shard("privateMessageReceived", {"user": "lvh"}, 8)
+        self.assertEqual(a, b)
+
+
+    def test_privateMessagesByUser(self):
+        """
+        Private messages have the bot's nickname as their channel, so they
+        go by user instead.
+        """
+        a = workers.shard("privateMessageReceived",
+                          {"channel": "barb", "user": "lvh!l@example.com"}, 8)
+        b = workers.shard("userQuit", {"user": "lvh"}, 8)
+        self.assertEqual(a, b)
+
+        shards = set(workers.shard("privateMessageReceived",
+                                   {"channel": "barb", "user": "u%d" % (i,)},
+                                   4)
+                     for i in range(100))
+        self.assertEqual(shards, set(range(4)))
+
+
+    def test_spread(self):
+        shards = set(workers.shard("x", {"channel": "#%d" % (i,)}, 4)
+                     for i in range(100))
+        self.assertEqual(shards, set(range(4)))
+
+
+
+class WorkerProtocolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pangler = dispatch.Pangler()
+        self.protocol = workers.WorkerProtocol(self.pangler)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+
+    def _event(self, token, eventName, owner=None, **event):
+        argNames = sorted(event)
+        self.protocol.dataReceived(workers._frame(
+            ["event", token, owner, eventName, argNames,
+             [event[name] for name in argNames]]))
+
+
+    def test_onlyOwnerFired(self):
+        """
+        Events are only fired at the plugin they were forwarded to, so
+        plugins sharing an event each see it once.
+        """
+        calls = []
+        for name in "ab":
+            scratch = dispatch.Pangler()
+            scratch.subscribe(lambda self, p, x, name=name: calls.append(name),
+                              event="foo", needs=["x"])
+            self.pangler.swap(name, scratch.hooks)
+
+        self._event(0, "foo", owner="a", x=1)
+        self._event(0, "foo", owner="b", x=1)
+        self.assertEqual(calls, ["a", "b"])
+
+
+    def test_eventFired(self):
+        stub = CallStub()
+        self.pangler.subscribe(stub, event="foo", needs=["x"])
+        self._event(3, "foo", x=1, y=2)
+
+        (instance, p), kwargs = stub.calledWith
+        self.assertEqual(kwargs, {"x": 1})
+        self.assertIdentical(p.instance, instance)
+
+
+    def test_clientCalls(self):
+        """
+        Calls to the stand-in client are sent back, with the token of the
+        instance the event came from.
+        """
+        self.pangler.subscribe(
+            lambda self, p, x: self.client.msg("#python", x),
+            event="foo", needs=["x"])
+        self._event(3, "foo", x="hi")
+        self.assertEqual(_frames(self.transport.value())[1:],
+                         [["call", 3, "msg", ["#python", "hi"]]])
+
+
+    def test_identity(self):
+        """
+        Identities sent as lists come back as ``Identity`` objects.
+        """
+        stub = CallStub()
+        self.pangler.subscribe(stub, event="foo", needs=["identity"])
+        self._event(0, "foo", identity=IDENTITY.asList())
+        _, kwargs = stub.calledWith
+        self.assertEqual(kwargs, {"identity": IDENTITY})
+        self.assertIsInstance(kwargs["identity"], identity.Identity)
+
+
+    def test_subscriptionsSent(self):
+        """
+        The plugins' subscriptions are sent when the connection is made.
+        """
+        scratch = dispatch.Pangler()
+        scratch.subscribe(CallStub(), event="foo", needs=["x"])
+        scratch.subscribe(CallStub(), routing.Filter(prefix="!paste"),
+                          event="channelMessageReceived",
+                          needs=["channel", "message"])
+        scratch.subscribe(CallStub(), event="privateMessageReceived",
+                          needs=["identity"])
+        self.pangler.swap("plugin", scratch.hooks)
+
+        transport = StringTransport()
+        workers.WorkerProtocol(self.pangler).makeConnection(transport)
+        self.assertEqual(_frames(transport.value()), [
+            ["subscriptions", [["plugin", [
+                ["channelMessageReceived",
+                 ["user", "channel", "message"], "!paste"],
+                ["foo", ["x"], None],
+                ["privateMessageReceived",
+                 ["user", "channel", "message", "identity"], None],
+            ]]]],
+        ])
+
+
+    def test_onlyClientMethods(self):
+        client = workers._ClientProxy(None, 0)
+        self.assertRaises(AttributeError, getattr, client, "transport")
+
+
+    def test_hookErrorsLogged(self):
+        def broken(self, p, x):
+            raise RuntimeError()
+        self.pangler.subscribe(broken, event="foo", needs=["x"])
+        self._event(0, "foo", x=1)
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+
+
+class FakeProcessTransport(StringTransport):
+    def __init__(self):
+        StringTransport.__init__(self)
+        self.stdinClosed = False
+
+
+    def closeStdin(self):
+        self.stdinClosed = True
+
+
+
+class FakeReactor(task.Clock):
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.spawned = []
+
+
+    def spawnProcess(self, processProtocol, executable, args, env=None):
+        self.spawned.append((processProtocol, args))
+        processProtocol.makeConnection(FakeProcessTransport())
+
+
+
+class Client(object):
+    def __init__(self):
+        self.msg = CallStub()
+
+
+
+class Network(object):
+    def __init__(self):
+        self.client = Client()
+
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.abspath(self.mktemp())
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, "infobarbworkerplugin.py"),
+                  "w") as f:
+            f.write(PLUGIN)
+        sys.path.insert(0, self.path)
+        self.addCleanup(sys.path.remove, self.path)
+
+        self.reactor = FakeReactor()
+        self.p = dispatch.Pangler()
+        self.pool = workers.WorkerPool(self.p, ["infobarbworkerplugin"],
+                                       count=2, reactor=self.reactor)
+        self.pool.startService()
+        self.pool.workers[0].outReceived(
+            workers._frame(["subscriptions", SUBSCRIPTIONS]))
+
+
+    def _sent(self):
+        return [_frames(worker.transport.value())
+                for worker in self.pool.workers]
+
+
+    def test_spawned(self):
+        self.assertEqual(len(self.reactor.spawned), 2)
+        _, args = self.reactor.spawned[0]
+        self.assertEqual(args[1:], ["-m", "infobarb.workers",
+                                    "infobarbworkerplugin"])
+
+
+    def test_notImported(self):
+        """
+        Nothing is subscribed, and the plugins aren't imported, until a
+        worker says what they subscribe to.
+        """
+        p = dispatch.Pangler()
+        pool = workers.WorkerPool(p, ["infobarbworkerplugin"], count=1,
+                                  reactor=self.reactor)
+        pool.startService()
+        self.assertEqual(p.hooks, [])
+        self.assertNotIn("infobarbworkerplugin", sys.modules)
+
+        pool.workers[0].outReceived(
+            workers._frame(["subscriptions", SUBSCRIPTIONS]))
+        self.assertEqual([hook.owner for hook in p.hooks],
+                         ["infobarbworkerplugin"])
+
+
+    def test_twoPlugins(self):
+        """
+        Two plugins in the workers interested in the same event each get
+        their own frame, naming them.
+        """
+        self.pool.pluginNames.append("otherplugin")
+        self.pool.workers[0].outReceived(workers._frame(
+            ["subscriptions", SUBSCRIPTIONS + [["otherplugin",
+                                                SUBSCRIPTIONS[0][1]]]]))
+
+        self.p.share(Network()).trigger(
+            event="channelMessageReceived", user="lvh", channel="#python",
+            message="hi", identity=IDENTITY)
+
+        [sent] = [frames for frames in self._sent() if frames]
+        self.assertEqual([owner for _, _, owner, _, _, _ in sent],
+                         ["infobarbworkerplugin", "otherplugin"])
+
+
+    def test_subscribedOnce(self):
+        """
+        The same subscriptions from other workers don't change anything.
+        """
+        hooks = list(self.p.hooks)
+        self.pool.workers[1].outReceived(
+            workers._frame(["subscriptions", SUBSCRIPTIONS]))
+        self.assertEqual(self.p.hooks, hooks)
+
+
+    def test_prefixForwarded(self):
+        """
+        Messages that don't start with a prefix the plugin wants aren't
+        sent.
+        """
+        self.pool.workers[0].outReceived(workers._frame(
+            ["subscriptions", [["infobarbworkerplugin", [
+                ["channelMessageReceived",
+                 ["user", "channel", "message", "identity"], "!paste"],
+            ]]]]))
+
+        bound = self.p.share(Network())
+        for message in ["hi", "!paste x"]:
+            bound.trigger(event="channelMessageReceived", user="lvh",
+                          channel="#python", message=message,
+                          identity=IDENTITY)
+
+        [sent] = [frames for frames in self._sent() if frames]
+        self.assertEqual([args[2] for _, _, _, _, _, args in sent],
+                         ["!paste x"])
+
+
+    def test_forwarded(self):
+        """
+        Events for a channel all go to the same worker, in order.
+        """
+        network = Network()
+        bound = self.p.share(network)
+        for message in "abc":
+            bound.trigger(event="channelMessageReceived", user="lvh",
+                          channel="#python", message=message,
+                          identity=IDENTITY)
+
+        sent = [frames for frames in self._sent() if frames]
+        self.assertEqual(len(sent), 1)
+        self.assertEqual([args for _, _, _, _, _, args in sent[0]], [
+            ["#python", IDENTITY.asList(), message, "lvh"]
+            for message in "abc"])
+
+
+    def test_callsMadeOnClient(self):
+        network = Network()
+        bound = self.p.share(network)
+        bound.trigger(event="channelMessageReceived", user="lvh",
+                      channel="#python", message="hi", identity=IDENTITY)
+        [[[_, token, _, _, _, _]]] = [f for f in self._sent() if f]
+
+        self.pool.workers[0].outReceived(
+            workers._frame(["call", token, "msg", ["#python", "HI"]]))
+        self.assertEqual(network.client.msg.calledWith,
+                         (("#python", "HI"), {}))
+
+
+    def test_partialFrames(self):
+        network = Network()
+        self.pool._token(network)
+        data = workers._frame(["call", 0, "msg", ["#python", "HI"]])
+        self.pool.workers[0].outReceived(data[:3])
+        self.assertFalse(network.client.msg.called)
+        self.pool.workers[0].outReceived(data[3:])
+        self.assertTrue(network.client.msg.called)
+
+
+    def test_unknownCallsIgnored(self):
+        network = Network()
+        self.pool._token(network)
+        self.pool.workers[0].outReceived(
+            workers._frame(["call", 0, "quit", []]))
+        self.assertFalse(network.client.msg.called)
+
+
+    def test_restart(self):
+        worker = self.pool.workers[1]
+        worker.processEnded(failure.Failure(error.ProcessDone(0)))
+        self.assertEqual(len(self.reactor.spawned), 2)
+        self.reactor.advance(self.pool.restartDelay)
+        self.assertEqual(len(self.reactor.spawned), 3)
+        self.assertNotIdentical(self.pool.workers[1], worker)
+
+
+    def test_stopService(self):
+        transports = [worker.transport for worker in self.pool.workers]
+        self.pool.stopService()
+        self.assertTrue(all(t.stdinClosed for t in transports))
+        self.assertEqual(self.p.hooks, [])
+
+
+
+class WorkerProcessTestCase(unittest.TestCase):
+    """
+    Tests that run real worker processes.
+    """
+    def setUp(self):
+        self.path = os.path.abspath(self.mktemp())
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, "infobarbworkerplugin.py"),
+                  "w") as f:
+            f.write(PLUGIN)
+
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(workers.__file__))))
+        paths = [self.path, root, os.environ.get("PYTHONPATH", "")]
+        self.patch(os, "environ", dict(os.environ,
+                                       PYTHONPATH=os.pathsep.join(paths)))
+        sys.path.insert(0, self.path)
+        self.addCleanup(sys.path.remove, self.path)
+
+
+    def test_roundTrip(self):
+        p = dispatch.Pangler()
+        pool = workers.WorkerPool(p, ["infobarbworkerplugin"], count=2)
+        subscribed = defer.Deferred()
+        subscribe = pool._subscribe
+
+        def recordingSubscribe(pairs):
+            subscribe(pairs)
+            if not subscribed.called:
+                subscribed.callback(None)
+
+        self.patch(pool, "_subscribe", recordingSubscribe)
+        pool.startService()
+
+        d = defer.Deferred()
+        network = Network()
+        network.client.msg = lambda *args: d.callback(args)
+        subscribed.addCallback(
+            lambda _: p.share(network).trigger(
+                event="channelMessageReceived", user="lvh",
+                channel="#python", message="hi", identity=IDENTITY))
+
+        def stop(result):
+            ended = [defer.Deferred() for _ in pool.workers]
+            for worker, e in zip(pool.workers, ended):
+                worker.processEnded = lambda reason, e=e: e.callback(None)
+            pool.stopService()
+            return defer.gatherResults(ended).addCallback(lambda _: result)
+
+        d.addCallback(stop)
+        d.addCallback(self.assertEqual, ("#python", "HI"))
+        return d
+
+    test_roundTrip.timeout = 30
@@ -0,0 +1,216 @@
+"""
+Watching the reactor for stalls, and finding out what caused them.
+
+A ``LagWatchdog`` schedules a call every ``interval`` seconds, and measures
+how late each one runs. That lateness is the reactor's lag: how long
+everything else, like a hook taking its time, kept the reactor busy. Lag
+goes into a rolling histogram.
+
+While the reactor is stuck, a watchdog thread takes a sample of the reactor
+thread's stack, and works out which events were being dispatched and which
+hooks were running. Once the reactor gets going again, the stall is logged
+and fired as a ``reactorStalled`` event with ``ARGS``:
+
+ * ``lag``, in seconds;
+ * ``eventName`` and ``hook``, the innermost event and hook name that
+   were running, or None if the stall wasn't in a hook;
+ * ``chain``, ``[event, hook]`` pairs for every event being dispatched,
+   outermost first, since hooks can trigger events of their own;
+ * ``stack``, the formatted stack sample.
+"""
+import sys
+import threading
+import timeit
+import traceback
+
+from collections import deque
+
+from panglery.pangler import _Hook
+
+from twisted.application import service
+from twisted.python import log
+
+from infobarb import dispatch, stats
+
+
+ARGS = ("lag", "eventName", "hook", "chain", "stack")
+
+# Upper bounds of the histogram's buckets, in seconds. The last bucket has
+# everything slower.
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0,
+           5.0, 10.0)
+
+_RUN = dispatch.Pangler._run.__func__.__code__
+_FINISH = dispatch.Pangler.finish.__func__.__code__
+_EXECUTE = _Hook.execute.__func__.__code__
+
+
+def _running(frame):
+    """
+    Returns ``(event, hook)`` if a frame is dispatching an event, or None.
+    """
+    if frame.f_code is _RUN:
+        names = frame.f_locals
+        pangler, position = names.get("self"), names.get("position")
+        hook = None
+        if position is not None and position < len(pangler.hooks):
+            hook = stats.hookName(pangler.hooks[position].func)
+        return names.get("eventName"), hook
+    elif frame.f_code is _FINISH:
+        names = frame.f_locals
+        event, hook = names.get("event") or {}, names.get("hook")
+        return event.get("event"), hook and stats.hookName(hook.func)
+    elif frame.f_code is _EXECUTE:
+        names = frame.f_locals
+        event = names.get("event") or {}
+        return event.get("event"), stats.hookName(names["self"].func)
+    return None
+
+
+
+def sampleStack(threadId):
+    """
+    Samples a thread's stack.
+
+    Returns ``(chain, stack)``, where ``chain`` holds ``[event, hook]``
+    pairs for the events the thread is dispatching, outermost first, and
+    ``stack`` holds formatted stack lines. Returns None if there is no such
+    thread.
+    """
+    frame = sys._current_frames().get(threadId)
+    if frame is None:
+        return None
+
+    stack = traceback.format_stack(frame)
+    chain = []
+    while frame is not None:
+        running = _running(frame)
+        if running is not None:
+            chain.append(list(running))
+        frame = frame.f_back
+    chain.reverse()
+    return chain, stack
+
+
+
+class LagWatchdog(service.Service):
+    """
+    Measures reactor lag every ``interval`` seconds, and reports lag over
+    ``threshold`` seconds as a stall.
+
+    Stalls are fired through ``pangler``, if there is one, as it is: hooks
+    get whatever instance it is bound to, if any. The histogram covers the
+    last ``window`` measurements. Stack samples need a thread, which can be
+    switched off with ``sampleStacks``.
+    """
+    timer = staticmethod(timeit.default_timer)
+
+    def __init__(self, pangler=None, interval=0.1, threshold=0.5,
+                 window=3000, sampleStacks=True, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+
+        self.pangler = pangler
+        self.interval = interval
+        self.threshold = threshold
+        self.sampleStacks = sampleStacks
+
+        self.stalls = 0
+        self._recent = deque(maxlen=window)
+        self._counts = [0] * (len(BUCKETS) + 1)
+
+        self._call = None
+        self._beat = None
+        self._sample = None
+        self._thread = None
+        self._stopping = None
+
+
+    def startService(self):
+        service.Service.startService(self)
+        self._beat = self.timer()
+        self._call = self.reactor.callLater(self.interval, self._tick)
+
+        if self.sampleStacks:
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(
+                target=self._watch, name="infobarb lag watchdog",
+                args=(threading.current_thread().ident, self._stopping))
+            self._thread.daemon = True
+            self._thread.start()
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+
+    def _watch(self, threadId, stopping):
+        """
+        Samples the reactor thread's stack once per stall, from a thread.
+        """
+        sampledBeat = None
+        while not stopping.wait(self.interval):
+            beat = self._beat
+            if beat == sampledBeat:
+                continue
+
+            if self.timer() - beat - self.interval > self.threshold:
+                self._sample = sampleStack(threadId)
+                sampledBeat = beat
+
+
+    def _tick(self):
+        now = self.timer()
+        lag = max(now - self._beat - self.interval, 0.0)
+        sample, self._sample = self._sample, None
+
+        self._beat = now
+        self._call = self.reactor.callLater(self.interval, self._tick)
+
+        self._record(lag)
+        if lag > self.threshold:
+            self._stalled(lag, sample)
+
+
+    def _record(self, lag):
+        bucket = len(BUCKETS)
+        for i, bound in enumerate(BUCKETS):
+            if lag <= bound:
+                bucket = i
+                break
+
+        recent = self._recent
+        if len(recent) == recent.maxlen:
+            self._counts[recent[0]] -= 1
+        recent.append(bucket)
+        self._counts[bucket] += 1
+
+
+    def _stalled(self, lag, sample):
+        self.stalls += 1
+
+        chain, stack = sample if sample is not None else ([], [])
+        eventName, hook = chain[-1] if chain else (None, None)
+        log.msg("reactor stalled for %.3f seconds in %s on %s"
+                % (lag, hook, eventName))
+
+        if self.pangler is not None:
+            dispatch.firer(self.pangler)("reactorStalled", ARGS,
+                                         (lag, eventName, hook, chain, stack))
+
+
+    def histogram(self):
+        """
+        Returns ``(bound, count)`` pairs for recent lag measurements. The
+        last bound is None, for lag over the largest bucket.
+        """
+        return zip(BUCKETS + (None,), self._counts)
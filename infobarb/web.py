@@ -0,0 +1,239 @@
+"""
+A shared HTTP client for plugins that fetch URLs.
+
+URL titles, pastebins and documentation lookups all fetch pages in response
+to channel messages. Rather than each plugin opening connections of its
+own, a ``ConnectionManager`` has one ``HTTPService``, which every network
+has as ``http``, so hooks can use ``self.http.get(url)``.
+
+The service keeps connections open between requests, limits how many
+requests it makes to one host at once, fetches a URL only once while
+requests for it are in flight, and caches responses for as long as their
+``Cache-Control`` (or ``Expires``) header allows. Requests that take too
+long, headers and body together, are given up on, so a server that stalls
+can't hold on to a host's slots.
+"""
+import re
+import time
+
+from collections import OrderedDict, namedtuple
+from urlparse import urlsplit
+
+from twisted.application import service
+from twisted.internet import defer, protocol
+from twisted.python import failure
+from twisted.web import client, http
+from twisted.web.http_headers import Headers
+
+
+Response = namedtuple("Response", "url code headers body truncated")
+
+# Responses that can be cached without explicit freshness information, as
+# RFC 7231 has it.
+_HEURISTICALLY_CACHEABLE = frozenset([200, 203, 204, 300, 301, 404, 405,
+                                      410, 414, 501])
+
+_MAX_AGE = re.compile(r"(?:^|,)\s*max-age\s*=\s*\"?(\d+)\"?", re.I)
+
+
+def freshness(code, headers, default, now=None):
+    """
+    Returns how many seconds a response may be cached for, or None if it
+    mustn't be.
+
+    ``default`` applies to responses without ``Cache-Control`` or
+    ``Expires`` headers.
+    """
+    cacheControl = ",".join(headers.getRawHeaders("cache-control", []))
+    directives = cacheControl.lower()
+    if "no-store" in directives or "no-cache" in directives:
+        return None
+
+    match = _MAX_AGE.search(cacheControl)
+    if match is not None:
+        lifetime = int(match.group(1))
+    else:
+        expires = headers.getRawHeaders("expires", [None])[0]
+        if expires is not None:
+            if now is None:
+                now = time.time()
+            try:
+                lifetime = http.stringToDatetime(expires) - now
+            except ValueError:
+                # Invalid dates mean "already expired".
+                return None
+        elif code in _HEURISTICALLY_CACHEABLE:
+            lifetime = default
+        else:
+            return None
+
+    if lifetime <= 0:
+        return None
+    return lifetime
+
+
+
+class _BodyCollector(protocol.Protocol):
+    """
+    Collects up to ``maxSize`` bytes of a body, and drops the connection
+    once it has that much.
+    """
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.finished = defer.Deferred(self._cancel)
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+        self.cancelled = False
+
+
+    def _cancel(self, finished):
+        self.cancelled = True
+        self.transport.stopProducing()
+
+
+    def dataReceived(self, data):
+        if self.truncated:
+            return
+
+        remaining = self.maxSize - self.size
+        if len(data) > remaining:
+            self.parts.append(data[:remaining])
+            self.size = self.maxSize
+            self.truncated = True
+            self.transport.stopProducing()
+            return
+
+        self.parts.append(data)
+        self.size += len(data)
+
+
+    def connectionLost(self, reason):
+        if self.cancelled:
+            return
+        if self.truncated or reason.check(client.ResponseDone,
+                                          http.PotentialDataLoss):
+            self.finished.callback(self)
+        else:
+            self.finished.errback(reason)
+
+
+
+class HTTPService(service.Service):
+    """
+    Fetches URLs for plugins.
+
+    At most ``maxPerHost`` requests go to one host at once. Up to
+    ``cacheSize`` responses are cached; responses without caching headers
+    are cached for ``defaultLifetime`` seconds. Bodies are cut off after
+    ``maxBodySize`` bytes, which is plenty to find a page's title. Requests
+    fail with ``TimeoutError`` if they take longer than ``timeout`` seconds.
+    """
+    userAgent = "infobarb"
+
+    def __init__(self, maxPerHost=2, cacheSize=256, defaultLifetime=60,
+                 maxBodySize=1 << 20, connectTimeout=30, timeout=60,
+                 reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.clock = reactor
+
+        self.maxPerHost = maxPerHost
+        self.cacheSize = cacheSize
+        self.defaultLifetime = defaultLifetime
+        self.maxBodySize = maxBodySize
+        self.timeout = timeout
+
+        self.pool = client.HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = maxPerHost
+        self.agent = client.BrowserLikeRedirectAgent(
+            client.Agent(reactor, connectTimeout=connectTimeout,
+                         pool=self.pool))
+
+        # URL -> (response, when it expires), least recently used first.
+        self._cache = OrderedDict()
+        # URL -> Deferreds waiting for a request in flight.
+        self._waiting = {}
+        self._hosts = {}
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        return self.pool.closeCachedConnections()
+
+
+    def get(self, url):
+        """
+        Fetches a URL, following redirects.
+
+        Returns a Deferred that fires with a ``Response``, for any status
+        code, or fails if the URL couldn't be fetched.
+        """
+        cached = self._cache.pop(url, None)
+        if cached is not None and cached[1] > self.clock.seconds():
+            self._cache[url] = cached
+            return defer.succeed(cached[0])
+
+        d = defer.Deferred()
+        waiting = self._waiting.get(url)
+        if waiting is not None:
+            waiting.append(d)
+            return d
+
+        self._waiting[url] = [d]
+        host = urlsplit(url).netloc.lower()
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = defer.DeferredSemaphore(
+                self.maxPerHost)
+
+        fetched = semaphore.run(self._fetch, url)
+        fetched.addBoth(self._fetched, url, host, semaphore)
+        return d
+
+
+    def _fetch(self, url):
+        headers = Headers({"User-Agent": [self.userAgent]})
+        d = self.agent.request(b"GET", url, headers)
+
+        def readBody(response):
+            collector = _BodyCollector(self.maxBodySize)
+            response.deliverBody(collector)
+            return collector.finished.addCallback(
+                lambda collector: Response(url, response.code,
+                                           response.headers,
+                                           b"".join(collector.parts),
+                                           collector.truncated))
+
+        d.addCallback(readBody)
+        # Cancelling the request (or the body, once there is one) releases
+        # the host's slot.
+        return d.addTimeout(self.timeout, self.clock)
+
+
+    def _fetched(self, result, url, host, semaphore):
+        if not semaphore.waiting and semaphore.tokens == semaphore.limit:
+            self._hosts.pop(host, None)
+
+        if not isinstance(result, failure.Failure):
+            self._store(url, result)
+
+        for d in self._waiting.pop(url):
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+    def _store(self, url, response):
+        now = self.clock.seconds()
+        lifetime = freshness(response.code, response.headers,
+                             self.defaultLifetime, now)
+        if lifetime is None or self.cacheSize <= 0:
+            return
+
+        self._cache.pop(url, None)
+        self._cache[url] = response, now + lifetime
+        while len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
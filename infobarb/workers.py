@@ -0,0 +1,421 @@
+"""
+Running CPU-heavy plugins in worker processes.
+
+A ``WorkerPool`` starts a few Python processes that each load the same
+plugins. The plugins are never imported in the main process: each worker
+reports what its plugins subscribe to when it starts, and the pool
+subscribes forwarding hooks for those events on the main pangler. Events
+are sharded by channel (or by user, for events without one), so every event
+for a channel goes to the same worker, in order.
+
+Hooks in a worker see an instance with a ``client`` that has the usual
+methods for talking to IRC, like ``msg`` and ``scheduleMsg``. Calling them
+sends the call back to the main process, which makes it on the real client
+of the instance the event came from.
+
+Events and calls travel as frames: a 4-byte length in network order,
+followed by a list encoded the way ``infobarb.recording`` encodes values.
+Event frames name the plugin they are for, and only that plugin's hooks see
+them in the worker.
+Identities travel as lists, and are turned back into ``Identity`` objects
+in the worker.
+"""
+import os
+import struct
+import sys
+import zlib
+
+from twisted.application import service
+from twisted.internet import protocol
+from twisted.protocols import basic
+from twisted.python import log
+
+from infobarb import (
+    dispatch, identity, manifest, plugins, recording, routing)
+
+
+_LENGTH = struct.Struct("!I")
+
+# The client methods hooks in workers may call.
+CLIENT_METHODS = frozenset([
+    "msg", "notice", "describe", "scheduleMsg", "scheduleNotice",
+    "join", "leave", "kick", "topic", "mode",
+])
+
+
+def _frame(message):
+    body = recording.encode(message)
+    return _LENGTH.pack(len(body)) + body
+
+
+
+_CHANNEL_PREFIXES = "#&+!"
+
+
+def shard(eventName, event, count):
+    """
+    Picks the worker, out of ``count``, that gets an event.
+
+    Events for a channel go by channel. Others, like private messages, whose
+    ``channel`` is the bot's own nickname, go by the nickname of the user.
+    """
+    key = event.get("channel")
+    if not key or key[0] not in _CHANNEL_PREFIXES:
+        key = event.get("user")
+        if key:
+            key = key.split("!", 1)[0]
+        else:
+            key = eventName
+    if isinstance(key, type(u"")):
+        key = key.encode("utf-8")
+    return zlib.crc32(key.lower()) % count
+
+
+
+def subscriptions(pangler):
+    """
+    Describes what the plugins subscribed to a pangler want to see.
+
+    Returns ``[name, triples]`` pairs, one per plugin, where ``triples`` are
+    ``(eventName, argNames, prefix)`` triples like
+    ``infobarb.manifest.stubs`` makes. Hooks only interested in messages
+    starting with a literal get that literal as their prefix, so other
+    messages needn't be sent to the workers at all.
+    """
+    byOwner = {}
+    for hook in pangler.hooks:
+        owner = getattr(hook, "owner", None)
+        if owner is None:
+            continue
+
+        eventName = hook.conditions.get("event")
+        if eventName is None:
+            raise ValueError("%r has hooks for any event, so it can't run "
+                             "in a worker" % (owner,))
+
+        events = byOwner.setdefault(owner, {})
+        argNames, prefixes = events.get(eventName, (set(), set()))
+        argNames |= hook.needs - set(["event"])
+        routeFilter = getattr(hook, "routeFilter", None)
+        prefixes.add(routeFilter.prefix if routeFilter is not None else None)
+        events[eventName] = argNames, prefixes
+
+    pairs = []
+    for owner, events in sorted(byOwner.items()):
+        triples = []
+        for eventName, (argNames, prefixes) in sorted(events.items()):
+            allArgs = manifest.eventArgs(eventName, argNames)
+            if allArgs is None:
+                allArgs = sorted(argNames)
+
+            if None in prefixes:
+                prefixes = [None]
+            else:
+                # A hook for "!a" sees everything one for "!ab" does.
+                prefixes = [prefix for prefix in sorted(prefixes)
+                            if not any(prefix != other
+                                       and prefix.startswith(other)
+                                       for other in prefixes)]
+
+            for prefix in prefixes:
+                triples.append([eventName, list(allArgs), prefix])
+        pairs.append([owner, triples])
+    return pairs
+
+
+
+class _ClientProxy(object):
+    """
+    Stands in for a client in a worker, sending calls to the main process.
+    """
+    def __init__(self, send, token):
+        self._send = send
+        self._token = token
+
+
+    def __getattr__(self, name):
+        if name not in CLIENT_METHODS:
+            raise AttributeError(name)
+
+        def call(*args):
+            self._send(["call", self._token, name, list(args)])
+
+        return call
+
+
+
+class _WorkerInstance(object):
+    def __init__(self, client):
+        self.client = client
+
+
+
+class WorkerProtocol(basic.Int32StringReceiver):
+    """
+    The worker's end: fires events from the main process through a pangler
+    with the plugins subscribed, and sends client calls back.
+
+    Each main process instance gets a pangler of its own, sharing the
+    plugins' hooks, bound to a stand-in instance. The plugins' subscriptions
+    are sent once the connection is made.
+    """
+    MAX_LENGTH = 16 * 1024 * 1024
+
+    def __init__(self, pangler):
+        self.pangler = pangler
+        self._bound = {}
+
+
+    def connectionMade(self):
+        self._send(["subscriptions", subscriptions(self.pangler)])
+
+
+    def _send(self, message):
+        self.sendString(recording.encode(message))
+
+
+    def _panglerFor(self, token):
+        p = self._bound.get(token)
+        if p is None:
+            instance = _WorkerInstance(_ClientProxy(self._send, token))
+            p = self._bound[token] = self.pangler.share(instance)
+        return p
+
+
+    def stringReceived(self, data):
+        kind, token, owner, eventName, argNames, args = recording.decode(data)
+        if "identity" in argNames:
+            i = argNames.index("identity")
+            args[i] = identity.Identity.fromList(args[i])
+
+        try:
+            self._panglerFor(token).fireOnly(owner, eventName,
+                                             tuple(argNames), tuple(args))
+        except Exception:
+            log.err(None, "Error dispatching %r in a worker" % (eventName,))
+
+
+    def connectionLost(self, reason):
+        from twisted.internet import reactor
+        if reactor.running:
+            reactor.stop()
+
+
+
+class _WorkerProcess(protocol.ProcessProtocol):
+    """
+    The main process's end of one worker.
+    """
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self._buffer = b""
+
+
+    def send(self, message):
+        if self.transport is not None:
+            self.transport.write(_frame(message))
+
+
+    def outReceived(self, data):
+        self._buffer += data
+        while len(self._buffer) >= _LENGTH.size:
+            length, = _LENGTH.unpack_from(self._buffer)
+            end = _LENGTH.size + length
+            if len(self._buffer) < end:
+                break
+
+            body = self._buffer[_LENGTH.size:end]
+            self._buffer = self._buffer[end:]
+            self.pool._messageReceived(recording.decode(body))
+
+
+    def errReceived(self, data):
+        for line in data.splitlines():
+            log.msg("worker %d: %s" % (self.index, line))
+
+
+    def processEnded(self, reason):
+        self.transport = None
+        self.pool._workerEnded(self, reason)
+
+
+
+class WorkerPool(service.Service):
+    """
+    Runs some plugins in ``count`` worker processes.
+
+    ``pangler`` is the main process's compiled pangler, usually the one all
+    networks share. The forwarding hooks are owned by each plugin's name, so
+    they can be swapped out like any other plugin's hooks, and are only
+    subscribed once a worker has reported the plugins' subscriptions. Workers
+    that die while the pool is running are started again after
+    ``restartDelay`` seconds; events for them are dropped in the meantime.
+    """
+    restartDelay = 1.0
+
+    def __init__(self, pangler, pluginNames, count=None, reactor=None,
+                 executable=sys.executable):
+        if count is None:
+            count = _cpuCount()
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.pangler = pangler
+        self.pluginNames = list(pluginNames)
+        self.count = count
+        self.reactor = reactor
+        self.executable = executable
+
+        self.workers = [None] * count
+        self._instances = {}
+        self._tokens = {}
+        self._subscriptions = {}
+
+
+    def startService(self):
+        service.Service.startService(self)
+        for index in range(self.count):
+            self._spawn(index)
+
+
+    def _subscribe(self, pairs):
+        """
+        Subscribes forwarding hooks for the subscriptions a worker reported,
+        unless they are already subscribed.
+        """
+        for name, triples in pairs:
+            if name not in self.pluginNames:
+                log.msg("ignoring subscriptions for %r from a worker"
+                        % (name,))
+                continue
+
+            triples = [tuple(triple) for triple in triples]
+            if self._subscriptions.get(name) == triples:
+                continue
+            self._subscriptions[name] = triples
+
+            scratch = dispatch.Pangler()
+            for eventName, argNames, prefix in triples:
+                routeFilter = None
+                if prefix is not None:
+                    routeFilter = routing.Filter(prefix=prefix)
+                scratch.subscribe(self._forwarder(name), routeFilter,
+                                  event=eventName,
+                                  needs=list(argNames) + ["event"])
+            self.pangler.swap(name, scratch.hooks)
+
+
+    def stopService(self):
+        service.Service.stopService(self)
+        self._subscriptions.clear()
+        for name in self.pluginNames:
+            self.pangler.swap(name, [])
+        for worker in self.workers:
+            if worker is not None and worker.transport is not None:
+                worker.transport.closeStdin()
+
+
+    def _spawn(self, index):
+        worker = self.workers[index] = _WorkerProcess(self, index)
+        args = [self.executable, "-m", "infobarb.workers"] + self.pluginNames
+        self.reactor.spawnProcess(worker, self.executable, args,
+                                  env=os.environ)
+
+
+    def _workerEnded(self, worker, reason):
+        if self.running and self.workers[worker.index] is worker:
+            log.msg("worker %d ended (%s), restarting"
+                    % (worker.index, reason.getErrorMessage()))
+            self.reactor.callLater(self.restartDelay, self._restart,
+                                   worker.index)
+
+
+    def _restart(self, index):
+        if self.running:
+            self._spawn(index)
+
+
+    def _token(self, instance):
+        token = self._tokens.get(id(instance))
+        if token is None:
+            token = self._tokens[id(instance)] = len(self._instances)
+            self._instances[token] = instance
+        return token
+
+
+    def _forwarder(self, owner):
+        """
+        Makes a hook forwarding events to a plugin in the workers. Only that
+        plugin's hooks see them there, so plugins interested in the same
+        event each get it once.
+        """
+        def forward(*prefix, **event):
+            instance = prefix[0] if len(prefix) == 2 else None
+            eventName = event.pop("event")
+            argNames = sorted(event)
+            if "identity" in event:
+                event["identity"] = event["identity"].asList()
+
+            index = shard(eventName, event, self.count)
+            self.workers[index].send(["event", self._token(instance), owner,
+                                      eventName, argNames,
+                                      [event[n] for n in argNames]])
+
+        return forward
+
+
+    def _messageReceived(self, message):
+        if message[0] == "subscriptions":
+            if self.running:
+                self._subscribe(message[1])
+            return
+
+        kind, token, name, args = message
+        if kind != "call" or name not in CLIENT_METHODS:
+            log.msg("ignoring %r from a worker" % (message,))
+            return
+
+        instance = self._instances.get(token)
+        client = getattr(instance, "client", None)
+        if client is None:
+            log.msg("dropping %s from a worker: not connected" % (name,))
+            return
+        getattr(client, name)(*args)
+
+
+
+def _cpuCount():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+
+def main(argv=None):
+    """
+    Runs a worker, with the plugins named on the command line, on stdio.
+    """
+    from twisted.internet import reactor, stdio
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    # Frames go to stdout, so nothing else may.
+    log.startLogging(sys.stderr, setStdout=False)
+    sys.stdout = sys.stderr
+
+    pangler = dispatch.Pangler()
+    manager = plugins.PluginManager(pangler)
+    for name in argv:
+        manager.load(name)
+
+    stdio.StandardIO(WorkerProtocol(pangler))
+    reactor.run()
+
+
+
+if __name__ == "__main__":
+    main()